@@ -384,7 +384,7 @@ def _run():
   else:
     # ignore python warnings if not in debug mode
     warnings.simplefilter('ignore')
-  if not ('-scp' in sys.argv or '-ipdrop' in sys.argv):
+  if not ('-scp' in sys.argv or '-ipdrop' in sys.argv or '-export' in sys.argv):
     initialize_gui_toolkit()
   active_session=initialize(sys.argv[1:])
   if active_session is None or active_session.use_gui: # start a new gui session
@@ -393,6 +393,8 @@ def _run():
   else: # in command line mode, just plot the selected data.
     if '-ipdrop' in sys.argv:
       ipdrop(active_session)
+    elif active_session.export_naming is not None:
+      active_session.export_all(active_session.export_naming, workers=active_session.export_workers)
     else:
       active_session.plot_all()
   # delete temporal files and folders after the program ended
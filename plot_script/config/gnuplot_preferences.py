@@ -112,6 +112,20 @@ set_output_terminal_gui='x11 enhanced' # fallback if terminal was not selected
 # set output file name, the postfix has to be chosen consistant to the 'set term' statement
 output_file_name='[name]_[add_info][nr].png'
 #output_file_name='[name]_[nr].ps'
+# export column data as binary records for plotting, text files are only
+# written when storing a gnuplot script together with its data
+binary_export=True
+# maximal size of rendered images kept in memory by the GUI to be reused
+# when the same plot is shown again
+RENDER_CACHE_SIZE=64*1024**2 # 64 MiB
+# number of previous/next datasets rendered in the background when
+# moving through the plots
+PREFETCH_NEIGHBOURS=1
+# number of gnuplot processes used for rendering, None uses the number of
+# processors (maximal 4)
+GNUPLOT_WORKERS=None
+# time in seconds after which a gnuplot process, that did not finish a plot, is restarted
+RENDER_TIMEOUT=60.
 
 # labels for x,y and z axis
 x_label='[x-dim] [[x-unit]]'
@@ -0,0 +1,22 @@
+# -*- encoding: utf-8 -*-
+'''
+ Settings of the cache for imported data files.
+'''
+
+__author__="Artur Glavic"
+__credits__=[]
+from plot_script.plotpy_info import __copyright__, __license__, __version__, __maintainer__, __email__ #@UnusedImport
+__status__="Production"
+
+import os
+from plot_script.config import config_path
+
+# Folder for the cached data, can be shared by several users.
+CACHE_DIR=os.path.join(config_path, 'import_cache')
+# Maximal number of bytes of all cached files,
+# the least recently used files are removed when exceeded.
+CACHE_SIZE=2*1024**3 # 2 GiB
+# Identify files by a hash of their content, so the same data is found even
+# when the file is copied or touched. Otherwise the path, size and
+# modification time of the file are used, which is faster for huge files.
+HASH_CONTENT=True
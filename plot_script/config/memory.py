@@ -0,0 +1,15 @@
+# -*- encoding: utf-8 -*-
+'''
+ Settings for the memory management of the data structures.
+'''
+
+__author__="Artur Glavic"
+__credits__=[]
+from plot_script.plotpy_info import __copyright__, __license__, __version__, __maintainer__, __email__ #@UnusedImport
+__status__="Production"
+
+# Maximal number of bytes of data arrays kept in memory by one spill manager,
+# the least recently used arrays are moved to temporary files when exceeded.
+SPILL_LIMIT=1024**3 # 1 GiB
+# Folder for the spilled arrays, None uses the session temporary directory.
+SPILL_DIR=None
@@ -1,6 +1,6 @@
 # -*- encoding: utf-8 -*-
 '''
- Settings used for parallel computing with the IPython cluster interface.
+ Settings used for parallel computing with local worker processes or the IPython cluster interface.
 '''
 
 __author__="Artur Glavic"
@@ -10,6 +10,12 @@ __status__="Production"
 
 import os
 
+# number of local worker processes, None uses one process per CPU
+WORKERS=None
+# connect to an IPython cluster instead of starting local worker processes
+USE_IPCLUSTER=False
+# folder for arrays shared with the worker processes, should be a RAM disk
+SHARED_MEMORY_DIR='/dev/shm'
 
 # keyword arguments of the Client function call
 CLIENT_KW=dict(
@@ -33,6 +33,9 @@ DATA_COLUMNS={
 # how to call the fit-script
 FIT_SCRIPT_COMMAND='fit-script'
 
+# simulate and fit with the numpy implementation of the fortran program,
+# the fortran program is only compiled if this is False
+NATIVE_SIMULATION=True
 # compiler settings for fortran
 FORTRAN_COMPILER='gfortran'
 # compiler optimization options as can be found in the manual,
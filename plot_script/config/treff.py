@@ -51,6 +51,9 @@ D17_MASK=None #((numpy.zeros((64, 256))+1).transpose()*numpy.where((numpy.arange
               #     (numpy.arange(0, 256)<=D17_MASK_BOUNDS_X[1]), 1., 0.)
 D17_PIXEL_SIZE=0.02225 # °
 D17_CENTER_OFFSET=0.18846#0.225 # °
+# simulate and fit with the numpy implementation of the fortran program,
+# the fortran program is only compiled if this is False
+NATIVE_SIMULATION=True
 # compiler settings for fortran
 FORTRAN_COMPILER='gfortran'
 # compiler optimization options as can be found in the manual,
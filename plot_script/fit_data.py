@@ -9,10 +9,11 @@
 import sys
 import numpy
 from copy import deepcopy
+from cPickle import dumps, loads
 from mpfit import mpfit
 from math import pi, sin, asin, exp
 # import own modules
-from measurement_data_structure import MeasurementData, PlotOptions
+from measurement_data_structure import MeasurementData, PhysicalProperty, PlotOptions
 # import gui functions for active config.gui.toolkit
 from plot_script.config import gui as gui_config
 import parallel
@@ -128,11 +129,15 @@ class FitFunction(FitFunctionGUI):
   parameters_history=None
   parameters_covariance=None
   fit_function=lambda self, p, x: 0.
+  # analytic derivatives of the function, fit_jacobian(p, x) returns an array
+  # with the derivative for every parameter in p as columns
+  fit_jacobian=None
   fit_function_text='f(x)'
   last_fit_output=None
   x_from=None
   x_to=None
   is_3d=False
+  _refine_indices=None
   fit_logarithmic=False
   constrains=None
   max_iter=200. # maximum numer of iterations for fitting (should be lowered for slow functions)
@@ -170,17 +175,9 @@ class FitFunction(FitFunctionGUI):
       
       :return: Residuals (meaning the value to be minimized) of the fit function and the measured data
     '''
-    # function is called len(x) times, this is just to speed up the lookup procedure
     function=self.fit_function
-    function_parameters=[]
-    for i in range(len(self.parameters)):
-      if i in self.refine_parameters:
-        function_parameters.append(params[self.refine_parameters.index(i)])
-      else:
-        function_parameters.append(self.parameters[i])
-    # in some circumstances a single parameter can lead to one entry arrays as paramter, so we fix this
-    function_parameters=map(numpy.float64, function_parameters)
-    if yerror==None: # is error list given?
+    function_parameters=self._full_parameters(params)
+    if yerror is None: # is error list given?
       err=function(function_parameters, x)-y
     else:
       err=(function(function_parameters, x)-y)/yerror
@@ -200,14 +197,8 @@ class FitFunction(FitFunctionGUI):
       
       :return: Residuals (meaning the value to be minimized) of the fit function and the measured data
     '''
-    # function is called len(x) times, this is just to speed up the lookup procedure
     function=self.fit_function
-    function_parameters=[]
-    for i in range(len(self.parameters)):
-      if i in self.refine_parameters:
-        function_parameters.append(params[self.refine_parameters.index(i)])
-      else:
-        function_parameters.append(self.parameters[i])
+    function_parameters=self._full_parameters(params)
     remove_negative=numpy.where(y>0.)
     x=numpy.array(x[remove_negative], dtype=numpy.float64, copy=False)
     y=numpy.array(y[remove_negative], dtype=numpy.float64, copy=False)
@@ -221,6 +212,63 @@ class FitFunction(FitFunctionGUI):
       err=numpy.log10(function(function_parameters, x))-numpy.log10(y)
     return err
 
+  def residuals_jacobian(self, params, y, x, yerror=None):
+    '''
+      Derivatives of the residuals with respect to the refined parameters
+      calculated from the analytic fit_jacobian.
+      
+      :return: Array with one column for each refined parameter
+    '''
+    function_parameters=self._full_parameters(params)
+    jacobian=self.fit_jacobian(function_parameters, x)[:, self._get_refine_indices()]
+    if yerror is not None:
+      jacobian/=yerror[:, numpy.newaxis]
+    return jacobian
+
+  def residuals_log_jacobian(self, params, y, x, yerror=None):
+    '''
+      Derivatives of the logarithmic residuals with respect to the refined parameters
+      calculated from the analytic fit_jacobian.
+      
+      :return: Array with one column for each refined parameter
+    '''
+    function_parameters=self._full_parameters(params)
+    remove_negative=numpy.where(y>0.)
+    x=numpy.array(x[remove_negative], dtype=numpy.float64, copy=False)
+    y=numpy.array(y[remove_negative], dtype=numpy.float64, copy=False)
+    jacobian=self.fit_jacobian(function_parameters, x)[:, self._get_refine_indices()]
+    # d log10(f)/dp = df/dp / (f·ln(10))
+    jacobian/=(self.fit_function(function_parameters, x)*numpy.log(10.))[:, numpy.newaxis]
+    if yerror is not None:
+      yerror=numpy.array(yerror[remove_negative], dtype=numpy.float64, copy=False)
+      yerror=numpy.where((numpy.isinf(yerror))+(numpy.isnan(yerror))+(yerror<=0.), 1., yerror)
+      propagated_error=yerror/y
+      jacobian/=propagated_error[:, numpy.newaxis]
+    return jacobian
+
+  def has_jacobian(self):
+    '''
+      Return if the function defines analytic derivatives.
+    '''
+    return self.fit_jacobian is not None
+
+  def _get_refine_indices(self):
+    '''
+      Indices of the refined parameters, precomputed during a refinement.
+    '''
+    if self._refine_indices is None:
+      return numpy.array(self.refine_parameters, dtype=int)
+    return self._refine_indices
+
+  def _full_parameters(self, params):
+    '''
+      Combine the refined parameters with the fixed ones.
+    '''
+    function_parameters=numpy.array(self.parameters, dtype=numpy.float64)
+    # in some circumstances a single parameter can lead to one entry arrays as paramter, so we fix this
+    function_parameters[self._get_refine_indices()]=numpy.hstack(params)
+    return list(function_parameters)
+
   def refine(self, dataset_x, dataset_y, dataset_yerror=None, progress_bar_update=None):
     '''
       Do the least square refinement to the given dataset. If the fit converges
@@ -277,8 +325,25 @@ class FitFunction(FitFunctionGUI):
       progress_bar_update can be an optional function, which is called after each iteration.
     '''
     constrains=self.constrains
-    def function(p, fjac=None, x=None, y=None, dy=None):
-      return [0, residuals(p, y, x, dy)]
+    self._refine_indices=numpy.array(self.refine_parameters, dtype=int)
+    jacobian=None
+    if self.has_jacobian() and parallel.dview is None and (constrains is None or
+                            not any(['tied' in item for item in constrains.values()])):
+      if residuals==self.residuals:
+        jacobian=self.residuals_jacobian
+      elif residuals==self.residuals_log:
+        jacobian=self.residuals_log_jacobian
+    if jacobian is None:
+      autoderivative=1
+      def function(p, fjac=None, x=None, y=None, dy=None):
+        return [0, residuals(p, y, x, dy)]
+    else:
+      autoderivative=0
+      def function(p, fjac=None, x=None, y=None, dy=None):
+        if fjac is None:
+          return [0, residuals(p, y, x, dy)]
+        # mpfit uses the derivatives of the model in the form (y-model)/dy
+        return [0, residuals(p, y, x, dy),-jacobian(p, y, x, dy)]
     function_keywords={'x':x, 'y': y, 'dy': dy}
     # define constrains
     if constrains is None:
@@ -351,12 +416,14 @@ class FitFunction(FitFunctionGUI):
       result=mpfit(function, xall=parameters, functkw=function_keywords,
                   parinfo=parinfo,
                   maxiter=self.max_iter, iterfunct=iterfunct,
+                  autoderivative=autoderivative,
                   quiet=1
                   )
     except Exception, error:
       result=None
     finally:
       sys.stdout, sys.stderr=old_std
+      self._refine_indices=None
     if result is None:
       raise error
     # evaluate the fit result
@@ -583,6 +650,17 @@ class FitSum(FitFunction):
     len1, ignore=self.func_len
     return func1(p[0:len1], x)+func2(p[len1:], x)
 
+  def has_jacobian(self):
+    return self.origin[0].has_jacobian() and self.origin[1].has_jacobian()
+
+  def fit_jacobian(self, p, x):
+    '''
+      Combine the derivatives of both functions.
+    '''
+    len1, ignore=self.func_len
+    return numpy.hstack([self.origin[0].fit_jacobian(p[0:len1], x),
+                         self.origin[1].fit_jacobian(p[len1:], x)])
+
   def set_parameters(self, new_params):
     '''
       Set new parameters and pass them to origin functions.
@@ -645,6 +723,20 @@ class FitMultiply(FitFunction):
     len1, ignore=self.func_len
     return func1(p[0:len1], x)*func2(p[len1:], x)
 
+  def has_jacobian(self):
+    return self.origin[0].has_jacobian() and self.origin[1].has_jacobian()
+
+  def fit_jacobian(self, p, x):
+    '''
+      Combine the derivatives of both functions using the product rule.
+    '''
+    func1, func2=self.origin
+    len1, ignore=self.func_len
+    f1=func1.fit_function(p[0:len1], x)*numpy.ones_like(x)
+    f2=func2.fit_function(p[len1:], x)*numpy.ones_like(x)
+    return numpy.hstack([func1.fit_jacobian(p[0:len1], x)*f2[:, numpy.newaxis],
+                         func2.fit_jacobian(p[len1:], x)*f1[:, numpy.newaxis]])
+
   def set_parameters(self, new_params):
     '''
       Set new parameters and pass them to origin functions.
@@ -740,6 +832,7 @@ class FitFunction3D(FitFunctionGUI):
   is_3d=True
   fit_logarithmic=False
   constrains=None
+  _refine_indices=None
   max_iter=200. # maximum numer of iterations for fitting (should be lowered for slow functions)
 
   def __init__(self, initial_parameters):
@@ -776,14 +869,8 @@ class FitFunction3D(FitFunctionGUI):
       
       :return: Residuals (meaning the value to be minimized) of the fit function and the measured data
     '''
-    # function is called len(x) times, this is just to speed up the lookup procedure
     function=self.fit_function
-    function_parameters=[]
-    for i in range(len(self.parameters)):
-      if i in self.refine_parameters:
-        function_parameters.append(params[self.refine_parameters.index(i)])
-      else:
-        function_parameters.append(self.parameters[i])
+    function_parameters=self._full_parameters(params)
     if zerror is None: # is error list given?
       err=function(function_parameters, x, y)-z
     else:
@@ -804,14 +891,8 @@ class FitFunction3D(FitFunctionGUI):
       
       :return: Residuals (meaning the value to be minimized) of the fit function and the measured data
     '''
-    # function is called len(x) times, this is just to speed up the lookup procedure
     function=self.fit_function
-    function_parameters=[]
-    for i in range(len(self.parameters)):
-      if i in self.refine_parameters:
-        function_parameters.append(params[self.refine_parameters.index(i)])
-      else:
-        function_parameters.append(self.parameters[i])
+    function_parameters=self._full_parameters(params)
     remove_negative=numpy.where(z>0.)
     x=x[remove_negative]
     y=y[remove_negative]
@@ -826,6 +907,22 @@ class FitFunction3D(FitFunctionGUI):
       err=numpy.log10(function(function_parameters, x, y))-numpy.log10(z)
     return err
 
+  def _get_refine_indices(self):
+    '''
+      Indices of the refined parameters, precomputed during a refinement.
+    '''
+    if self._refine_indices is None:
+      return numpy.array(self.refine_parameters, dtype=int)
+    return self._refine_indices
+
+  def _full_parameters(self, params):
+    '''
+      Combine the refined parameters with the fixed ones.
+    '''
+    function_parameters=numpy.array(self.parameters, dtype=numpy.float64)
+    function_parameters[self._get_refine_indices()]=numpy.hstack(params)
+    return list(function_parameters)
+
   def refine(self, dataset_x, dataset_y, dataset_z, dataset_zerror=None, progress_bar_update=None):
     '''
       Do the least square refinement to the given dataset. If the fit converges
@@ -894,6 +991,7 @@ class FitFunction3D(FitFunctionGUI):
       The constrains can be boundaries, equalitiy and inequality fuctions.
     '''
     constrains=self.constrains
+    self._refine_indices=numpy.array(self.refine_parameters, dtype=int)
     def function(p, fjac=None, x=None, y=None, z=None, dz=None):
       return [0, residuals(p, z, y, x, dz)]
     function_keywords={'x':x, 'y': y, 'z':z, 'dz': dz}
@@ -955,11 +1053,14 @@ class FitFunction3D(FitFunctionGUI):
           dview.execute('err=self.residuals(p,z,y,x,dz)')
           return [0, dview.gather('err')]
     # call the fit routine
-    result=mpfit(function, xall=parameters, functkw=function_keywords,
-                 parinfo=parinfo,
-                 maxiter=self.max_iter, iterfunct=iterfunct,
-                 quiet=1
-                 )
+    try:
+      result=mpfit(function, xall=parameters, functkw=function_keywords,
+                   parinfo=parinfo,
+                   maxiter=self.max_iter, iterfunct=iterfunct,
+                   quiet=1
+                   )
+    finally:
+      self._refine_indices=None
     if result.status==-1:
       result.status=5
     self.last_fit_output=result
@@ -1245,6 +1346,10 @@ class FitLinear(FitFunction):
   fit_function=lambda self, p, x: p[0]*numpy.array(x)+p[1]
   fit_function_text='[a]·x + [b]'
 
+  def fit_jacobian(self, p, x):
+    x=numpy.array(x, dtype=numpy.float64)
+    return numpy.array([x, numpy.ones_like(x)]).transpose()
+
 class ThetaCorrection(FitFunction):
   '''
     Fit a function to peak positions to get a reciprocal lattice parameter and Θ-offset.
@@ -1319,6 +1424,10 @@ class FitQuadratic(FitFunction):
   fit_function=lambda self, p, x: p[0]*numpy.array(x)**2+p[1]*numpy.array(x)+p[2]
   fit_function_text='[a]·x^2 + [b]·x + [c]'
 
+  def fit_jacobian(self, p, x):
+    x=numpy.array(x, dtype=numpy.float64)
+    return numpy.array([x**2, x, numpy.ones_like(x)]).transpose()
+
 class FitPowerlaw(FitFunction):
   '''
     Fit a powerlaw function.
@@ -1340,6 +1449,14 @@ class FitPowerlaw(FitFunction):
 
   def fit_function(self, p, x):
     return p[0]*(x-p[1])**p[2]+p[3]
+
+  def fit_jacobian(self, p, x):
+    x=numpy.array(x, dtype=numpy.float64)
+    power=(x-p[1])**p[2]
+    return numpy.array([power,
+                        -p[0]*p[2]*(x-p[1])**(p[2]-1.),
+                        p[0]*power*numpy.log(x-p[1]),
+                        numpy.ones_like(x)]).transpose()
 FitPolynomialPowerlaw=FitPowerlaw
 
 class FitSinus(FitFunction):
@@ -1384,6 +1501,11 @@ class FitExponential(FitFunction):
   fit_function=lambda self, p, x: p[0]*numpy.exp(p[1]*numpy.array(x))+p[2]
   fit_function_text='[A]·exp([B]·x) + [C]'
 
+  def fit_jacobian(self, p, x):
+    x=numpy.array(x, dtype=numpy.float64)
+    exp_x=numpy.exp(p[1]*x)
+    return numpy.array([exp_x, p[0]*x*exp_x, numpy.ones_like(x)]).transpose()
+
 class FitOneOverX(FitFunction):
   '''
     Fit a one over x function.
@@ -1401,6 +1523,10 @@ class FitOneOverX(FitFunction):
   fit_function=lambda self, p, x: p[0]*1/(numpy.array(x)-p[1])+p[2]
   fit_function_text='[C]/(x-[x0|2]) + [D]'
 
+  def fit_jacobian(self, p, x):
+    inverse=1./(numpy.array(x, dtype=numpy.float64)-p[1])
+    return numpy.array([inverse, p[0]*inverse**2, numpy.ones_like(inverse)]).transpose()
+
 class FitGaussian(FitFunction):
   '''
     Fit a gaussian function.
@@ -1417,6 +1543,14 @@ class FitGaussian(FitFunction):
   fit_function=lambda self, p, x: p[0]*numpy.exp(-0.5*((x-p[1])/p[2])**2)+p[3]
   fit_function_text='Gaussian: I=[I] x_0=[x0] σ=[σ|2]'
 
+  def fit_jacobian(self, p, x):
+    u=(numpy.array(x, dtype=numpy.float64)-p[1])/p[2]
+    gauss=numpy.exp(-0.5*u**2)
+    return numpy.array([gauss,
+                        p[0]*gauss*u/p[2],
+                        p[0]*gauss*u**2/p[2],
+                        numpy.ones_like(u)]).transpose()
+
 class FitLogNormal(FitFunction):
   '''
     Fit a log-normal distribution.
@@ -1449,6 +1583,14 @@ class FitLorentzian(FitFunction):
   fit_function=lambda self, p, x: p[0]/(1+((numpy.array(x)-p[1])/p[2])**2)+p[3]
   fit_function_text='Lorentzian: I=[I] x_0=[x0] γ=[γ|2]'
 
+  def fit_jacobian(self, p, x):
+    u=(numpy.array(x, dtype=numpy.float64)-p[1])/p[2]
+    lorentz=1./(1.+u**2)
+    return numpy.array([lorentz,
+                        2.*p[0]*u*lorentz**2/p[2],
+                        2.*p[0]*u**2*lorentz**2/p[2],
+                        numpy.ones_like(u)]).transpose()
+
 class FitLorentzianAsymmetric(FitFunction):
   '''
     Fit a asymmetric lorentz function.
@@ -1562,6 +1704,34 @@ class FitVoigt(FitFunction):
     value=p[0]*wofz(z).real/wofz(z0).real+p[4]
     return value
 
+  def fit_jacobian(self, p, x):
+    '''
+      Derivatives of the Voigt profile using w'(z)=-2z·w(z)+2i/sqrt(π).
+    '''
+    from scipy.special import wofz
+    x=numpy.float64(numpy.array(x))
+    p=numpy.float64(numpy.array(p))
+    scale=1./abs(p[3])/self.sqrt2
+    z=(x-p[1]+(abs(p[2])*1j))*scale
+    z0=(abs(p[2])*1j)*scale
+    w=wofz(z)
+    w0=wofz(z0)
+    dw=-2.*z*w+2j/numpy.sqrt(numpy.pi)
+    dw0=-2.*z0*w0+2j/numpy.sqrt(numpy.pi)
+    R=w.real
+    R0=w0.real
+    # derivatives of z and z0 for x0, γ and σ
+    dR_dx0=(dw*(-scale)).real
+    dR_dgamma=(dw*(1j*numpy.sign(p[2])*scale)).real
+    dR0_dgamma=(dw0*(1j*numpy.sign(p[2])*scale)).real
+    dR_dsigma=(dw*(-z*numpy.sign(p[3])/abs(p[3]))).real
+    dR0_dsigma=(dw0*(-z0*numpy.sign(p[3])/abs(p[3]))).real
+    return numpy.array([R/R0,
+                        p[0]*dR_dx0/R0,
+                        p[0]*(dR_dgamma*R0-R*dR0_dgamma)/R0**2,
+                        p[0]*(dR_dsigma*R0-R*dR0_dsigma)/R0**2,
+                        numpy.ones_like(x)]).transpose()
+
 class FitOffspecular(FitFunction):
   '''
     Fit the offspecular diffuse scattering from roughness.
@@ -2498,6 +2668,29 @@ def B_J(p, x):
   coth=lambda x: 1./numpy.tanh(x)
   return numpy.nan_to_num((2.*J+1.)/(2.*J)*coth((2.*J+1.)/(2.*J)*x)-1./(2.*J)*coth(1./(2.*J)*x))
 
+def B_J_derivatives(p, x):
+  '''
+    Derivatives of the Brillouine function, x·dB_J/dx and the partial derivative
+    for J. Small values of x use the linear approximation B_J=(J+1)/(3J)·x.
+    
+    :return: x·dB_J/dx, dB_J/dJ
+  '''
+  J=p[1]
+  x=numpy.array(x, dtype=numpy.float64)
+  a=(2.*J+1.)/(2.*J)
+  b=1./(2.*J)
+  small=numpy.abs(x)<1e-4
+  xs=numpy.where(small, 1., x)
+  coth_a=1./numpy.tanh(a*xs)
+  coth_b=1./numpy.tanh(b*xs)
+  # u·csch²(u)
+  ucsch_a=a*xs/numpy.sinh(a*xs)**2
+  ucsch_b=b*xs/numpy.sinh(b*xs)**2
+  x_dB_dx=numpy.where(small, (J+1.)/(3.*J)*x, b*ucsch_b-a*ucsch_a)
+  dB_dJ=numpy.where(small,-x/(3.*J**2),
+                    -1./(2.*J**2)*((coth_a-ucsch_a)-(coth_b-ucsch_b)))
+  return x_dB_dx, dB_dJ
+
 class FitBrillouineB(FitFunction):
   '''
     Fit a Brillouine's function for the magnetic behaviour of a paramagnet
@@ -2541,6 +2734,18 @@ class FitBrillouineB(FitFunction):
 #      out.append(fsolve(lambda item: self.brillouine(p, item, xi), 1e-6))
     return self.brillouine(p, numpy.array(B)/1.2566e-3)
 
+  def fit_jacobian(self, p, B):
+    N, J, g, T=p[:4]
+    B=numpy.array(B, dtype=numpy.float64)/1.2566e-3
+    x=(g*self.muB*J*B)/(self.kB*T)
+    C=N*g*self.muB*J
+    B_x=B_J(p, x)
+    x_dB_dx, dB_dJ=B_J_derivatives(p, x)
+    return numpy.array([C/N*B_x,
+                        C*(B_x/J+x_dB_dx/J+dB_dJ),
+                        C*(B_x+x_dB_dx)/g,
+                        -C*x_dB_dx/T]).transpose()
+
 class FitBrillouineT(FitFunction):
   '''
     Fit a Brillouine's function for the magnetic behaviour of a paramagnet
@@ -2582,6 +2787,19 @@ class FitBrillouineT(FitFunction):
     '''
     return self.brillouine(p, numpy.array(T))+p[4]
 
+  def fit_jacobian(self, p, T):
+    N, J, g, B=p[:4]
+    T=numpy.array(T, dtype=numpy.float64)
+    x=(g*self.muB*J*B/1.2566e-3)/(self.kB*T)
+    C=N*g*self.muB*J
+    B_x=B_J(p, x)
+    x_dB_dx, dB_dJ=B_J_derivatives(p, x)
+    return numpy.array([C/N*B_x,
+                        C*(B_x/J+x_dB_dx/J+dB_dJ),
+                        C*(B_x+x_dB_dx)/g,
+                        C*x_dB_dx/B,
+                        numpy.ones_like(T)]).transpose()
+
 class FitNanoparticleZFC(FitFunction):
   '''
     Fit zero field cooled curves of Nanoparticles.
@@ -3185,7 +3403,12 @@ class FitSession(FitSessionGUI):
         and (self.data.yerror is not None):
       data_zerror=data[self.data.yerror]
     else:
-      data_zerror=data_z.error # take error from z column, if available
+      # take error from z column, if available, the errors follow the columns in the matrix
+      columns=self.data.data
+      if columns[self.data.zdata].has_error:
+        data_zerror=data[len(columns)+[col.has_error for col in columns[:self.data.zdata]].count(True)]
+      else:
+        data_zerror=None
     covariance_matices=[]
     for i, function in enumerate(self.functions):
       pgu=None
@@ -3384,6 +3607,124 @@ class FitSession(FitSessionGUI):
         plot_list.append(result)
     self.data.plot_together=[self.data]+plot_list
 
+  def fit_batch(self, datasets, seed_neighbours=False, index=None, processes=None):
+    '''
+      Fit the functions of this session to a list of datasets,
+      see fit_batch function.
+    '''
+    return fit_batch(datasets, self, seed_neighbours, index, processes)
+
+def _fit_batch_init():
+  '''
+    Initialize a batch fit process, the fits are not distributed further.
+  '''
+  parallel.dview=None
+
+def _fit_batch_chunk(arguments):
+  '''
+    Fit a list of datasets in one process.
+    
+    :return: List of (parameters, covariance matrices) or (None, error message) for each dataset
+  '''
+  session_string, datasets, seed_neighbours=arguments
+  results=[]
+  session=loads(session_string)
+  for dataset in datasets:
+    if not seed_neighbours:
+      session=loads(session_string)
+    session.data=dataset
+    try:
+      covariance_matrices=session.fit()
+      for function in session.functions:
+        result=function[0].last_fit_output
+        if function[1] and result is not None and result.status<=0:
+          raise RuntimeError, result.errmsg or 'mpfit status %i'%result.status
+    except Exception, error:
+      results.append((None, "%s: %s"%(type(error).__name__, error)))
+      # start the next fit from the template parameters
+      session=loads(session_string)
+      continue
+    parameters=[list(function[0].parameters) for function in session.functions]
+    results.append((parameters, covariance_matrices))
+  return results
+
+def fit_batch(datasets, template, seed_neighbours=False, index=None, processes=None):
+  '''
+    Fit the functions of a FitSession to each dataset of a list.
+    The independent fits are distributed over several processes.
+    If the fits are seeded from their neighbours the datasets are split
+    into one continuous block per process, so the first fit of each block
+    starts with the template parameters.
+    Fits of 3d datasets need a 3d template session, fits where mpfit
+    reports an error are skipped.
+    
+    :param datasets: List of MeasurementData objects
+    :param template: FitSession with the functions and start parameters
+    :param seed_neighbours: Start each fit with the result of the previous dataset
+    :param index: List or PhysicalProperty used as x-column of the result, defaults to dataset number
+    :param processes: Number of processes, None uses the WORKERS setting from config.parallel
+    
+    :return: MeasurementData with the fitted parameters and errors vs. index
+  '''
+  import multiprocessing
+  for dataset in datasets:
+    if (dataset.zdata>=0)!=template.data_is_3d:
+      if template.data_is_3d:
+        raise ValueError, "the fit functions of a 3d template can only be fitted to 3d datasets"
+      else:
+        raise ValueError, "the fit functions of a 2d template can't be fitted to 3d datasets"
+  if processes is None:
+    processes=parallel.WORKERS or multiprocessing.cpu_count()
+  # the template data is not needed in the fit processes
+  data=template.data
+  template.data=None
+  try:
+    session_string=dumps(template, 2)
+  finally:
+    template.data=data
+  if seed_neighbours:
+    block_length=(len(datasets)+processes-1)//processes
+  else:
+    block_length=1
+  blocks=[(session_string, datasets[i:i+block_length], seed_neighbours)
+            for i in range(0, len(datasets), block_length)]
+  if processes>1 and len(blocks)>1:
+    pool=multiprocessing.Pool(min(processes, len(blocks)), _fit_batch_init)
+    try:
+      results=pool.map(_fit_batch_chunk, blocks, 1)
+    finally:
+      pool.terminate()
+  else:
+    results=map(_fit_batch_chunk, blocks)
+  results=sum(results, [])
+  # create the parameter vs. index dataset
+  if index is None:
+    index=PhysicalProperty('Index', '', range(len(datasets)))
+  elif not hasattr(index, 'dimension'):
+    index=PhysicalProperty('Index', '', index)
+  fitted=[i for i, function in enumerate(template.functions) if function[1]]
+  columns=[(index.dimension, index.unit)]
+  for i in fitted:
+    for name in template.functions[i][0].parameter_names:
+      if len(fitted)>1:
+        name='%s_%i'%(name, i)
+      columns.append((name, ''))
+  output=MeasurementData(columns, [], 0, 1)
+  for j, (parameters, covariance_matrices) in enumerate(results):
+    if parameters is None:
+      print "Fit of dataset %i failed: %s"%(j, covariance_matrices)
+      continue
+    point=[float(index[j])]
+    for i in fitted:
+      covariance=numpy.array(covariance_matrices[i], dtype=numpy.float64)
+      errors=numpy.sqrt(numpy.abs(covariance.diagonal()))
+      point+=zip(parameters[i], errors)
+    output.append(point)
+  output.short_info='fit parameters (%s)'%", ".join([template.functions[i][0].name for i in fitted])
+  if len(datasets)>0:
+    output.sample_name=datasets[0].sample_name
+  return output
+
 class InteractiveFit(FitFunction):
   '''
     A class to allow interactive definition of fits,
@@ -295,11 +295,11 @@ class FileActions:
                            1,
                            -1,
                            )
-    def prepare_data(point):
-      return [point[0], point[0], point[0], point[1], point[2], 0]
-    data2=map(prepare_data, data)
+    data=numpy.array(data, dtype=numpy.float64)
+    data2=numpy.array([data[:, 0], data[:, 0], data[:, 0], data[:, 1], data[:, 2],
+                       numpy.zeros(len(data))]).transpose()
     data3=self.sort_and_bin(data2, binning, bin_distance=bin_distance)
-    x, y, dy=numpy.array(data3).transpose()[numpy.array([0, 3, 4])]
+    x, y, dy=data3.transpose()[numpy.array([0, 3, 4])]
     x=PhysicalProperty(dataset.x.dimension, dataset.x.unit, x)
     y=PhysicalProperty(dataset.y.dimension, dataset.y.unit, y)
     if dataset.yerror>=0:
@@ -585,15 +585,15 @@ class FileActions:
     dist1=dist1[sort_idx]
     dist=dist[sort_idx]
     if dzdata is not None:
-      data=numpy.array([dist1, xdata, ydata, zdata, dzdata, dist]).transpose().tolist()
+      data=numpy.array([dist1, xdata, ydata, zdata, dzdata, dist]).transpose()
     else:
-      data=numpy.array([dist1, xdata, ydata, zdata, dist]).transpose().tolist()
+      data=numpy.array([dist1, xdata, ydata, zdata, dist]).transpose()
     data=self.sort_and_bin(data, binning, gauss_weighting,
                            sigma_gauss, bin_distance)
     if len(data)<3:
       # if step size was too big there are not enough data points
       return None
-    data=numpy.array(data).transpose()
+    data=data.transpose()
     out_dataset=MeasurementData()
     out_dataset.yerror=-1
     first_dim=''
@@ -708,57 +708,58 @@ class FileActions:
       Sort a dataset and bin the datapoints together. Gaussian weighting is 
       possible and errors are calculated.
       
-      :param data: A list of data points consisting of (x0, x1, x2, y, dy, weighting)
+      :param data: An array or list of data points consisting of (x0, x1, x2, y, dy, weighting)
       
-      :return: Binned dataset
-    '''
-    from math import sqrt, exp
-    data.sort()
-    # Start to bin the datapoints
-    dat_tmp=[]
-    if gauss_weighting:
-      def gauss_sum(data_list):
-        output=0.
-        for i, dat in enumerate(data_list):
-          output+=dat*exp(-din[i][-1]**2/(2*sigma_gauss**2))
-        return output
+      :return: Binned dataset as array with one row per bin
+    '''
+    data=numpy.asarray(data, dtype=numpy.float64)
+    if len(data)==0:
+      return data
+    # sort the points by all columns, as list.sort would do,
+    # the other columns are only needed if x0 has equal values
+    order=numpy.argsort(data[:, 0], kind='mergesort')
+    if (numpy.diff(data[order, 0])==0).any():
+      order=numpy.lexsort(data.transpose()[::-1])
+    data=data[order]
     if bin_distance is not None:
-      bin_dist_position=int(data[0][0]/bin_distance)
-      din=[]
-    for i, point in enumerate(data):
-      if bin_distance is not None:
-        if point[0]<=bin_distance*(bin_dist_position+0.5):
-          din.append([bin_dist_position*bin_distance]+point[1:])
-        else:
-          while point[0]>bin_distance*(bin_dist_position+0.5):
-            bin_dist_position+=1
-          din=[[bin_dist_position*bin_distance]+point[1:]]
-        if (i+1)==len(data) or data[i+1][0]<=bin_distance*(bin_dist_position+0.5):
-          continue
-      else:
-        if i%binning==0:
-          din=[point]
-        else:
-          din.append(point)
-        if (i+1)%binning!=0:
-          continue
-      # Create the mean value of the collected points
-      dout=[]
-      if gauss_weighting:
-        g_sum=gauss_sum([1 for d in din])
-        for j in range(4):
-          dout.append(gauss_sum([d[j] for d in din])/g_sum)
-        if len(din[0])>5:
-          dout.append(sqrt(gauss_sum([d[4]**2 for d in din]))/g_sum)
-        dout.append(g_sum/len(din))
-      else:
-        for j in range(4):
-          dout.append(sum([d[j] for d in din])/len(din))
-        if len(din[0])>5:
-          dout.append(sqrt(sum([d[4]**2 for d in din]))/len(din))
-        dout.append(sum([d[-1] for d in din])/len(din))
-      dat_tmp.append(dout)
-    return dat_tmp
+      # Every point is put in the first bin not before the bin of the previous point
+      # for which x0<=bin_distance*(position+0.5), the last bin is not used.
+      x=data[:, 0]
+      positions=numpy.ceil(x/bin_distance-0.5)
+      positions+=(x>bin_distance*(positions+0.5))
+      positions-=(x<=bin_distance*(positions-0.5))
+      positions=numpy.maximum(positions, int(x[0]/bin_distance))
+      labels=numpy.cumsum(positions[1:]!=positions[:-1])
+      labels=numpy.append(0, labels)
+      use=labels<labels[-1]
+      data=data[use]
+      data[:, 0]=positions[use]*bin_distance
+      labels=labels[use]
+    else:
+      # group each binning points, an incomplete last bin is dropped
+      items=(len(data)//binning)*binning
+      data=data[:items]
+      labels=numpy.arange(items)//binning
+    if len(data)==0:
+      return numpy.zeros((0, min(data.shape[1], 6)))
+    # Create the mean value of the collected points
+    counts=numpy.bincount(labels).astype(numpy.float64)
+    if gauss_weighting:
+      weights=numpy.exp(-data[:, -1]**2/(2*sigma_gauss**2))
+      norm=numpy.bincount(labels, weights)
+    else:
+      weights=numpy.ones(len(data))
+      norm=counts
+    output=[]
+    for j in range(4):
+      output.append(numpy.bincount(labels, weights*data[:, j])/norm)
+    if data.shape[1]>5:
+      output.append(numpy.sqrt(numpy.bincount(labels, weights*data[:, 4]**2))/norm)
+    if gauss_weighting:
+      output.append(norm/counts)
+    else:
+      output.append(numpy.bincount(labels, data[:, -1])/counts)
+    return numpy.array(output).transpose()
 
   def integrate_around_point(self, x_pos, y_pos, radius, dataset):
     '''
@@ -787,7 +788,8 @@ class FileActions:
     else:
       return (0., 1.)
 
-def interpolate_and_smooth(dataset, sigma_x, sigma_y, grid_x, grid_y, use_matrix_data_output=False, fill_value=(0., 1.)):
+def interpolate_and_smooth(dataset, sigma_x, sigma_y, grid_x, grid_y, use_matrix_data_output=False,
+                           fill_value=(0., 1.), processes=1):
   '''
     Fill a grid with datapoints from another grid, weighting the points with a gaussian up to a distance of
     3*sigma.
@@ -796,17 +798,12 @@ def interpolate_and_smooth(dataset, sigma_x, sigma_y, grid_x, grid_y, use_matrix
     :param sigma_x: Sigma for the gaussian weighting in x direction
     :param sigmy_y: Sigma for the gaussian weighting in y direction
     :param grid_xy: List of (x,y) tuples for the new grid
+    :param processes: Number of processes used to calculate the grid columns
     
     :return: MeasurementData or HugeMD object with the rebinned data
   '''
   if dataset.zdata<0:
     raise ValueError, 'Dataset needs to be 3 dimensional for interpolation'
-  gauss_factor_x=-0.5/sigma_x**2
-  gauss_factor_y=-0.5/sigma_y**2
-  three_sigma_x=3.*sigma_x
-  three_sigma_y=3.*sigma_y
-  exp=numpy.exp
-  sqrt=numpy.sqrt
   where=numpy.where
   # get the data
   data=dataset.get_filtered_data_matrix()
@@ -820,8 +817,6 @@ def interpolate_and_smooth(dataset, sigma_x, sigma_y, grid_x, grid_y, use_matrix
   else:
     dzq=dataset.z.error**2
   dzq=where(numpy.isinf(dzq), numpy.nan_to_num(dzq), 1.)
-  #zout=[]
-  #dzout=[]
   dims=dataset.dimensions()
   units=dataset.units()
   cols=[(dims[dataset.xdata], units[dataset.xdata]),
@@ -832,30 +827,82 @@ def interpolate_and_smooth(dataset, sigma_x, sigma_y, grid_x, grid_y, use_matrix
     output_data.is_matrix_data=True
   else:
     output_data=MeasurementData(cols, [], 0, 1,-1, 2)
-  # Go through the new grid point by point and search for datapoints close to the new grid points
-  for xi in grid_x:
-    distances_x=abs(x-xi)
-    indices_x=where(distances_x<three_sigma_x)[0]
-    if len(indices_x)==0:
-      # fill grid at points not in old grid
-      for yi in grid_y:
-        output_data.append([xi, yi, (fill_value[0], fill_value[1])])
-      continue
-    for yi in grid_y:
-      distances_y=abs(y[indices_x]-yi)
-      sub_indices=where(distances_y<three_sigma_y)[0]
-      indices=indices_x[sub_indices]
-      if len(indices)==0:
-        # fill grid at points not in old grid
-        output_data.append([xi, yi, (fill_value[0], fill_value[1])])
-        continue
-      factors=exp(distances_x[indices]**2*gauss_factor_x+distances_y[sub_indices]**2*gauss_factor_y)
-      scale=1./factors.sum()
-      zi=(z[indices]*factors).sum()*scale
-      dzi=sqrt((dzq[indices]*factors).sum())*scale
-      output_data.append([xi, yi, (zi, dzi)])
+  grid_x=numpy.array(grid_x, dtype=numpy.float64)
+  grid_y=numpy.array(grid_y, dtype=numpy.float64)
+  # sort the points by x to find the points close to each grid column with searchsorted
+  order=numpy.argsort(x, kind='mergesort')
+  arrays=(x[order], y[order], z[order], dzq[order])
+  if processes>1 and len(grid_x)>=2*processes:
+    import multiprocessing
+    pool=multiprocessing.Pool(processes)
+    try:
+      blocks=pool.map(_interpolate_grid_columns,
+                      [arrays+(sigma_x, sigma_y, grid_x_block, grid_y, fill_value)
+                       for grid_x_block in numpy.array_split(grid_x, processes)])
+    finally:
+      pool.terminate()
+    zout=numpy.vstack([block[0] for block in blocks])
+    dzout=numpy.vstack([block[1] for block in blocks])
+  else:
+    zout, dzout=_interpolate_grid_columns(arrays+(sigma_x, sigma_y, grid_x, grid_y, fill_value))
+  # the grid is ordered by x first
+  output_data.data[0]=PhysicalProperty(cols[0][0], cols[0][1], numpy.repeat(grid_x, len(grid_y)))
+  output_data.data[1]=PhysicalProperty(cols[1][0], cols[1][1], numpy.tile(grid_y, len(grid_x)))
+  output_data.data[2]=PhysicalProperty(cols[2][0], cols[2][1], zout.flatten(), dzout.flatten())
   return output_data
 
+def _interpolate_grid_columns(arguments):
+  '''
+    Calculate the gaussian weighted z-values and errors for all grid points with
+    the x-values of grid_x. The data has to be sorted by x.
+    
+    :return: Arrays of z and errors with shape (len(grid_x), len(grid_y))
+  '''
+  x, y, z, dzq, sigma_x, sigma_y, grid_x, grid_y, fill_value=arguments
+  gauss_factor_x=-0.5/sigma_x**2
+  gauss_factor_y=-0.5/sigma_y**2
+  three_sigma_x=3.*sigma_x
+  three_sigma_y=3.*sigma_y
+  len_y=len(grid_y)
+  zout=numpy.empty((len(grid_x), len_y))
+  zout.fill(fill_value[0])
+  dzout=numpy.empty((len(grid_x), len_y))
+  dzout.fill(fill_value[1])
+  for i, xi in enumerate(grid_x):
+    start=x.searchsorted(xi-three_sigma_x, 'left')
+    end=x.searchsorted(xi+three_sigma_x, 'right')
+    distances_x=abs(x[start:end]-xi)
+    indices=numpy.where(distances_x<three_sigma_x)[0]
+    if len(indices)==0:
+      continue
+    distances_x=distances_x[indices]
+    indices+=start
+    # sort the points of this column by y to get the window of each grid point
+    y_order=numpy.argsort(y[indices], kind='mergesort')
+    indices=indices[y_order]
+    distances_x=distances_x[y_order]
+    y_window=y[indices]
+    window_start=y_window.searchsorted(grid_y-three_sigma_y, 'left')
+    window_end=y_window.searchsorted(grid_y+three_sigma_y, 'right')
+    counts=window_end-window_start
+    if counts.sum()==0:
+      continue
+    # create the (grid point, data point) pairs of all windows
+    pair_grid=numpy.repeat(numpy.arange(len_y), counts)
+    pair_data=numpy.arange(counts.sum())-numpy.repeat(counts.cumsum()-counts-window_start, counts)
+    distances_y=abs(y_window[pair_data]-grid_y[pair_grid])
+    close=distances_y<three_sigma_y
+    pair_grid=pair_grid[close]
+    pair_data=pair_data[close]
+    factors=numpy.exp(distances_x[pair_data]**2*gauss_factor_x+distances_y[close]**2*gauss_factor_y)
+    found=numpy.bincount(pair_grid, minlength=len_y)>0
+    scale=1./numpy.bincount(pair_grid, factors, len_y)[found]
+    zsum=numpy.bincount(pair_grid, z[indices][pair_data]*factors, len_y)
+    dzsum=numpy.bincount(pair_grid, dzq[indices][pair_data]*factors, len_y)
+    zout[i, found]=zsum[found]*scale
+    dzout[i, found]=numpy.sqrt(dzsum[found])*scale
+  return zout, dzout
+
 def rebin_2d(dataset, join_pixels_x, join_pixels_y=None, use_matrix_data_output=False):
   '''
     Rebin data on a regular grid by summing up pixels in x and y direction.
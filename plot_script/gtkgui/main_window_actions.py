@@ -122,6 +122,8 @@ Gnuplot version %.1f patchlevel %i with terminals:
     # plot the data
     self.replot()
     self._set_xyz_range_labels()
+    # render the next plots in the background
+    self.prefetch_neighbours()
     if self.plot_tree is not None:
       self.plot_tree.add_data()
       self.plot_tree.set_focus_item(self.active_session.active_file_name, self.index_mess)
@@ -842,12 +844,16 @@ Gnuplot version %.1f patchlevel %i with terminals:
 
   def connect_cluster(self, action):
     '''
-      Open a dialog to connect to IPython Cluster.
+      Open a dialog to connect to IPython Cluster or start the local
+      worker processes.
     '''
     from plot_script import parallel
     if parallel.dview is not None:
       parallel.disconnect()
       return
+    if not parallel.USE_IPCLUSTER:
+      parallel.connect()
+      return
 
     parameters=user_config['Parallel']
     parameters=",\n".join(map(lambda item: "%s=%s"%(item[0], repr(item[1])),
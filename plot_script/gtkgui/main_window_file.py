@@ -7,6 +7,7 @@ import os
 import sys
 import gtk
 import subprocess
+from time import sleep
 from diverse_classes import PlotProfile
 from dialogs import FileImportDialog, StatusDialog, ExportFileChooserDialog, \
                     PreviewDialog, ImportWizard
@@ -578,20 +579,32 @@ class MainFile(object):
     if selection_dialog.run()==1:
       selection_dialog.hide()
       naming_text=naming_entry.get_text()
+      # the plots are rendered by all gnuplot processes of the pool
+      requests=[]
+      def export_finished(output, ignore, i):
+        if output!='':
+          self.last_plot_text=output
+        print 'Export plot number %2i...'%i
       for i, item in enumerate(selection_dialog.get_active_objects_with_key()):
         file_name, dataset=item
         file_name_raw=os.path.split(file_name)[1]
         naming=naming_text.replace('[name]', file_name_raw)
-        self.last_plot_text=self.plot(self.active_session,
+        requests.append(measurement_data_plotting.gnuplot_plot_script(self.active_session,
                                       dataset.plot_together,
                                       file_name,
+                                      self.script_suf,
                                       dataset.short_info,
                                       [ds.short_info for ds in dataset.plot_together],
                                       errorbars,
                                       os.path.join(self.active_folder, naming),
-                                      fit_lorentz=False)
-        self.reset_statusbar()
-        print 'Export plot number %2i...'%i
+                                      fit_lorentz=False,
+                                      callback=lambda output, variables, i=i: export_finished(output, variables, i)))
+      # keep the GUI responsive until all plots are finished
+      while not all([request.finished.is_set() for request in requests]) or gtk.events_pending():
+        gtk.main_iteration(False)
+        if not gtk.events_pending():
+          sleep(0.01)
+      self.reset_statusbar()
       print 'Export Done!'
     selection_dialog.destroy()
 
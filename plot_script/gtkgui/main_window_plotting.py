@@ -5,9 +5,11 @@
 
 import os
 import gtk
+import gobject
 import numpy
 from time import sleep
 from plot_script import measurement_data_plotting
+from plot_script.render_cache import RenderCache, RenderPrefetcher, render_key
 from plot_script.config import gnuplot_preferences, user_config
 from dialogs import LabelArrowDialog, StyleLine, SimpleEntryDialog, \
                     PreviewDialog, VListEntry
@@ -21,12 +23,24 @@ __credits__=['Liane Schätzler', 'Emmanuel Kentzinger', 'Werner Schweika',
 from plot_script.plotpy_info import __copyright__, __license__, __version__, __maintainer__, __email__ #@UnusedImport
 __status__="Production"
 
+def dispatch_to_main_loop(function, *args):
+  '''
+    Call a function from the gtk main loop, used for callbacks of other threads.
+  '''
+  def call_once():
+    function(*args)
+    return False
+  gobject.idle_add(call_once)
+
 class MainPlotting(object):
   '''
     Plotting actions
   '''
   gnuplot_initialized=False
   label_arrow_dialog=None
+  render_cache=None
+  render_prefetcher=None
+  plot_requests=0
   gnuplot_info={
                 'version': 0,
                 'patch': 0,
@@ -50,33 +64,103 @@ class MainPlotting(object):
 
   def plot(self, session, datasets, file_name_prefix, title, names,
             with_errorbars, output_file=gnuplot_preferences.output_file_name,
-            fit_lorentz=False, sample_name=None, show_persistent=False):
+            fit_lorentz=False, sample_name=None, show_persistent=False,
+            callback=None):
     '''
       Plot via script file instead of using python gnuplot pipeing.
       
-      :return: Gnuplot error messages, which have been reported
+      :param callback: Render in the background and call this function with the
+                       gnuplot error messages when the image has been created
+      
+      :return: Gnuplot error messages, which have been reported (None when rendering in background)
     '''
     if not self.gnuplot_initialized:
       self.initialize_gnuplot()
+    cached=None
+    if not show_persistent:
+      if self.render_cache is None:
+        if measurement_data_plotting.gnuplot_pool is None:
+          session.initialize_gnuplot()
+        measurement_data_plotting.gnuplot_pool.dispatch=dispatch_to_main_loop
+        self.render_cache=RenderCache()
+        self.render_prefetcher=RenderPrefetcher(measurement_data_plotting.gnuplot_pool,
+                                                self.render_cache, dispatch_to_main_loop)
+      key=self.get_render_key(session, datasets, file_name_prefix, title, names,
+                              with_errorbars, output_file, sample_name)
+      cached=self.render_cache.get(key)
+    if cached is not None:
+      # the same plot has been rendered before
+      image, variables=cached
+      open(output_file, 'wb').write(image)
+      self.set_mouse_data_range('', variables)
+      if callback is not None:
+        # ignore results of earlier requests
+        self.plot_requests+=1
+        callback('')
+        return None
+      return ''
+    if callback is not None and not show_persistent:
+      # render into a seperate file, the result of the last request replaces output_file
+      self.plot_requests+=1
+      request_number=self.plot_requests
+      name, extension=os.path.splitext(output_file)
+      request_file='%s-%i%s'%(name, request_number, extension)
+      def finished(output, variables):
+        if request_number!=self.plot_requests:
+          # a newer plot has been requested in the mean time
+          if os.path.exists(request_file):
+            os.remove(request_file)
+          return
+        if os.path.exists(request_file):
+          if os.path.exists(output_file):
+            os.remove(output_file)
+          os.rename(request_file, output_file)
+          if output=='':
+            self.render_cache.put(key, open(output_file, 'rb').read(), variables)
+        self.set_mouse_data_range(output, variables)
+        callback(output)
+      measurement_data_plotting.gnuplot_plot_script(session,
+                                                    datasets,
+                                                    file_name_prefix,
+                                                    self.script_suf,
+                                                    title,
+                                                    names,
+                                                    with_errorbars,
+                                                    request_file,
+                                                    fit_lorentz=False,
+                                                    sample_name=sample_name,
+                                                    get_xy_ranges=self.mouse_mode,
+                                                    callback=finished)
+      return None
     try:
       output, variables=measurement_data_plotting.gnuplot_plot_script(session,
-                                                         datasets,
-                                                         file_name_prefix,
-                                                         self.script_suf,
-                                                         title,
-                                                         names,
-                                                         with_errorbars,
-                                                         output_file,
-                                                         fit_lorentz=False,
-                                                         sample_name=sample_name,
-                                                         show_persistent=show_persistent,
-                                                         get_xy_ranges=self.mouse_mode)
+                                                       datasets,
+                                                       file_name_prefix,
+                                                       self.script_suf,
+                                                       title,
+                                                       names,
+                                                       with_errorbars,
+                                                       output_file,
+                                                       fit_lorentz=False,
+                                                       sample_name=sample_name,
+                                                       show_persistent=show_persistent,
+                                                       get_xy_ranges=self.mouse_mode)
     except RuntimeError:
       print "Gnuplot instance lost, try to restart ..."
       # gnuplot instance was somehow killed, try to restart
       self.active_session.initialize_gnuplot()
       return self.splot(session, datasets, file_name_prefix, title, names,
             with_errorbars, output_file, fit_lorentz, sample_name, show_persistent)
+    if not show_persistent and output=='' and os.path.exists(output_file):
+      self.render_cache.put(key, open(output_file, 'rb').read(), variables)
+    self.set_mouse_data_range(output, variables)
+    return output
+
+  def set_mouse_data_range(self, output, variables):
+    '''
+      Calculate the relation between image pixels and plot coordinates
+      from the values printed by gnuplot.
+    '''
     if output=='' and variables is not None and len(variables)==8:
       img_size=self.image.get_allocation()
       mr_x=variables[0]/img_size.width
@@ -86,7 +170,73 @@ class MainPlotting(object):
       self.mouse_data_range=((mr_x, mr_width, mr_y, mr_height), variables[4:]+[
                                           self.get_first_in_mp().logx,
                                           self.get_first_in_mp().logy])
-    return output
+
+  def get_render_key(self, session, datasets, file_name_prefix, title, names,
+                     with_errorbars, output_file, sample_name=None):
+    '''
+      Return the render cache key for a plot, which depends on the data and
+      the created gnuplot script.
+    '''
+    gnuplot_file_text=measurement_data_plotting.create_plot_script(session,
+                                                         datasets,
+                                                         file_name_prefix,
+                                                         self.script_suf,
+                                                         title,
+                                                         list(names),
+                                                         with_errorbars,
+                                                         output_file,
+                                                         fit_lorentz=False,
+                                                         sample_name=sample_name)
+    return render_key(gnuplot_file_text+'\nmouse_mode=%s'%self.mouse_mode, datasets)
+
+  def prefetch_neighbours(self):
+    '''
+      Render the plots of the previous and next datasets in the background,
+      so they can be shown from the render cache when moving through the plots.
+      Only the cache keys are calculated here, the data is exported when
+      the GUI is idle.
+    '''
+    if self.active_multiplot or self.render_prefetcher is None:
+      return
+    session=self.active_session
+    output_file=session.TEMP_DIR+'plot_temp.png'
+    offsets=range(1, gnuplot_preferences.PREFETCH_NEIGHBOURS+1)
+    for offset in offsets+[-offset for offset in offsets]:
+      index=self.index_mess+offset
+      if index<0 or index>=len(self.measurement):
+        continue
+      dataset=self.measurement[index]
+      if hasattr(dataset, 'tmp_export_file'):
+        # don't load huge datasets into memory in advance
+        continue
+      names=[ds.short_info for ds in dataset.plot_together]
+      key=self.get_render_key(session, [dataset], self.input_file_name, dataset.short_info,
+                              names, errorbars, output_file)
+      if key in self.render_cache or key in self.render_prefetcher.pending:
+        continue
+      # use seperate files as the main gnuplot instance could run at the same time
+      prefetch_prefix=session.TEMP_DIR+'tmp_prefetch_'+key[:16]+'_'
+      prefetch_file=session.TEMP_DIR+'prefetch_'+key[:16]+'.png'
+      def prepare(dataset=dataset, names=names, prefetch_prefix=prefetch_prefix,
+                  prefetch_file=prefetch_file, file_name_prefix=self.input_file_name,
+                  with_errorbars=errorbars, mouse_mode=self.mouse_mode):
+        # called from the main loop when idle, as the export of the data takes some time
+        binary_formats=measurement_data_plotting.export_plot_data([dataset], prefetch_prefix)
+        gnuplot_file_text=measurement_data_plotting.create_plot_script(session,
+                                                           [dataset],
+                                                           file_name_prefix,
+                                                           self.script_suf,
+                                                           dataset.short_info,
+                                                           names,
+                                                           with_errorbars,
+                                                           prefetch_file,
+                                                           fit_lorentz=False,
+                                                           output_file_prefix=prefetch_prefix,
+                                                           binary_formats=binary_formats)
+        if mouse_mode:
+          gnuplot_file_text+=measurement_data_plotting.PRINT_XY_RANGES
+        return gnuplot_file_text, prefetch_file
+      self.render_prefetcher.prefetch_later(key, prepare, prefetch_prefix)
 
   def plot_persistent(self, action=None):
     '''
@@ -259,6 +409,7 @@ class MainPlotting(object):
   def replot(self, echo=True):
     '''
       Recreate the current plot and clear the statusbar.
+      The image is rendered in the background and shown when it is finished.
     '''
     global errorbars
     # change label and plot other picture
@@ -302,18 +453,22 @@ class MainPlotting(object):
     self.frame1.set_current_page(0)
     self.active_session.picture_width=str(self.image.get_allocation().width)
     self.active_session.picture_height=str(self.image.get_allocation().height)
+    # the image is rendered in the background and shown by replot_finished
+    plotted_dataset=self.active_dataset
+    callback=lambda output: self.replot_finished(output, plotted_dataset, echo)
     if self.active_multiplot:
       multiplot=self.multiplot
       itemlist=[item[0] for item in multiplot]
-      self.last_plot_text=self.plot(self.active_session,
-                                    itemlist,
-                                    multiplot[0][1],
-                                    multiplot.title,
-                                    [item.short_info for item in itemlist],
-                                    errorbars,
-                                    output_file=self.active_session.TEMP_DIR+'plot_temp.png',
-                                    fit_lorentz=False,
-                                    sample_name=multiplot.sample_name)
+      self.plot(self.active_session,
+                itemlist,
+                multiplot[0][1],
+                multiplot.title,
+                [item.short_info for item in itemlist],
+                errorbars,
+                output_file=self.active_session.TEMP_DIR+'plot_temp.png',
+                fit_lorentz=False,
+                sample_name=multiplot.sample_name,
+                callback=callback)
       self.label.set_width_chars(30)
       self.label.set_text(multiplot.sample_name)
       self.label2.set_width_chars(30)
@@ -323,14 +478,28 @@ class MainPlotting(object):
       self.label.set_text(self.active_dataset.sample_name)
       self.label2.set_width_chars(30)
       self.label2.set_text(self.active_dataset.short_info)
-      self.last_plot_text=self.plot(self.active_session,
-                                  [self.active_dataset],
-                                  self.input_file_name,
-                                  self.active_dataset.short_info,
-                                  [ds.short_info for ds in self.active_dataset.plot_together],
-                                  errorbars,
-                                  output_file=self.active_session.TEMP_DIR+'plot_temp.png',
-                                  fit_lorentz=False)
+      self.plot(self.active_session,
+                [self.active_dataset],
+                self.input_file_name,
+                self.active_dataset.short_info,
+                [ds.short_info for ds in self.active_dataset.plot_together],
+                errorbars,
+                output_file=self.active_session.TEMP_DIR+'plot_temp.png',
+                fit_lorentz=False,
+                callback=callback)
+    self.plot_options_buffer.set_text(str(self.active_dataset.plot_options))
+    text=self.active_session.get_active_file_info()+self.active_dataset.get_info()
+    self.info_label.set_markup(text.replace('<', '[').replace('>', ']').replace('&', 'and'))
+    # make sure hugeMD objects are removed from memory after plotting,
+    # the data has already been exported
+    if hasattr(self.active_dataset, 'tmp_export_file'):
+      self.active_dataset.store_data()
+
+  def replot_finished(self, output, dataset, echo=True):
+    '''
+      Show the image after gnuplot has finished rendering.
+    '''
+    self.last_plot_text=output
     if self.last_plot_text!='':
       self.set_title('Plotting GUI - '+self.input_file_name+" - "+str(self.index_mess))
       self.active_plot_geometry=(self.widthf, self.heightf)
@@ -349,14 +518,8 @@ class MainPlotting(object):
       self.reset_statusbar()
       self.set_image()
       if not self.active_multiplot:
-        self.active_dataset.preview=self.image_pixbuf.scale_simple(100, 50,
-                                                        gtk.gdk.INTERP_BILINEAR)
-    self.plot_options_buffer.set_text(str(self.active_dataset.plot_options))
-    text=self.active_session.get_active_file_info()+self.active_dataset.get_info()
-    self.info_label.set_markup(text.replace('<', '[').replace('>', ']').replace('&', 'and'))
-    # make sure hugeMD objects are removed from memory after plotting
-    if hasattr(self.active_dataset, 'tmp_export_file'):
-      self.active_dataset.store_data()
+        dataset.preview=self.image_pixbuf.scale_simple(100, 50,
+                                                       gtk.gdk.INTERP_BILINEAR)
     self.emit('plot-drawn')
 
   def open_plot_options_window(self, action):
@@ -735,12 +898,7 @@ class MainPlotting(object):
                                     gnuplot_preferences.defined_color_patterns[pattern])
       gptext+='unset multiplot\n'
       # send commands to gnuplot
-      measurement_data_plotting.gnuplot_instance.stdin.write('reset\n') #@UndefinedVariable
-      measurement_data_plotting.gnuplot_instance.stdin.write(gptext) #@UndefinedVariable
-      measurement_data_plotting.gnuplot_instance.stdin.write('\nprint "|||"\n') #@UndefinedVariable
-      output=measurement_data_plotting.gnuplot_instance.stdout.read(3) #@UndefinedVariable
-      while output[-3:]!='|||':
-        output+=measurement_data_plotting.gnuplot_instance.stdout.read(1) #@UndefinedVariable
+      measurement_data_plotting.gnuplot_pool.render(gptext) #@UndefinedVariable
     pattern_box=gtk.combo_box_new_text()
     # drop down menu for the pattern selection
     for i, pattern in enumerate(pattern_names):
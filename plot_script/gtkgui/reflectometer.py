@@ -11,6 +11,7 @@ import math
 import numpy
 # own modules
 from plot_script.read_data import reflectometer as read_data
+from plot_script.config import reflectometer as config
 from plot_script.sessions.reflectometer_fit.reflectometer import * #@UnusedWildImport
 import dialogs
 from plot_script import fit_data
@@ -599,7 +600,10 @@ class ReflectometerGUI:
       self.dialog_fit(action, window)
       # read fit parameters from file and create new object, if process is killed ignore
       if fit_list[1]['actually'] and response==5 and self.active_file_data.fit_object.fit==1:
-        parameters, errors=self.read_fit_file(self.TEMP_DIR+'fit_temp.ref', self.active_file_data.fit_object)
+        if config.NATIVE_SIMULATION:
+          parameters, errors=self.native_fit_result
+        else:
+          parameters, errors=self.read_fit_file(self.TEMP_DIR+'fit_temp.ref', self.active_file_data.fit_object)
         new_fit=self.active_file_data.fit_object.copy()
         new_fit.get_parameters(parameters)
         sorted_errors=new_fit.get_errors(errors)
@@ -722,16 +726,24 @@ class ReflectometerGUI:
     ent_file=open(self.TEMP_DIR+'fit_temp.ent', 'w')
     ent_file.write(self.active_file_data.fit_object.get_ent_str()+'\n')
     ent_file.close()
-    #open a background process for the fit function
-    self.proc=self.call_fit_program(self.TEMP_DIR+'fit_temp.ent', self.TEMP_DIR+'fit_temp.res',
-                                      self.TEMP_DIR+'fit_temp', self.max_iter)
-    print "fit.f90 program started."
-    if self.active_file_data.fit_object.fit!=1: # if this is not a fit just wait till finished
-      exec_time, ignore=self.proc.communicate()
-      print "fit.f90 program finished in %.2g seconds."%float(exec_time.splitlines()[-1])
+    if config.NATIVE_SIMULATION:
+      if self.active_file_data.fit_object.fit==1:
+        max_iter=self.max_iter
+      else:
+        max_iter=0
+      simu, parameters, errors=self.native_fit(dataset, max_iter, self.x_from, self.x_to)
+      self.native_fit_result=(parameters, errors)
     else:
-      self.open_status_dialog(window)
-    simu=read_data.read_simulation(self.TEMP_DIR+'fit_temp.sim')
+      #open a background process for the fit function
+      self.proc=self.call_fit_program(self.TEMP_DIR+'fit_temp.ent', self.TEMP_DIR+'fit_temp.res',
+                                        self.TEMP_DIR+'fit_temp', self.max_iter)
+      print "fit.f90 program started."
+      if self.active_file_data.fit_object.fit!=1: # if this is not a fit just wait till finished
+        exec_time, ignore=self.proc.communicate()
+        print "fit.f90 program finished in %.2g seconds."%float(exec_time.splitlines()[-1])
+      else:
+        self.open_status_dialog(window)
+      simu=read_data.read_simulation(self.TEMP_DIR+'fit_temp.sim')
     simu.number='sim_'+dataset.number
     simu.short_info='simulation'
     simu.sample_name=dataset.sample_name
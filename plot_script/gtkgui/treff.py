@@ -823,7 +823,10 @@ class TreffGUI:
       self.dialog_fit(action, window, move_channels=parameters_list[10].get_active(), new_max_hr=new_max_hr)
       # read fit parameters from file and create new object, if process is killed ignore
       if fit_list[1]['actually'] and response==5 and self.active_file_data.fit_object.fit==1:
-        parameters, errors=self.read_fit_file(self.TEMP_DIR+'result', self.active_file_data.fit_object)
+        if config.NATIVE_SIMULATION:
+          parameters, errors=self.native_fit_result
+        else:
+          parameters, errors=self.read_fit_file(self.TEMP_DIR+'result', self.active_file_data.fit_object)
         new_fit=self.active_file_data.fit_object.copy()
         new_fit.get_parameters(parameters)
         sorted_errors=new_fit.get_errors(errors)
@@ -848,24 +851,36 @@ class TreffGUI:
     names=config.REF_FILE_ENDINGS
     output_names=config.FIT_OUTPUT_FILES
     self.export_data_and_entfile(self.TEMP_DIR, 'fit_temp.ent')
-    #open a background process for the fit function
-    self.proc=self.call_fit_program(self.TEMP_DIR+'fit_temp.ent', new_max_hr)
-    print "PNR program started."
-    if self.active_file_data.fit_object.fit!=1 and any(self.active_file_data.fit_datasets): # if this is not a fit just wait till finished
-      exec_time, stderr_value=self.proc.communicate()
-      try:
-        print "PNR program finished in %.2g seconds."%float(exec_time.splitlines()[-1])
-      except IndexError:
-        if exec_time.strip()!='' or stderr_value.strip()!='':
-          raise RuntimeError, 'PNR program finished with error message:\n%s'%(exec_time+' '+stderr_value)
+    exec_time=''
+    stderr_value=''
+    if config.NATIVE_SIMULATION:
+      if self.active_file_data.fit_object.fit==1:
+        max_iter=self.max_iter
+      else:
+        max_iter=0
+      simulations, parameters, errors=self.native_fit(max_iter)
+      self.native_fit_result=(parameters, errors)
+      read_simulation=lambda i: simulations[i]
     else:
-      self.open_status_dialog(window)
+      #open a background process for the fit function
+      self.proc=self.call_fit_program(self.TEMP_DIR+'fit_temp.ent', new_max_hr)
+      print "PNR program started."
+      if self.active_file_data.fit_object.fit!=1 and any(self.active_file_data.fit_datasets): # if this is not a fit just wait till finished
+        exec_time, stderr_value=self.proc.communicate()
+        try:
+          print "PNR program finished in %.2g seconds."%float(exec_time.splitlines()[-1])
+        except IndexError:
+          if exec_time.strip()!='' or stderr_value.strip()!='':
+            raise RuntimeError, 'PNR program finished with error message:\n%s'%(exec_time+' '+stderr_value)
+      else:
+        self.open_status_dialog(window)
+      read_simulation=lambda i: read_data.read_simulation(self.TEMP_DIR+output_names[i])
     free_sims=[]
     for i, dataset in enumerate(self.active_file_data.fit_datasets):
       if dataset:
         # if data for the channel was selected combine data and fit together
         try:
-          simu=read_data.read_simulation(self.TEMP_DIR+output_names[i])
+          simu=read_simulation(i)
           simu.number='sim_'+dataset.number
           simu.short_info='simulation '+names[i]
           simu.sample_name=dataset.sample_name
@@ -877,7 +892,7 @@ class TreffGUI:
         dataset.plot_together[1].plot_options._special_plot_parameters=PlotStyle()
         dataset.plot_together[1].plot_options._special_plot_parameters.color=i+1
       elif self.active_file_data.fit_object.simulate_all_channels:
-        simu=read_data.read_simulation(self.TEMP_DIR+output_names[i])
+        simu=read_simulation(i)
         simu.number='%i'%i
         simu.short_info='simulation '+names[i]
         simu.plot_options._special_plot_parameters=PlotStyle()
@@ -0,0 +1,212 @@
+# -*- encoding: utf-8 -*-
+'''
+ Cache for the datasets imported from data files.
+
+ The datasets read from a file are stored in the columnar snapshot format
+ (see snapshots module) in a central cache folder, which replaces the .mds
+ files created next to the data files in former versions. Reopening a file
+ from any session or script skips the parsing and only maps the stored columns.
+
+ The key of an entry is calculated from the file content (or path, size and
+ modification time), the version of the modules used to read the file and the
+ reader options of the session. Entries are written to temporary files and
+ renamed afterwards, the removal of the least recently used entries, when the
+ cache exceeds its size limit, is locked to be safe for concurrent processes.
+'''
+
+import os
+import sys
+import inspect
+from hashlib import md5
+from types import ModuleType
+from cPickle import UnpicklingError
+import config.import_cache as cache_config
+from snapshots import SnapshotWriter, SnapshotReader
+try:
+  import fcntl
+except ImportError:
+  # no locking on windows
+  fcntl=None
+
+__author__="Artur Glavic"
+__credits__=[]
+from plotpy_info import __copyright__, __license__, __version__, __maintainer__, __email__ #@UnusedImport
+__status__="Development"
+
+ENTRY_SUFFIX='.mdc'
+HASH_BLOCK_SIZE=1024**2
+
+def file_identity(file_name):
+  '''
+    Return an object identifying the file, the hash of it's content
+    or the path, size and modification time.
+  '''
+  if cache_config.HASH_CONTENT:
+    hasher=md5()
+    input_file=open(file_name, 'rb')
+    try:
+      block=input_file.read(HASH_BLOCK_SIZE)
+      while block:
+        hasher.update(block)
+        block=input_file.read(HASH_BLOCK_SIZE)
+    finally:
+      input_file.close()
+    return ('content', hasher.hexdigest())
+  stat=os.stat(file_name)
+  return ('file', os.path.abspath(file_name), stat.st_size, stat.st_mtime)
+
+def module_version(module):
+  '''
+    Return the name, size and modification time of a module's source file.
+  '''
+  path=getattr(module, '__file__', None)
+  if path is None:
+    return (module.__name__, None)
+  if 'library.zip' in path:
+    path=path.split('library.zip')[0]+'library.zip'
+  elif path[-4:] in ['.pyc', '.pyo'] and os.path.exists(path[:-1]):
+    path=path[:-1]
+  try:
+    stat=os.stat(path)
+  except OSError:
+    return (module.__name__, None)
+  return (module.__name__, stat.st_size, stat.st_mtime)
+
+def reader_version(session):
+  '''
+    Return the version of all modules used by a session to read files.
+    These are the modules of the session class and it's parents, the
+    read_data modules they use and the data structure module.
+  '''
+  modules=[sys.modules['plot_script.measurement_data_structure']]
+  for cls in inspect.getmro(session.__class__):
+    module=sys.modules.get(cls.__module__)
+    if module is None or module in modules:
+      continue
+    modules.append(module)
+    for item in vars(module).values():
+      if type(item) is not ModuleType or not item.__name__.startswith('plot_script.read_data'):
+        continue
+      # packages are used with all submodules
+      used=[item]+[sub_module for name, sub_module in sys.modules.items()
+                   if name.startswith(item.__name__+'.') and sub_module is not None]
+      for used_module in used:
+        if not used_module in modules:
+          modules.append(used_module)
+  return [__version__]+sorted(map(module_version, modules))
+
+class ImportCache(object):
+  '''
+    Store the datasets imported from files in a cache folder with a limit
+    on the total size, the least recently used files are removed first.
+  '''
+
+  def __init__(self, cache_dir=None, byte_limit=None):
+    if cache_dir is None:
+      cache_dir=cache_config.CACHE_DIR
+    if byte_limit is None:
+      byte_limit=cache_config.CACHE_SIZE
+    self.cache_dir=cache_dir
+    self.byte_limit=byte_limit
+    self.hits=0
+    self.misses=0
+
+  def key(self, file_name, version, options):
+    '''
+      Return the cache key for a file read by a reader with given version and options.
+    '''
+    return md5(repr((file_identity(file_name), version, options))).hexdigest()
+
+  def entry_name(self, key):
+    return os.path.join(self.cache_dir, key+ENTRY_SUFFIX)
+
+  def get(self, key):
+    '''
+      Return the datasets stored for a key or None.
+    '''
+    entry_name=self.entry_name(key)
+    try:
+      datasets=SnapshotReader(entry_name).read()
+    except (IOError, OSError, EOFError, ValueError, UnpicklingError):
+      self.misses+=1
+      return None
+    self.hits+=1
+    try:
+      # mark the entry as recently used
+      os.utime(entry_name, None)
+    except OSError:
+      pass
+    return datasets
+
+  def put(self, key, datasets):
+    '''
+      Store the datasets for a key and remove old entries if the size limit is exceeded.
+
+      :return: If the datasets could be stored
+    '''
+    try:
+      if not os.path.exists(self.cache_dir):
+        os.makedirs(self.cache_dir)
+      SnapshotWriter(self.entry_name(key)).write(datasets)
+    except (IOError, OSError):
+      # the cache folder is not writable or another process created it
+      if not os.path.exists(self.entry_name(key)):
+        return False
+    self.evict()
+    return True
+
+  def _lock(self):
+    '''
+      Return the locked lock file of the cache folder.
+    '''
+    lock_file=open(os.path.join(self.cache_dir, '.lock'), 'a')
+    if fcntl is not None:
+      fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+    return lock_file
+
+  def _unlock(self, lock_file):
+    if fcntl is not None:
+      fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    lock_file.close()
+
+  def evict(self, byte_limit=None):
+    '''
+      Remove the least recently used entries until the cache is smaller than the limit.
+    '''
+    if byte_limit is None:
+      byte_limit=self.byte_limit
+    lock_file=self._lock()
+    try:
+      entries=[]
+      for name in os.listdir(self.cache_dir):
+        if not name.endswith(ENTRY_SUFFIX):
+          continue
+        entry_name=os.path.join(self.cache_dir, name)
+        try:
+          stat=os.stat(entry_name)
+        except OSError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, entry_name))
+      entries.sort()
+      size=sum([entry[1] for entry in entries])
+      for ignore, entry_size, entry_name in entries:
+        if size<=byte_limit:
+          break
+        try:
+          os.remove(entry_name)
+        except OSError:
+          # file still memory mapped on windows
+          continue
+        size-=entry_size
+    finally:
+      self._unlock(lock_file)
+
+  def clear(self):
+    '''
+      Remove all entries from the cache.
+    '''
+    if os.path.exists(self.cache_dir):
+      self.evict(0)
+
+# cache used by all sessions
+import_cache=ImportCache()
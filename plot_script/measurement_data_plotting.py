@@ -12,6 +12,13 @@ import os
 import sys
 exit=sys.exit #@ReservedAssignment
 import subprocess
+from glob import glob
+from time import time
+from select import select
+from traceback import format_exc
+from threading import Thread, Event, Timer, Lock
+from Queue import PriorityQueue
+from multiprocessing import cpu_count
 import plot_script.config.gnuplot_preferences as gp
 #from time import sleep
 
@@ -35,8 +42,21 @@ persistent_plot_instances=[]
 
 maps_with_projection=False
 
-# open an instance of gnuplot on first import
-gnuplot_instance=None
+# pool of gnuplot processes, started by the session
+gnuplot_pool=None
+# number of plots rendered asynchronously, used for unique file names
+async_plots=0
+# gnuplot commands to get the plot region in pixels and data coordinates
+PRINT_XY_RANGES="""
+      print GPVAL_TERM_XMIN
+      print GPVAL_TERM_XMAX
+      print GPVAL_TERM_YMIN
+      print GPVAL_TERM_YMAX
+      print GPVAL_X_MIN
+      print GPVAL_X_MAX
+      print GPVAL_Y_MIN
+      print GPVAL_Y_MAX
+      """
 
 def check_gnuplot_version(session):
   '''
@@ -93,7 +113,9 @@ def gnuplot_plot_script(session,
                         fit_lorentz=False,
                         sample_name=None,
                         show_persistent=False,
-                        get_xy_ranges=False):
+                        get_xy_ranges=False,
+                        callback=None,
+                        priority=0):
   '''
     Function to plot with an additional data and gnuplot file and calling to the gnuplot program.
     Files are stored in temporary folder set in gp.
@@ -106,31 +128,28 @@ def gnuplot_plot_script(session,
     :param output_file: File name for the output picture_height
     :param additional_info: Additional info string for the title
     :param fit_lorentz: Is a fit included in this measurement?
+    :param callback: Render asynchronously and call this function with the error message
+                     and printed values when finished
+    :param priority: Requests with lower values are rendered first
     
-    :return: Gnuplot error message or empty string
+    :return: Gnuplot error message or empty string and printed values,
+             the RenderRequest object if a callback is given
   '''
-  global gnuplot_instance
-  file_numbers=[]
   if show_persistent:
     global persistent_plots
     tmp_name='tmp_data_p-%i_'%persistent_plots
     persistent_plots+=1
     output_file_prefix=session.TEMP_DIR+tmp_name
+  elif callback is not None:
+    # data files of plots rendered at the same time need to be different
+    global async_plots
+    tmp_name='tmp_data_a-%i_'%async_plots
+    async_plots+=1
+    output_file_prefix=session.TEMP_DIR+tmp_name
   else:
     tmp_name='tmp_data_'
     output_file_prefix=session.TEMP_DIR+tmp_name
-  for j, dataset in enumerate(datasets):
-    for i, attachedset in enumerate(dataset.plot_together):
-      if getattr(attachedset, 'is_matrix_data', False):
-        file_numbers.append(str(j)+'-'+str(i))
-        attachedset.export_matrix(output_file_prefix+str(j)+'-'+str(i)+'.bin')
-      else:
-        file_numbers.append(str(j)+'-'+str(i))
-        attachedset.export(output_file_prefix+str(j)+'-'+str(i)+'.out')
-  if datasets[0].zdata>=0 and maps_with_projection:
-    # export data of projections
-    projections_name=output_file_prefix+file_numbers[0]+'.xy'
-    datasets[0].export_projections(projections_name)
+  binary_formats=export_plot_data(datasets, output_file_prefix)
   if not sample_name:
     sample_name=datasets[0].sample_name
   #if output_file is None:
@@ -151,18 +170,10 @@ def gnuplot_plot_script(session,
                                        fit_lorentz,
                                        output_file_prefix=output_file_prefix,
                                        sample_name=sample_name,
-                                       show_persistent=show_persistent)
+                                       show_persistent=show_persistent,
+                                       binary_formats=binary_formats)
   if get_xy_ranges:
-    gnuplot_file_text+="""
-      print GPVAL_TERM_XMIN
-      print GPVAL_TERM_XMAX
-      print GPVAL_TERM_YMIN
-      print GPVAL_TERM_YMAX
-      print GPVAL_X_MIN
-      print GPVAL_X_MAX
-      print GPVAL_Y_MIN
-      print GPVAL_Y_MAX
-      """
+    gnuplot_file_text+=PRINT_XY_RANGES
   if show_persistent:
     #write_file=open(script_name, 'w')
     #write_file.write(gnuplot_file_text+'\n')
@@ -182,18 +193,56 @@ def gnuplot_plot_script(session,
     except:
       raise RuntimeError, "\nProblem communicating with Gnuplot, please check your system settings! Gnuplot command used: %s"%session.GNUPLOT_COMMAND
     return '', []
-  try:
-    gnuplot_instance.stdin.write('reset\n')
-  except (IOError, ValueError), error:
-    # gnuplot instance closed due to an unknown problem
-    gnuplot_instance=None
-    raise RuntimeError, "gnuplot instance closed due to unknown problem: %s"%(error)
-  gnuplot_instance.stdin.write(gnuplot_file_text)
-  gnuplot_instance.stdin.write('\nset output\nprint "|||"\n')
-  output=gnuplot_instance.stdout.read(3)
-  while output[-3:]!='|||':
-    output+=gnuplot_instance.stdout.read(1)
-  output=output[:-3].strip()
+  if gnuplot_pool is None:
+    session.initialize_gnuplot()
+  if callback is not None:
+    return gnuplot_pool.submit(gnuplot_file_text, callback, priority=priority,
+                               file_prefix=output_file_prefix)
+  return gnuplot_pool.render(gnuplot_file_text)
+
+class GnuplotTimeout(RuntimeError):
+  '''
+    Gnuplot did not finish a script in the given time.
+  '''
+
+def run_gnuplot_script(instance, gnuplot_file_text, timeout=None):
+  '''
+    Send a script to a running gnuplot process and wait for it to be finished.
+    
+    :param timeout: Raise a GnuplotTimeout if the script is not finished after this time,
+                    only supported on posix systems
+    
+    :return: Gnuplot error message or empty string, list of printed values
+  '''
+  instance.stdin.write(gnuplot_file_text)
+  instance.stdin.write('\nset output\nprint "|||"\n')
+  instance.stdin.flush()
+  if os.name=='nt':
+    # select does not work with pipes on windows
+    output=instance.stdout.read(3)
+    while output[-3:]!='|||':
+      next_char=instance.stdout.read(1)
+      if next_char=='':
+        raise RuntimeError, "gnuplot instance closed during plotting"
+      output+=next_char
+    output=output[:-3]
+  else:
+    # read everything available until the end mark is received
+    fd=instance.stdout.fileno()
+    if timeout:
+      end_time=time()+timeout
+    output=''
+    while not '|||' in output:
+      if timeout:
+        remaining=end_time-time()
+        if remaining<=0 or not select([fd], [], [], remaining)[0]:
+          raise GnuplotTimeout, "gnuplot did not finish within %gs"%timeout
+      next_chars=os.read(fd, 4096)
+      if next_chars=='':
+        raise RuntimeError, "gnuplot instance closed during plotting"
+      output+=next_chars
+    output=output.split('|||')[0]
+  output=output.strip()
   if 'line' in output:
     return output, []
   else:
@@ -202,6 +251,236 @@ def gnuplot_plot_script(session,
     except ValueError:
       return output, []
 
+class RenderRequest(object):
+  '''
+    A script to be rendered by a GnuplotPool.
+  '''
+  output=''
+  variables=[]
+
+  def __init__(self, gnuplot_file_text, callback=None, timeout=None, file_prefix=None):
+    self.gnuplot_file_text=gnuplot_file_text
+    self.callback=callback
+    self.timeout=timeout
+    self.file_prefix=file_prefix
+    self.finished=Event()
+
+  def wait(self, timeout=None):
+    '''
+      Wait for the request to be finished.
+      
+      :return: Gnuplot error message or empty string, list of printed values
+    '''
+    self.finished.wait(timeout)
+    return self.output, self.variables
+
+  def remove_files(self):
+    '''
+      Remove the data files used by the script.
+    '''
+    if self.file_prefix is None:
+      return
+    for file_name in glob(self.file_prefix+'*'):
+      try:
+        os.remove(file_name)
+      except OSError:
+        pass
+
+class GnuplotWorker(object):
+  '''
+    One long running gnuplot process. The process is restarted after
+    a crash or when a script did not finish in time.
+  '''
+  process=None
+  timed_out=False
+
+  def __init__(self, command):
+    self.command=command
+    self._lock=Lock()
+
+  def start(self):
+    self.process=subprocess.Popen([self.command],
+                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                  shell=gp.EMMULATE_SHELL,
+                  creationflags=gp.PROCESS_FLAGS)
+    # set encoding once, it is not altered by the reset function
+    self.process.stdin.write('set encoding '+gp.ENCODING+'\n')
+
+  def kill(self, timed_out=True):
+    '''
+      Stop a gnuplot process that does not respond.
+    '''
+    self._lock.acquire()
+    try:
+      if self.process is not None:
+        self.timed_out=timed_out
+        try:
+          self.process.kill()
+          self.process.poll()
+        except OSError:
+          pass
+        self.process=None
+    finally:
+      self._lock.release()
+
+  def render(self, request):
+    '''
+      Run the script of a request and store the results in it, if
+      gnuplot crashes the script is retried once with a new process.
+    '''
+    for ignore in range(2):
+      self.timed_out=False
+      if self.process is None:
+        try:
+          self.start()
+        except (OSError, IOError), error:
+          self.kill(timed_out=False)
+          request.output, request.variables="could not start gnuplot: %s"%error, []
+          return
+      timer=None
+      try:
+        if request.timeout and os.name=='nt':
+          timer=Timer(request.timeout, self.kill)
+          timer.start()
+        self.process.stdin.write('reset\n')
+        request.output, request.variables=run_gnuplot_script(self.process,
+                                                             request.gnuplot_file_text,
+                                                             request.timeout)
+        return
+      except (IOError, OSError, ValueError, RuntimeError), error:
+        if isinstance(error, GnuplotTimeout):
+          self.kill()
+        else:
+          self.kill(timed_out=self.timed_out)
+        if self.timed_out:
+          request.output, request.variables="gnuplot did not finish within %gs"%request.timeout, []
+          return
+        request.output, request.variables="gnuplot instance closed due to unknown problem: %s"%error, []
+      finally:
+        if timer is not None:
+          timer.cancel()
+
+  def close(self):
+    if self.process is not None:
+      try:
+        self.process.stdin.write('exit\n')
+        self.process.communicate()
+      except (IOError, ValueError, OSError):
+        pass
+      self.process=None
+
+class GnuplotPool(object):
+  '''
+    A number of gnuplot processes rendering scripts from a request queue.
+    Requests can be rendered synchronously or asynchronously with a callback,
+    which is executed by the dispatch function (e.g. in the GUI main loop).
+  '''
+
+  def __init__(self, command, workers=None, dispatch=None):
+    if workers is None:
+      workers=gp.GNUPLOT_WORKERS or min(cpu_count(), 4)
+    self.queue=PriorityQueue()
+    self.requests=0
+    self.workers=[GnuplotWorker(command) for ignore in range(workers)]
+    # the first process is started directly to get errors in the calling thread
+    self.workers[0].start()
+    if dispatch is None:
+      dispatch=lambda function, *args: function(*args)
+    self.dispatch=dispatch
+    self.threads=[]
+    for worker in self.workers:
+      thread=Thread(target=self._run, args=(worker,))
+      thread.daemon=True
+      thread.start()
+      self.threads.append(thread)
+
+  def submit(self, gnuplot_file_text, callback=None, timeout=None, priority=0, file_prefix=None):
+    '''
+      Add a script to the queue.
+      
+      :param gnuplot_file_text: The script to render
+      :param callback: Function called with the error message and printed values when finished
+      :param timeout: Time in seconds after which the gnuplot process is killed
+      :param priority: Requests with lower values are rendered first
+      :param file_prefix: Prefix of data files to be removed after rendering
+      
+      :return: The RenderRequest object
+    '''
+    if timeout is None:
+      timeout=gp.RENDER_TIMEOUT
+    request=RenderRequest(gnuplot_file_text, callback, timeout, file_prefix)
+    self.requests+=1
+    self.queue.put((priority, self.requests, request))
+    return request
+
+  def render(self, gnuplot_file_text, timeout=None):
+    '''
+      Render a script and wait for the result.
+      
+      :return: Gnuplot error message or empty string, list of printed values
+    '''
+    return self.submit(gnuplot_file_text, timeout=timeout, priority=-1).wait()
+
+  def _run(self, worker):
+    '''
+      Render requests until None is received.
+    '''
+    while True:
+      ignore, ignore, request=self.queue.get()
+      if request is None:
+        break
+      # the request has to be finished in any case, as other threads wait for it
+      try:
+        worker.render(request)
+      except Exception, error:
+        request.output, request.variables="error while rendering: %s"%error, []
+      request.remove_files()
+      request.finished.set()
+      if request.callback is not None:
+        try:
+          self.dispatch(request.callback, request.output, request.variables)
+        except Exception:
+          print "Error in the callback of a plot request:\n"+format_exc()
+    worker.close()
+
+  def close(self):
+    '''
+      Finish all queued requests and stop the gnuplot processes.
+    '''
+    for ignore in self.threads:
+      self.requests+=1
+      self.queue.put((sys.maxint, self.requests, None))
+    for thread in self.threads:
+      thread.join()
+    self.threads=[]
+
+def export_plot_data(datasets, output_file_prefix):
+  '''
+    Export the data of all datasets and the attached datasets for plotting.
+    The files are named after the dataset number and the number in plot_together.
+    
+    :return: Dictionary of the binary clauses for files exported as binary
+  '''
+  file_numbers=[]
+  binary_formats={}
+  for j, dataset in enumerate(datasets):
+    for i, attachedset in enumerate(dataset.plot_together):
+      if getattr(attachedset, 'is_matrix_data', False):
+        file_numbers.append(str(j)+'-'+str(i))
+        attachedset.export_matrix(output_file_prefix+str(j)+'-'+str(i)+'.bin')
+      elif gp.binary_export:
+        file_numbers.append(str(j)+'-'+str(i))
+        binary_formats[str(j)+'-'+str(i)]=attachedset.export_binary(
+                                            output_file_prefix+str(j)+'-'+str(i)+'.dat')
+      else:
+        file_numbers.append(str(j)+'-'+str(i))
+        attachedset.export(output_file_prefix+str(j)+'-'+str(i)+'.out')
+  if datasets[0].zdata>=0 and maps_with_projection:
+    # export data of projections
+    projections_name=output_file_prefix+file_numbers[0]+'.xy'
+    datasets[0].export_projections(projections_name)
+  return binary_formats
+
 def replace_ph(session,
                string,
                datasets,
@@ -278,11 +557,15 @@ def create_plot_script(session,
                        fit_lorentz=False,
                        output_file_prefix=None,
                        sample_name=None,
-                       show_persistent=False
+                       show_persistent=False,
+                       binary_formats=None
                        ):
   '''
       Create a script for the gnuplot program.
       
+      :param binary_formats: Dictionary of file numbers which have been exported as binary
+                             files with the gnuplot binary clause as values
+      
       :return: The text of the script
   '''
   if output_file_prefix is None:
@@ -315,17 +598,21 @@ def create_plot_script(session,
   if datasets[0].zdata>=0:
     if maps_with_projection:
       gnuplot_file_text+=script_plotlines_3d_projection(session, datasets, file_name_prefix, output_file_prefix,
-                file_numbers, title, names, sample_name, postscript_export, additional_info, with_errorbars)
+                file_numbers, title, names, sample_name, postscript_export, additional_info, with_errorbars,
+                binary_formats)
     else:
       gnuplot_file_text+=script_plotlines_3d(session, datasets, file_name_prefix, output_file_prefix, file_numbers,
-                     title, names, sample_name, postscript_export, additional_info, with_errorbars)
+                     title, names, sample_name, postscript_export, additional_info, with_errorbars,
+                     binary_formats)
   else:
     gnuplot_file_text+=script_plotlines(session, datasets, file_name_prefix, output_file_prefix, file_numbers,
-                     title, names, sample_name, postscript_export, additional_info, with_errorbars)
+                     title, names, sample_name, postscript_export, additional_info, with_errorbars,
+                     binary_formats)
   return gnuplot_file_text
 
 def script_plotlines(session, datasets, file_name_prefix, output_file_prefix, file_numbers,
-                     title, names, sample_name, postscript_export, additional_info, with_errorbars):
+                     title, names, sample_name, postscript_export, additional_info, with_errorbars,
+                     binary_formats=None):
   '''
     Plot lines for 2d plots. (x vs. y)
   '''
@@ -345,7 +632,7 @@ def script_plotlines(session, datasets, file_name_prefix, output_file_prefix, fi
     using_cols=str(datasets[0].xdata+1)+':'+str(datasets[0].ydata+1)
   output_file_prefix=os.path.normpath(output_file_prefix)
   gnuplot_file_text+='# now the plotting function\n'+\
-        'plot "'+output_file_prefix+file_numbers[0]+'.out" u '+using_cols+\
+        'plot '+data_file(output_file_prefix, file_numbers[0], binary_formats)+' u '+using_cols+\
                 datasets[0].plot_options.special_using_parameters+\
                 ' t "'+gp.titles+'" '+\
                 (datasets[0].plot_options.special_plot_parameters or plotting_param)
@@ -376,8 +663,8 @@ def script_plotlines(session, datasets, file_name_prefix, output_file_prefix, fi
       else:
         plotting_param=gp.plotting_parameters
         using_cols=str(datasets[i].xdata+1)+':'+str(datasets[i].ydata+1)
-      gnuplot_file_text+=',\\\n"'+output_file_prefix+number+\
-          '.out" u '+using_cols+\
+      gnuplot_file_text+=',\\\n'+data_file(output_file_prefix, number, binary_formats)+\
+          ' u '+using_cols+\
           datasets[i].plot_options.special_using_parameters+\
           ' t "'+gp.titles+'" '+(datasets[i].plot_options.special_plot_parameters or plotting_param)
       gnuplot_file_text=replace_ph(session,
@@ -395,8 +682,8 @@ def script_plotlines(session, datasets, file_name_prefix, output_file_prefix, fi
       plotting_param=gp.plotting_parameters
       using_cols_woerror=str(datasets[i].plot_together[j].xdata+1)+':'+\
                           str(datasets[i].plot_together[j].ydata+1)
-      gnuplot_file_text+=',\\\n"'+output_file_prefix+number+\
-          '.out" u '+using_cols_woerror+' t "'+gp.titles+'" '+\
+      gnuplot_file_text+=',\\\n'+data_file(output_file_prefix, number, binary_formats)+\
+          ' u '+using_cols_woerror+' t "'+gp.titles+'" '+\
           (datasets[i].plot_together[j].plot_options.special_plot_parameters or plotting_param)
       gnuplot_file_text=replace_ph(session,
                                    gnuplot_file_text,
@@ -412,7 +699,8 @@ def script_plotlines(session, datasets, file_name_prefix, output_file_prefix, fi
   return gnuplot_file_text
 
 def script_plotlines_3d(session, datasets, file_name_prefix, output_file_prefix, file_numbers,
-                     title, names, sample_name, postscript_export, additional_info, with_errorbars):
+                     title, names, sample_name, postscript_export, additional_info, with_errorbars,
+                     binary_formats=None):
   '''
     Plot lines for 3d plots. (x,y vs. z)
   '''
@@ -427,7 +715,8 @@ def script_plotlines_3d(session, datasets, file_name_prefix, output_file_prefix,
   first_index=datasets[0].plot_together_zindex
   if first_index==-1:
     return gnuplot_file_text+script_plotlines_multiplot_3d(session, datasets, file_name_prefix, output_file_prefix,
-                      file_numbers, title, names, sample_name, postscript_export, additional_info, with_errorbars)
+                      file_numbers, title, names, sample_name, postscript_export, additional_info, with_errorbars,
+                      binary_formats)
   using_cols=str(datasets[0].plot_together[first_index].xdata+1)+':'+\
               str(datasets[0].plot_together[first_index].ydata+1)+':'+\
               str(datasets[0].plot_together[first_index].zdata+1)
@@ -437,7 +726,7 @@ def script_plotlines_3d(session, datasets, file_name_prefix, output_file_prefix,
         'plot "'+output_file_prefix+file_numbers[first_index]+'.bin" binary format="%float" u 1:2:3 w image t "'+gp.titles+'" '
   else:
     gnuplot_file_text+='# now the plotting function\n'+\
-        'splot "'+output_file_prefix+file_numbers[first_index]+'.out" u '+using_cols+\
+        'splot '+data_file(output_file_prefix, file_numbers[first_index], binary_formats)+' u '+using_cols+\
                 datasets[0].plot_options.special_using_parameters+\
                 ' t "'+gp.titles+'" '+\
                 (datasets[0].plot_options.special_plot_parameters or plotting_param)
@@ -463,8 +752,8 @@ def script_plotlines_3d(session, datasets, file_name_prefix, output_file_prefix,
         '.bin"  binary format="%float" u 1:2:3 t "'+gp.titles+'" '+\
           (datasets[i].plot_options.special_plot_parameters or plotting_param)
     else:
-      gnuplot_file_text+=',\\\n"'+output_file_prefix+number+\
-        '.out" u '+using_cols_woerror+' t "'+gp.titles+'" '+\
+      gnuplot_file_text+=',\\\n'+data_file(output_file_prefix, number, binary_formats)+\
+        ' u '+using_cols_woerror+' t "'+gp.titles+'" '+\
           (datasets[i].plot_options.special_plot_parameters or plotting_param)
     gnuplot_file_text=replace_ph(session,
                                  gnuplot_file_text,
@@ -480,7 +769,8 @@ def script_plotlines_3d(session, datasets, file_name_prefix, output_file_prefix,
   return gnuplot_file_text
 
 def script_plotlines_multiplot_3d(session, datasets, file_name_prefix, output_file_prefix,
-                    file_numbers, title, names, sample_name, postscript_export, additional_info, with_errorbars):
+                    file_numbers, title, names, sample_name, postscript_export, additional_info, with_errorbars,
+                    binary_formats=None):
   '''
     Plot lines for 3d plots as multiplot layout (data, fit, data-fit, log(data)-log(fit)). (x,y vs. z)
   '''
@@ -519,7 +809,7 @@ def script_plotlines_multiplot_3d(session, datasets, file_name_prefix, output_fi
       gnuplot_file_text+='# now the plotting function\n'+\
           'plot "'+output_file_prefix+file_numbers[i]+'.bin" binary format="%float" u 1:2:3 w image t "'+gp.titles+'"\n'
     else:
-      gnuplot_file_text+='splot "'+output_file_prefix+file_numbers[i]+'.out" u '+using_cols+\
+      gnuplot_file_text+='splot '+data_file(output_file_prefix, file_numbers[i], binary_formats)+' u '+using_cols+\
                   datasets[0].plot_options.special_using_parameters+\
                   ' t "'+gp.titles+'" '+\
                   (datasets[0].plot_options.special_plot_parameters or plotting_param)+'\n'
@@ -537,7 +827,8 @@ def script_plotlines_multiplot_3d(session, datasets, file_name_prefix, output_fi
   return gnuplot_file_text+'unset multiplot\n'
 
 def script_plotlines_3d_projection(session, datasets, file_name_prefix, output_file_prefix, file_numbers,
-                     title, names, sample_name, postscript_export, additional_info, with_errorbars):
+                     title, names, sample_name, postscript_export, additional_info, with_errorbars,
+                     binary_formats=None):
   '''
     Plot lines for 3d plots with projections on the axes. (x,y vs. z)
   '''
@@ -622,7 +913,7 @@ def script_plotlines_3d_projection(session, datasets, file_name_prefix, output_f
         'plot "'+output_file_prefix+file_numbers[0]+'.bin" binary format="%float" u 1:2:3 w image t "'+gp.titles+'" '
   else:
     gnuplot_file_text+='# now the plotting function\n'+\
-        'splot "'+output_file_prefix+file_numbers[0]+'.out" u '+using_cols+\
+        'splot '+data_file(output_file_prefix, file_numbers[0], binary_formats)+' u '+using_cols+\
                 datasets[0].plot_options.special_using_parameters+\
                 ' t "'+gp.titles+'" '+\
                 (datasets[0].plot_options.special_plot_parameters or plotting_param)
@@ -639,6 +930,15 @@ def script_plotlines_3d_projection(session, datasets, file_name_prefix, output_f
                              additional_info)
   return gnuplot_file_text+'\nunset multiplot'
 
+def data_file(output_file_prefix, number, binary_formats=None):
+  '''
+    Return the quoted data file name for one plot line, followed by the binary clause
+    if the dataset was exported as binary file.
+  '''
+  if binary_formats and number in binary_formats:
+    return '"'+output_file_prefix+number+'.dat" '+binary_formats[number]
+  return '"'+output_file_prefix+number+'.out"'
+
 def script_header(show_persistent, datasets, output_file):
   '''
     Create the header of the script with global settings.
@@ -7,12 +7,16 @@
 # Pleas do not make any changes here unless you know what you are doing.
 
 import os
+from itertools import count
 from shutil import copyfile
 from copy import deepcopy
 from cPickle import load, dump
+from collections import OrderedDict
+from weakref import ref
 import numpy
 from tempfile import gettempdir
 from config.transformations import known_unit_transformations
+from config.memory import SPILL_LIMIT, SPILL_DIR
 
 __author__="Artur Glavic"
 __credits__=[]
@@ -21,6 +25,8 @@ __status__="Production"
 
 hmd_file_number=0
 TEMP_DIR=gettempdir()
+# unique numbers for PhysicalProperty objects
+next_serial=count().next
 
 #++++++++++++++++++++++++++++++++++++++MeasurementData-Class+++++++++++++++++++++++++++++++++++++++++++++++++++++#
 class MeasurementData(object):
@@ -82,11 +88,26 @@ class MeasurementData(object):
   index=0
   # every data value is a pysical property
   def _get_data(self):
+    if self._point_buffer is not None:
+      self._freeze_points()
     return self._data_buffer
   def _set_data(self, value):
-    self._data_buffer=BufferList(value)
+    self._point_buffer=None
+    self._data_buffer=BufferList(value, getattr(value, '_manager', None))
+    self._data_version+=1
   data=property(_get_data, _set_data)
   _data_buffer=None
+  # counter of changes to the data not visible in the columns themselves
+  _data_version=0
+  # data matrix and filter mask, calculated when the data or filters change
+  _filter_cache=None
+  # x- and y-projections of 3d data, calculated when the data or plot ranges change
+  _projection_cache=None
+  # sort order and scan lines of the 3d export, calculated when the data changes
+  _export_layout_cache=None
+  # points added with append, which are not yet stored in the columns
+  _point_buffer=None
+  _point_errors=[]
   # for plotting the measurement select x and y data
   xdata=0
   ydata=0
@@ -166,35 +187,22 @@ class MeasurementData(object):
   def get_filtered_data_matrix(self):
     '''
       Return the data as numpy array with applied filters.
+      The array is cached until the data or the filters change,
+      so it is read only.
       
       :return: numpy array of point lists
     '''
-    # try:
-    data=numpy.vstack(self.data+[item.error for item in self.data if item.has_error])  # numpy.array([col.values for col in self.data])
-    # except ValueError:
-      # min_length=min([len(col.values) for col in self.data])
-      # data=numpy.array([col.values[:min_length] for col in self.data])
-    filters=self.filters
-    for data_filter in filters:
-      filter_column=data[data_filter[0]]
-      filter_from, filter_to=data_filter[1:3]
-      if filter_from>filter_to:
-        filter_from=data_filter[2]
-        filter_to=data_filter[1]
-      if data_filter[3]:
-        if filter_from is None:
-          filter_from=filter_column.min()
-        if filter_to is None:
-          filter_to=filter_column.max()
-        data_indices=numpy.where((filter_column>=filter_from)&(filter_column<=filter_to))
+    cache=self._get_filter_cache()
+    if cache['filtered'] is None:
+      if cache['matrix'] is None:
+        cache['matrix']=self._build_data_matrix()
+      if cache['unfiltered']:
+        cache['filtered']=cache['matrix']
       else:
-        if filter_from is None:
-          filter_from=filter_column.max()
-        if filter_to is None:
-          filter_to=filter_column.min()
-        data_indices=numpy.where((filter_column>=filter_to)|(filter_column<=filter_from))
-      data=data[:, data_indices[0]]
-    return data
+        filtered=cache['matrix'][:, cache['mask']]
+        filtered.flags.writeable=False
+        cache['filtered']=filtered
+    return cache['filtered']
 
   def get_filter_indices(self):
     '''
@@ -202,11 +210,85 @@ class MeasurementData(object):
       
       :return: numpy array of filters
     '''
-    data=numpy.vstack(self.data+[item.error for item in self.data if item.has_error])
-    # initialize true array
-    indices=(data[0]==data[0])
+    return self._get_filter_cache()['mask']
+
+  def get_filtered_column(self, index):
+    '''
+      Return the values of one column with applied filters.
+      If no point is filtered, this is a read only view of the column data.
+      
+      :param index: Index of the column in the data list
+      
+      :return: numpy array of the values
+    '''
+    cache=self._get_filter_cache()
+    column=self.data[index].view(numpy.ndarray)
+    if cache['unfiltered']:
+      column.flags.writeable=False
+      return column
+    return column[cache['mask']]
+
+  def data_changed(self):
+    '''
+      Mark the data as changed. Only needed after writing to the column arrays
+      directly with numpy functions, all changes made with PhysicalProperty
+      methods or by replacing columns are recognized automatically.
+    '''
+    self._data_version+=1
+
+  def _get_data_state(self):
+    '''
+      Return an object which changes when a column or the filters changed,
+      it contains the serial number, version and shape of the columns.
+    '''
+    return (self._data_version, repr(self.filters),
+            [(col._serial, col._version, col.shape, col.has_error) for col in self.data])
+
+  def _build_data_matrix(self):
+    '''
+      Return the read only matrix of all columns followed by the errors.
+    '''
+    columns=list(self.data)
+    matrix=numpy.vstack(columns+[col._error for col in columns if col.has_error])
+    matrix.flags.writeable=False
+    return matrix
+
+  def _get_filter_cache(self):
+    '''
+      Return the cached data matrix and filter mask. They are recalculated
+      when the data state changed, without filters the matrix is only
+      build when it is requested.
+    '''
+    state=self._get_data_state()
+    cache=self._filter_cache
+    if cache is not None and cache['state']==state:
+      return cache
+    if self.filters:
+      matrix=self._build_data_matrix()
+      mask=self._calculate_filter_mask(matrix)
+    else:
+      matrix=None
+      mask=numpy.ones(len(self), dtype=bool)
+    mask.flags.writeable=False
+    cache={
+           'state': state,
+           'matrix': matrix,
+           'mask': mask,
+           'unfiltered': bool(mask.all()),
+           'filtered': None,
+           }
+    self._filter_cache=cache
+    return cache
+
+  def _calculate_filter_mask(self, data):
+    '''
+      Apply all filters to the data matrix. Missing filter limits are
+      taken from the points left by the previous filters.
+      
+      :return: numpy array of filters
+    '''
+    indices=numpy.ones(data.shape[1], dtype=bool)
     filters=self.filters
-    lnot=numpy.logical_not
     for data_filter in filters:
       filter_column=data[data_filter[0]]
       filter_from, filter_to=data_filter[1:3]
@@ -215,16 +297,16 @@ class MeasurementData(object):
         filter_to=data_filter[1]
       if data_filter[3]:
         if filter_from is None:
-          filter_from=filter_column.min()
+          filter_from=filter_column[indices].min()
         if filter_to is None:
-          filter_to=filter_column.max()
+          filter_to=filter_column[indices].max()
         indices&=(filter_column>=filter_from)&(filter_column<=filter_to)
       else:
         if filter_from is None:
-          filter_from=filter_column.max()
+          filter_from=filter_column[indices].max()
         if filter_to is None:
-          filter_to=filter_column.min()
-        indices&=lnot((filter_column>=filter_from)&(filter_column<=filter_to))
+          filter_to=filter_column[indices].min()
+        indices&=(filter_column>=filter_to)|(filter_column<=filter_from)
     return indices
 
   def __getstate__(self):
@@ -233,38 +315,100 @@ class MeasurementData(object):
     '''
     self.preview=None
     self._functional=None
+    self._filter_cache=None
+    self._projection_cache=None
+    self._export_layout_cache=None
+    if self._point_buffer is not None:
+      self._freeze_points()
     return self.__dict__
 
   def __len__(self):
     '''
       len(MeasurementData) returns number of Datapoints.
     '''
-    try:
-      return len(self.data[0])
-    except IndexError:
-      return 0
+    return self.number_of_points
 
   def __getitem__(self, index):
     '''
       MeasurementData[index] returns one datapoint.
     '''
     if hasattr(index, '__iter__'):
-      output=deepcopy(self)
-      for i, col in enumerate(output.data):
-        output.data[i]=col[index]
-      return output
+      return self._get_subset(self._index_to_slice(index))
     else:
       return [float(col[index]) for col in self.data]+[col.error[index] for col in self.data if col.has_error]
 
   def __getslice__(self, start, end):
     '''
       MeasurementData[start:end] returns a MeasurementData instance with data columns in the given range.
+      The columns are read only views of the columns of this dataset.
+    '''
+    return self._get_subset(slice(start, end))
+
+  def _index_to_slice(self, index):
+    '''
+      Return a slice for boolean or integer indices selecting a contiguous
+      range of points, otherwise the unchanged index.
+    '''
+    indices=numpy.asarray(index)
+    if indices.ndim!=1 or len(indices)==0:
+      return index
+    if indices.dtype==bool:
+      if len(indices)!=len(self):
+        return index
+      indices=numpy.flatnonzero(indices)
+      if len(indices)==0:
+        return index
+    elif not numpy.issubdtype(indices.dtype, numpy.integer):
+      return index
+    if indices[0]<0 or (indices[-1]-indices[0])!=(len(indices)-1) or \
+        not (numpy.diff(indices)==1).all():
+      return index
+    return slice(int(indices[0]), int(indices[-1])+1)
+
+  def _get_subset(self, index):
+    '''
+      Return a new dataset with the points selected by index. For slices the columns
+      are views of this dataset's columns, other indices copy the selected points.
+      
+      A shared column is copied before one of the datasets changes or resizes
+      it (see PhysicalProperty.shared_slice).
+    '''
+    output=self._copy_metadata()
+    columns=[]
+    for col in self.data:
+      if type(index) is slice:
+        column=col.shared_slice(index.start, index.stop)
+      else:
+        column=col[index]
+      columns.append(column)
+    output.data=columns
+    return output
+
+  def _copy_metadata(self):
     '''
-    output=deepcopy(self)
-    for i, col in enumerate(output.data):
-      output.data[i]=col[start:end]
+      Return a copy of this dataset without the data columns and cached values.
+    '''
+    if self._point_buffer is not None:
+      self._freeze_points()
+    state=dict(self.__dict__)
+    for key in ['_data_buffer', '_filter_cache', '_projection_cache', '_export_layout_cache']:
+      state.pop(key, None)
+    state['preview']=None
+    state['_functional']=None
+    output=self.__class__.__new__(self.__class__)
+    output.__dict__=deepcopy(state, {id(self): output})
     return output
 
+  def _copy_unowned_columns(self):
+    '''
+      Replace the columns not owning their data by copies, before they get resized.
+    '''
+    data=self._data_buffer
+    for i in range(len(data)):
+      col=data[i]
+      if not col.flags.owndata:
+        data[i]=col.copy()
+
   def __setitem__(self, index, item):
     '''
       Set data at index reverse of __getitem__
@@ -446,8 +590,10 @@ class MeasurementData(object):
     self.__dict__=state
     if not hasattr(self, '_plot_options'):
       self._plot_options=PlotOptions()
-    for i, col in enumerate(self.data):
-      if col.__class__ is PysicalProperty:
+    # check the classes without loading columns not yet in memory
+    for i in range(len(self.data)):
+      if self.data.item_class(i) is PysicalProperty:
+        col=self.data[i]
         self.data[i]=PhysicalProperty(col.dimension, col.unit, col.values)
 
   def __call__(self, x):
@@ -545,10 +691,12 @@ class MeasurementData(object):
       self._yerror=index
 
   def _get_number_of_points(self):
-    if len(self.data)>0:
-      return len(self.data[0])
-    else:
+    # the point buffer is not frozen to allow fast appending
+    if len(self._data_buffer)==0:
       return 0
+    if self._point_buffer is None:
+      return len(self._data_buffer[0])
+    return len(self._data_buffer[0])+len(self._point_buffer)
 
   plot_options=property(_get_plot_options, _set_plot_options)
   yerror=property(_get_error, _set_error)
@@ -563,41 +711,103 @@ class MeasurementData(object):
 
   def append(self, point):
     '''
-      Add a point to this sequence.
+      Add a point to this sequence. The points are collected in a buffer
+      of growing capacity and added to the columns at once, when the
+      data is accessed the next time.
       
       :param point: List of entries by columns
       
       :return: The added point or 'NULL' if an error has occured
     '''
-    data=self.data  # speedup data_lookup
-    append_fast=PhysicalProperty.append
-    nop=self.number_of_points
-    if len(point)==len(data):
-      try:
-        for i, val in enumerate(point):
-          append_fast(data[i], val)
-      except ValueError, error:
-        # make sure the length of all columns is the same after encountering an error
-        for j in range(i):
-          data[j]=data[j][:nop]
-        raise ValueError, error
-      return point
-    elif len(point)==len(self.units()):
+    if self._point_buffer is None:
+      self._create_point_buffer(point)
+    self._point_buffer.append(self._point_row(point))
+    return point
+
+  def extend(self, points):
+    '''
+      Add several points to this sequence.
+      
+      :param points: 2d array of points with one row per point,
+                     each row has the same layout as for append
+    '''
+    if len(points)==0:
+      return
+    if self._point_buffer is None:
+      self._create_point_buffer(points[0])
+    if not hasattr(points, 'shape'):
+      points=map(self._point_row, points)
+    elif points.shape[1]!=self._point_buffer.num_columns:
+      points=map(self._point_row, points)
+    self._point_buffer.extend(points)
+
+  def _create_point_buffer(self, point):
+    '''
+      Create the buffer for appended points and define which columns
+      get error values, using the first point.
+    '''
+    data=self._data_buffer
+    errors=[col.has_error for col in data]
+    if len(point)==len(data) and self.number_of_points==0:
+      # columns without points get an error from (value, error) entries
+      for i, val in enumerate(point):
+        if hasattr(val, '__iter__') and len(val)==2:
+          errors[i]=True
+    self._point_errors=errors
+    self._point_buffer=GrowingArray(len(errors)+errors.count(True))
+
+  def _point_row(self, point):
+    '''
+      Return a point as row of the point buffer, the values of all
+      columns followed by the errors.
+    '''
+    errors=self._point_errors
+    if len(point)==len(errors):
+      if not True in errors:
+        return point
+      values=[]
+      error_values=[]
+      for val, has_error in zip(point, errors):
+        if not hasattr(val, '__iter__'):
+          if has_error:
+            raise ValueError, "need a value with corresponding error to append data"
+          values.append(val)
+        elif not has_error:
+          raise ValueError, "the input needs to be a scalar without error value"
+        elif len(val)!=2:
+          raise ValueError, "can only append scalar or iterable with length 2"
+        else:
+          values.append(val[0])
+          error_values.append(val[1])
+      return values+error_values
+    elif len(point)==self._point_buffer.num_columns:
       # point is a set of [val1,val2...]+[err1,err2...]
-      try:
-        for i, val in enumerate(point[:len(data)]):
-          if data[i].has_error:
-            append_fast(data[i], (val, point[len(data)+len([col for col in data[:i] if col.has_error])]))
-          else:
-            append_fast(data[i], val)
-      except ValueError, error:
-        # make sure the length of all columns is the same after encountering an error
-        for j in range(i):
-          data[j]=data[j][:nop]
-        raise ValueError, error
       return point
     else:
-      raise ValueError, 'can only append data with %i/%i items, input has %i'%(len(data), len(self.units()), len(point))
+      raise ValueError, 'can only append data with %i/%i items, input has %i'%(
+                                len(errors), self._point_buffer.num_columns, len(point))
+
+  def _freeze_points(self):
+    '''
+      Add the points in the buffer to the columns, each column is
+      only resized once.
+    '''
+    points=self._point_buffer.get_array()
+    self._point_buffer=None
+    if len(points)==0:
+      return
+    self._copy_unowned_columns()
+    data=self._data_buffer
+    j=len(self._point_errors)
+    for i, has_error in enumerate(self._point_errors):
+      col=data[i]
+      if has_error:
+        col.extend(points[:, i], points[:, j])
+        j+=1
+      else:
+        col.extend(points[:, i])
+      data[i]=col
+    self._data_version+=1
 
   def append_column(self, column, dimension="", unit=""):
     '''
@@ -613,6 +823,7 @@ class MeasurementData(object):
     else:
       col=PhysicalProperty(dimension, unit, column)
       self.data.append(col)
+    self._data_version+=1
 
   get_data=__getitem__
   set_data=__setitem__
@@ -957,13 +1168,74 @@ class MeasurementData(object):
         format_string="%.15g"
       else:
         format_string="%.7g"
+    data, split_indices=self.get_export_data(xfrom, xto, only_fitted_columns)
+    # write data to file
+    write_file=open(file_name, 'w')
+    if print_info:
+      write_file.write('# exportet dataset from measurement_data_structure.py\n# Sample: '+self.sample_name+\
+                       '\n#\n# other informations:\n#'+self.info.replace('\n', '\n#'))
+      columns=''
+      for i in range(len(self.data)):
+        columns=columns+' '+self.dimensions()[i]+'['+self.units()[i]+']'
+      write_file.write('#\n#\n# Begin of Dataoutput:\n#'+columns+'\n')
+    # Convert the data from matrix format to a string which can be written to a file
+    data_string=self.string_from_data_matrix(seperator, data, split_indices, format_string=format_string)
+    write_file.write(data_string)
+    write_file.write('\n')
+    write_file.close()
+    return data.shape[1]  # return the number of exported data lines
+
+  def export_binary(self, file_name, xfrom=None, xto=None, only_fitted_columns=False,
+                    dtype=None):
+    '''
+      Write the data as binary file of contiguous point records, as much faster
+      alternative to the text export used for gnuplot. The points are sorted and
+      split to scan lines the same way as for the text export.
+      
+      :param file_name: Name of the export file
+      :param xfrom: Start value of x for the export
+      :param xto: End value of x for the export
+      :param only_fitted_columns: Only export columns used for fitting.
+      :param dtype: numpy.float32 or numpy.float64, the default depends on the exported columns
+      
+      :return: The gnuplot binary clause to read the file, empty if the data was written as text
+    '''
+    data, split_indices=self.get_export_data(xfrom, xto, only_fitted_columns)
+    if data.shape[1]==0:
+      # gnuplot does not accept empty records
+      self.export(file_name, xfrom=xfrom, xto=xto, only_fitted_columns=only_fitted_columns)
+      return ''
+    if dtype is None:
+      if data.dtype==numpy.float32:
+        dtype=numpy.float32
+      else:
+        dtype=numpy.float64
+    cols=data.shape[0]
+    write_file=open(file_name, 'wb')
+    numpy.nan_to_num(data.transpose()).astype(dtype).tofile(write_file)
+    write_file.close()
+    # each scan line is one record, gnuplot treats them like blank line seperated blocks
+    records=numpy.diff([0]+split_indices)
+    if dtype==numpy.float64:
+      format_string='%double'*cols
+    else:
+      format_string='%float'*cols
+    return 'binary record=%s format="%s"'%(':'.join(map(str, records)), format_string)
+
+  def get_export_data(self, xfrom=None, xto=None, only_fitted_columns=False):
+    '''
+      Return the data matrix to be exported and the indices where scan lines end.
+      For 3d data the points are sorted to build up scan lines for gnuplot.
+      
+      :return: data matrix, list of split indices (the last is the number of points)
+    '''
     xd=self.xdata
     yd=self.ydata
     zd=self.zdata
     ed=self.yerror
     SPLIT_SENSITIVITY=self.SPLIT_SENSITIVITY
     data=self.get_filtered_data_matrix()
-    if not xto:
+    if not xto and data.shape[1]>0:
       xto=data[xd].max()
     data_window=numpy.where((data[xd]>=xfrom)&(data[xd]<=xto))[0]
     data=data[:, data_window]
@@ -973,6 +1245,8 @@ class MeasurementData(object):
       else:
         data=data[numpy.array([xd, yd, ed])]
     split_indices=numpy.array([])
+    if data.shape[1]==0:
+      return data, [0]
     if zd>=0:
       # crop data to prevent white holes in the plot
       if self.crop_zdata:
@@ -988,40 +1262,52 @@ class MeasurementData(object):
             absmin=1e-10
         data[zd]=numpy.where(data[zd]>=absmin, data[zd], absmin)
         data[zd]=numpy.where(data[zd]<=absmax, data[zd], absmax)
-      # get the best way to sort and split the data for gnuplot
-      if self.scan_line_constant<0:
-        x_sort_indices=self.rough_sort(data[xd], data[yd], SPLIT_SENSITIVITY)
-        y_sort_indices=self.rough_sort(data[yd], data[xd], SPLIT_SENSITIVITY)
-        sorted_x=data[:, x_sort_indices]
-        sorted_y=data[:, y_sort_indices]
-        split_indices_x=numpy.where(sorted_x[yd, :-1]<sorted_x[yd, 1:])[0]
-        split_indices_y=numpy.where(sorted_y[xd, :-1]<sorted_y[xd, 1:])[0]
-        if len(split_indices_x)<=len(split_indices_y):
-          split_indices=split_indices_x+1
-          data=sorted_x
-        else:
-          split_indices=split_indices_y+1
-          data=sorted_y
-      else:
-        sort_indices=self.rough_sort(data[self.scan_line_constant], data[self.scan_line], SPLIT_SENSITIVITY)
-        data=data[:, sort_indices]
-        split_indices=numpy.where(data[self.scan_line, :-1]<data[self.scan_line, 1:])[0]+1
+      # get the best way to sort and split the data for gnuplot,
+      # the layout only depends on the x and y values and is reused
+      state=(self._get_data_state(), xd, yd, xfrom, xto, only_fitted_columns,
+             self.scan_line_constant, self.scan_line, SPLIT_SENSITIVITY)
+      cache=self._export_layout_cache
+      if cache is None or cache['state']!=state:
+        sort_indices, split_indices=self.get_scan_line_layout(data, SPLIT_SENSITIVITY)
+        cache={
+               'state': state,
+               'sort_indices': sort_indices,
+               'split_indices': split_indices,
+               }
+        self._export_layout_cache=cache
+      data=data[:, cache['sort_indices']]
+      split_indices=cache['split_indices']
     split_indices=split_indices.tolist()+[len(data[0])]
-    # write data to file
-    write_file=open(file_name, 'w')
-    if print_info:
-      write_file.write('# exportet dataset from measurement_data_structure.py\n# Sample: '+self.sample_name+\
-                       '\n#\n# other informations:\n#'+self.info.replace('\n', '\n#'))
-      columns=''
-      for i in range(len(self.data)):
-        columns=columns+' '+self.dimensions()[i]+'['+self.units()[i]+']'
-      write_file.write('#\n#\n# Begin of Dataoutput:\n#'+columns+'\n')
-    # Convert the data from matrix format to a string which can be written to a file
-    data_string=self.string_from_data_matrix(seperator, data, split_indices, format_string=format_string)
-    write_file.write(data_string)
-    write_file.write('\n')
-    write_file.close()
-    return data.shape[1]  # return the number of exported data lines
+    return data, split_indices
+
+  def get_scan_line_layout(self, data, sensitivity):
+    '''
+      Return the sort order of the points of 3d data and the indices, where new scan lines
+      start. If no scan line columns are defined, the points are split along x or y,
+      whichever gives fewer scan lines.
+      
+      :param data: Data matrix with the x and y values
+      :param sensitivity: Relative step size of coordinates which are treated as equal
+      
+      :return: sorting indices, split indices
+    '''
+    xd=self.xdata
+    yd=self.ydata
+    if self.scan_line_constant<0:
+      x_sort_indices=self.rough_sort(data[xd], data[yd], sensitivity)
+      y_sort_indices=self.rough_sort(data[yd], data[xd], sensitivity)
+      sorted_y=data[yd, x_sort_indices]
+      sorted_x=data[xd, y_sort_indices]
+      split_indices_x=numpy.where(sorted_y[:-1]<sorted_y[1:])[0]
+      split_indices_y=numpy.where(sorted_x[:-1]<sorted_x[1:])[0]
+      if len(split_indices_x)<=len(split_indices_y):
+        return x_sort_indices, split_indices_x+1
+      else:
+        return y_sort_indices, split_indices_y+1
+    else:
+      sort_indices=self.rough_sort(data[self.scan_line_constant], data[self.scan_line], sensitivity)
+      sorted_line=data[self.scan_line, sort_indices]
+      return sort_indices, numpy.where(sorted_line[:-1]<sorted_line[1:])[0]+1
 
   def export_matrix(self, file_name):
     '''
@@ -1061,19 +1347,27 @@ class MeasurementData(object):
   def rough_sort(self, ds1, ds2, sensitivity):
     '''
       Return the sorting indices from a first and second column ignoring small
-      differences.
-    '''
-    srt_run1=numpy.argsort(ds1)
-    ds1_run1=ds1[srt_run1]
-    max_step=(ds1_run1[1:]-ds1_run1[:-1]).max()
-    abs_sensitivity=max_step*sensitivity
-    small_step_indices=numpy.where(((ds1_run1[1:]-ds1_run1[:-1])<abs_sensitivity)*((ds1_run1[:-1]-ds1_run1[1:])!=0))
-    for index in small_step_indices[0][1:]:
-      from_data=ds1_run1[index+1]
-      to_data=ds1_run1[index]
-      ds1=numpy.where(ds1==from_data, ds1, to_data)
-    srt_run2=numpy.lexsort(keys=(ds1, ds2))
-    return srt_run2
+      differences of the first column.
+    '''
+    return numpy.lexsort(keys=(self.quantize_column(ds1, sensitivity), ds2))
+
+  def quantize_column(self, values, sensitivity):
+    '''
+      Return labels for clusters of near-equal values. Values belong to one cluster,
+      if the step between them in the sorted column is smaller than sensitivity
+      times the largest step. The labels increase with the values.
+    '''
+    if len(values)<2:
+      return numpy.zeros(len(values), dtype=numpy.intp)
+    order=numpy.argsort(values, kind='mergesort')
+    steps=numpy.diff(values[order])
+    new_cluster=steps>=(steps.max()*sensitivity)
+    # equal values always belong to the same cluster
+    new_cluster&=(steps!=0)
+    labels=numpy.empty(len(values), dtype=numpy.intp)
+    labels[order[0]]=0
+    labels[order[1:]]=numpy.cumsum(new_cluster)
+    return labels
 
   def string_from_data_matrix(self, seperator, data, split_indices, format_string="%.15g"):
     '''
@@ -1131,78 +1425,137 @@ class MeasurementData(object):
     min_point=self.data[self.ydata].values.index(y[indices].min())
     return [self.data[self.xdata].values[min_point], self.data[self.ydata].values[min_point]]
 
-  def get_xprojection(self, numpoints):
+  def get_projections(self, numpoints=None):
     '''
-      Return the projection of 3d data on the x-axis.
+      Calculate the projections of 3d data on the x- and y-axis in one pass.
+      The points outside the xy plot range are ignored and the axes are binned
+      logarithmic when plotted on log scale. The result is cached until the
+      data, filters, plot ranges or binning change.
+      
+      :param numpoints: Number of bins, square root of the number of points if None
+      
+      :return: Dictionary with 'x' and 'y' projections, each a dictionary with
+               bin 'centers', z 'sum' and 'mean' with errors and point 'count'
     '''
     if self.zdata<0:
       raise TypeError, "Only 3d datasets can be used to calculate a projection."
+    plot_options=self.plot_options
+    state=(self._get_data_state(), bool(self.is_matrix_data), self.xdata, self.ydata, self.zdata,
+           tuple(plot_options.xrange), tuple(plot_options.yrange), self.logx, self.logy, numpoints)
+    cache=self._projection_cache
+    if cache is not None and cache['state']==state:
+      return cache['projections']
     # get the data columns
     if not self.is_matrix_data:
-      data=self.get_filtered_data_matrix()
-      x=data[self.xdata]
-      y=data[self.ydata]
-      z=data[self.zdata]
+      x=self.get_filtered_column(self.xdata)
+      y=self.get_filtered_column(self.ydata)
+      z=self.get_filtered_column(self.zdata)
+      if self.z.has_error:
+        dz=self.z.error
+        if not self._get_filter_cache()['unfiltered']:
+          dz=dz[self.get_filter_indices()]
+      else:
+        dz=None
     else:
       x=numpy.array(self.x, dtype=numpy.float32)
       y=numpy.array(self.y, dtype=numpy.float32)
       z=numpy.array(self.z, dtype=numpy.float32)
-    # filter the columns by xy-range
+      if self.z.has_error:
+        dz=numpy.array(self.z.error, dtype=numpy.float32)
+      else:
+        dz=None
+    # filter the columns by xy-range, the same mask is used for both projections
     result=numpy.ones(x.shape, dtype=bool)
-    if self.plot_options.xrange[0] is not None:
-      result&=(x>=self.plot_options.xrange[0])
-    if self.plot_options.xrange[1] is not None:
-      result&=(x<=self.plot_options.xrange[1])
-    if self.plot_options.yrange[0] is not None:
-      result&=(y>=self.plot_options.yrange[0])
-    if self.plot_options.yrange[1] is not None:
-      result&=(y<=self.plot_options.yrange[1])
-    x=x[result]
-    z=z[result]
+    if plot_options.xrange[0] is not None:
+      result&=(x>=plot_options.xrange[0])
+    if plot_options.xrange[1] is not None:
+      result&=(x<=plot_options.xrange[1])
+    if plot_options.yrange[0] is not None:
+      result&=(y>=plot_options.yrange[0])
+    if plot_options.yrange[1] is not None:
+      result&=(y<=plot_options.yrange[1])
+    if not result.all():
+      x=x[result]
+      y=y[result]
+      z=z[result]
+      if dz is not None:
+        dz=dz[result]
     if numpoints is None:
       numpoints=int(numpy.sqrt(len(x)))
-    projection, ignore=numpy.histogram(x, numpoints, weights=z)
-    counts, px=numpy.histogram(x, numpoints)
-    px=(px[:-1]+px[1:])/2.
-    py=projection/counts
-    return PhysicalProperty(self.x.dimension, self.x.unit, px), \
-            PhysicalProperty(self.z.dimension, self.z.unit, py)
+    numpoints=max(numpoints, 1)
+    if dz is not None:
+      dz2=dz*dz
+    else:
+      dz2=None
+    projections={
+           'x': self._project_on_axis(x, z, dz2, numpoints, self.logx),
+           'y': self._project_on_axis(y, z, dz2, numpoints, self.logy),
+           }
+    self._projection_cache={'state': state, 'projections': projections}
+    return projections
+
+  def _project_on_axis(self, axis, z, dz2, numpoints, log_binning=False):
+    '''
+      Sum the z values in equally sized bins of the axis values, one bincount
+      call for each of counts, sums and squared errors.
+    '''
+    if log_binning and len(axis)>0 and axis.min()>0:
+      binned=numpy.log10(axis)
+    else:
+      log_binning=False
+      binned=axis
+    if len(binned)>0:
+      first_edge=float(binned.min())
+      last_edge=float(binned.max())
+    else:
+      first_edge, last_edge=0., 1.
+    if first_edge==last_edge:
+      first_edge-=0.5
+      last_edge+=0.5
+    edges=numpy.linspace(first_edge, last_edge, numpoints+1,
+                         dtype=numpy.result_type(first_edge, last_edge, binned))
+    # bin index calculation as used by numpy.histogram
+    indices=((binned-first_edge)*(numpoints/(last_edge-first_edge))).astype(numpy.intp)
+    indices[indices==numpoints]-=1
+    indices[binned<edges[indices]]-=1
+    indices[(binned>=edges[indices+1])&(indices!=numpoints-1)]+=1
+    counts=numpy.bincount(indices, minlength=numpoints)
+    sums=numpy.bincount(indices, weights=z, minlength=numpoints)
+    if dz2 is not None:
+      sum_errors=numpy.sqrt(numpy.bincount(indices, weights=dz2, minlength=numpoints))
+    else:
+      sum_errors=numpy.zeros(numpoints)
+    old_settings=numpy.seterr(divide='ignore', invalid='ignore')
+    means=sums/counts
+    mean_errors=sum_errors/counts
+    numpy.seterr(**old_settings)
+    centers=(edges[:-1]+edges[1:])/2.
+    if log_binning:
+      centers=10.**centers
+    return {
+            'centers': centers,
+            'count': counts,
+            'sum': sums,
+            'sum_error': sum_errors,
+            'mean': means,
+            'mean_error': mean_errors,
+            }
+
+  def get_xprojection(self, numpoints):
+    '''
+      Return the projection of 3d data on the x-axis.
+    '''
+    projection=self.get_projections(numpoints)['x']
+    return PhysicalProperty(self.x.dimension, self.x.unit, projection['centers']), \
+            PhysicalProperty(self.z.dimension, self.z.unit, projection['mean'], projection['mean_error'])
 
   def get_yprojection(self, numpoints):
     '''
       Return the projection of 3d data on the y-axis.
     '''
-    if self.zdata<0:
-      raise TypeError, "Only 3d datasets can be used to calculate a projection."
-    if not self.is_matrix_data:
-      data=self.get_filtered_data_matrix()
-      x=data[self.xdata]
-      y=data[self.ydata]
-      z=data[self.zdata]
-    else:
-      x=numpy.array(self.x, dtype=numpy.float32)
-      y=numpy.array(self.y, dtype=numpy.float32)
-      z=numpy.array(self.z, dtype=numpy.float32)
-    # filter the columns by xy-range
-    result=numpy.ones(x.shape, dtype=bool)
-    if self.plot_options.xrange[0] is not None:
-      result&=(x>=self.plot_options.xrange[0])
-    if self.plot_options.xrange[1] is not None:
-      result&=(x<=self.plot_options.xrange[1])
-    if self.plot_options.yrange[0] is not None:
-      result&=(y>=self.plot_options.yrange[0])
-    if self.plot_options.yrange[1] is not None:
-      result&=(y<=self.plot_options.yrange[1])
-    y=y[result]
-    z=z[result]
-    if numpoints is None:
-      numpoints=int(numpy.sqrt(len(y)))
-    projection, ignore=numpy.histogram(y, numpoints, weights=z)
-    counts, px=numpy.histogram(y, numpoints)
-    px=(px[:-1]+px[1:])/2.
-    py=projection/counts
-    return PhysicalProperty(self.y.dimension, self.y.unit, px), \
-            PhysicalProperty(self.z.dimension, self.z.unit, py)
+    projection=self.get_projections(numpoints)['y']
+    return PhysicalProperty(self.y.dimension, self.y.unit, projection['centers']), \
+            PhysicalProperty(self.z.dimension, self.z.unit, projection['mean'], projection['mean_error'])
 
   def export_projections(self, file_name, numpoints=None):
     '''
@@ -1226,190 +1579,396 @@ class MeasurementData(object):
 #--------------------------------------MeasurementData-Class-----------------------------------------------------#
 
 
+class SpillManager(object):
+  '''
+    Keeps track of the arrays stored in BufferList objects and moves the
+    least recently used ones to temporary .npy files when the memory used by
+    all arrays exceeds a given limit. Spilled arrays are only read back
+    (memory mapped) when they get accessed the next time.
+    
+    The access order is stored in an OrderedDict, so every access is O(1).
+    The size of an array is taken from it's nbytes attribute, for
+    PhysicalProperty objects the error array is included.
+    
+    ======================    =================================================
+    Statistics                Description
+    ======================    =================================================
+    hits                      Number of accesses to items in memory
+    ----------------------    -------------------------------------------------
+    restores                  Number of accesses to items on disk
+    ----------------------    -------------------------------------------------
+    spills                    Number of items moved to disk
+    ----------------------    -------------------------------------------------
+    bytes_resident            Size of all items in memory
+    ----------------------    -------------------------------------------------
+    bytes_spilled             Size of all items on disk
+    ======================    =================================================
+  '''
+
+  def __init__(self, limit=SPILL_LIMIT, spill_dir=SPILL_DIR):
+    '''
+      :param limit: Number of bytes to keep in memory
+      :param spill_dir: Folder for spilled arrays, None uses TEMP_DIR
+    '''
+    self._cached_items=OrderedDict() # arrays in memory, last accessed at the end
+    self._item_sizes={} # size in bytes of the arrays in memory
+    self._stored_items={} # information about the arrays on disk
+    self._next_item=0 # the counter for item indices
+    self._limit=limit
+    self.spill_dir=spill_dir
+    self.bytes_resident=0
+    self.bytes_spilled=0
+    self.hits=0
+    self.restores=0
+    self.spills=0
+
+  def _get_limit(self):
+    return self._limit
+
+  def _set_limit(self, limit):
+    self._limit=limit
+    self._store_if_larger()
+
+  limit=property(_get_limit, _set_limit, None, "Size limit in bytes for items in memory")
+
+  @staticmethod
+  def item_size(item):
+    '''
+      Return the size in bytes of an array including it's error values.
+    '''
+    size=item.nbytes
+    error=getattr(item, '_error', None)
+    if error is not None:
+      size+=error.nbytes
+    return size
+
+  def statistics(self):
+    '''
+      Return a dictionary with the access statistics of this manager.
+    '''
+    return {
+            'items_resident': len(self._cached_items),
+            'items_spilled': len(self._stored_items),
+            'bytes_resident': self.bytes_resident,
+            'bytes_spilled': self.bytes_spilled,
+            'hits': self.hits,
+            'restores': self.restores,
+            'spills': self.spills,
+            }
+
+  def add(self, item):
+    '''
+      Add item to cached items and return the caching index.
+    '''
+    idx=self._next_item
+    self._next_item+=1
+    self._cached_items[idx]=item
+    size=self.item_size(item)
+    self._item_sizes[idx]=size
+    self.bytes_resident+=size
+    self._store_if_larger()
+    return idx
+
+  def add_stored(self, item_class, state, data, error=None):
+    '''
+      Add an item which is not loaded into memory before it gets accessed.
+      
+      :param item_class: Class of the item, e.g. PhysicalProperty
+      :param state: Dictionary of the item attributes or None
+      :param data: Memory mapped array with the values
+      :param error: Memory mapped array with the errors or None
+      
+      :return: The caching index
+    '''
+    idx=self._next_item
+    self._next_item+=1
+    size=data.nbytes
+    if error is not None:
+      size+=error.nbytes
+    self._stored_items[idx]={'data': data, 'error': error, 'size': size,
+                             'class': item_class, 'state': state}
+    self.bytes_spilled+=size
+    return idx
+
+  def item_class(self, idx):
+    '''
+      Return the class of an item without loading it from disk.
+    '''
+    if idx in self._stored_items:
+      return self._stored_items[idx]['class']
+    return self._cached_items[idx].__class__
+
+  def get(self, idx):
+    '''
+      Return an item from cache or load it from disk before.
+    '''
+    if idx in self._stored_items:
+      self._restore(idx)
+      self.restores+=1
+    else:
+      # move the item to the end of the access order,
+      # the size is updated as the array could have been changed in place
+      item=self._cached_items.pop(idx)
+      self._cached_items[idx]=item
+      size=self.item_size(item)
+      self.bytes_resident+=size-self._item_sizes[idx]
+      self._item_sizes[idx]=size
+      self.hits+=1
+    self._store_if_larger()
+    return self._cached_items[idx]
+
+  def set(self, idx, item):
+    '''
+      Exchange the value at a given index.
+    '''
+    self.remove(idx)
+    self._cached_items[idx]=item
+    size=self.item_size(item)
+    self._item_sizes[idx]=size
+    self.bytes_resident+=size
+    self._store_if_larger()
+
+  def remove(self, idx):
+    '''
+      Remove item from cache and disk.
+    '''
+    if idx in self._stored_items:
+      info=self._stored_items.pop(idx)
+      self.bytes_spilled-=info['size']
+      for source in (info['data'], info['error']):
+        if isinstance(source, basestring) and os.path.exists(source):
+          os.remove(source)
+    elif idx in self._cached_items:
+      del(self._cached_items[idx])
+      self.bytes_resident-=self._item_sizes.pop(idx)
+
+  def _get_name(self, idx, suffix=''):
+    # return a name for a given item in temporary path
+    spill_dir=self.spill_dir
+    if spill_dir is None:
+      spill_dir=TEMP_DIR
+    return os.path.join(spill_dir, "BufferListItem_%i_%x_%06i%s.npy"%(
+                                        os.getpid(), id(self), idx, suffix))
+
+  def _store(self, idx):
+    # move item from cache to disk
+    item=self._cached_items.pop(idx)
+    size=self._item_sizes.pop(idx)
+    info={'data': self._get_name(idx), 'error': None, 'size': size,
+          'class': item.__class__, 'state': None}
+    numpy.save(info['data'], item.view(numpy.ndarray))
+    if hasattr(item, '__dict__'):
+      state=dict(item.__dict__)
+      state.pop('_views', None)
+      state.pop('_shared', None)
+      error=state.pop('_error', None)
+      if error is not None:
+        info['error']=self._get_name(idx, '_error')
+        numpy.save(info['error'], error)
+      info['state']=state
+    self._stored_items[idx]=info
+    self.bytes_resident-=size
+    self.bytes_spilled+=size
+    self.spills+=1
+
+  def _restore(self, idx):
+    # move item from disk to cache
+    info=self._stored_items.pop(idx)
+    item=self._load_array(info['data'], info['class'])
+    if info['state'] is not None:
+      item.__dict__.update(info['state'])
+    if info['error'] is not None:
+      item._error=self._load_array(info['error'])
+    self._cached_items[idx]=item
+    self._item_sizes[idx]=info['size']
+    self.bytes_spilled-=info['size']
+    self.bytes_resident+=info['size']
+
+  @staticmethod
+  def _load_array(source, item_class=numpy.ndarray):
+    # spilled arrays are stored as .npy file names, other sources are
+    # memory mapped arrays (e.g. from snapshot files) which are only copied,
+    # the copy owns it's data so it can be resized
+    if isinstance(source, basestring):
+      item=numpy.ndarray.copy(numpy.load(source, mmap_mode='r').view(item_class))
+      os.remove(source)
+    else:
+      item=numpy.ndarray.copy(source.view(item_class))
+    return item
+
+  def _store_if_larger(self):
+    # save the items not accessed for the longest time,
+    # the last accessed item is always kept in memory
+    cached_items=self._cached_items
+    while self.bytes_resident>self._limit and len(cached_items)>1:
+      self._store(iter(cached_items).next())
+
+# the manager used by all BufferList objects if not specified otherwise
+spill_manager=SpillManager()
+
 class BufferList(object):
   '''
   A list object for arrays, storeing unused data to temporary files
   when hitting a size limit.
-  Every access the limit is checked and the data acessed lates is always
-  kept in memory.
+  The arrays are handled by a SpillManager, which is shared between
+  all BufferList objects by default.
   '''
-  
-  _stored_items={} # arrays on disk are stored here as filenames
-  _cached_items={} # arrays in memory are stored here
-  _access_order=[] # a list of the accessed items, last accessed are stored first
-  _next_item=0 # the counter for item indices
-  _limit=1024**1024**2 # size limit in bytes (1 GiB by default)
-  
-  def __init__(self, values):
+
+  def __init__(self, values, manager=None):
+    if manager is None:
+      manager=spill_manager
+    self._manager=manager
     self._associations=[]
     map(self.append, values)
-  
-  @classmethod
-  def _add_item(cls, item):
-    # add item to cached items and return the caching index
-    idx=cls._next_item
-    cls._cached_items[idx]=item
-    cls._next_item+=1
-    cls._access_order.insert(0, idx)
-    cls._store_if_larger()
-    return idx
-    
-  @classmethod
-  def _get_item(cls, idx):
-    # return an item from cache or load it from disk before
-    if idx in cls._stored_items:
-      cls._restore(idx)
-    else:
-      cls._access_order.remove(idx)
-      cls._access_order.insert(0, idx)      
-    item=cls._cached_items[idx]
-    cls._store_if_larger()
-    return item
-    
-  @classmethod
-  def _set_item(cls, idx, item):
-    # exchange the value at a given index
-    if idx in cls._stored_items:
-      cls._restore(idx)
-    cls._cached_items[idx]=item
-  
-  @classmethod
-  def _del_item(cls, idx):
-    # remove item from cache and disk
-    if idx in cls._stored_items:
-      cls._restore(idx)
-    cls._access_order.remove(idx)
-    del(cls._cached_items[idx])
-  
-  @classmethod
-  def _store(cls, idx):
-    # move item from cache to disk
-    if not idx in cls._cached_items:
-      raise IndexError, 'Item not in cache'
-    item=cls._cached_items[idx]
-    fname=cls._get_name(idx)
-    numpy.save(fname, item)
-    del(cls._cached_items[idx])
-    cls._stored_items[idx]=fname
-    cls._access_order.remove(idx)
 
-  @classmethod
-  def _restore(cls, idx):
-    # move item from disk to cache
-    if not idx in cls._stored_items:
-      raise IndexError, 'Item not on disk'
-    fname=cls._stored_items[idx]
-    item=numpy.load(fname)
-    os.remove(fname)
-    cls._cached_items[idx]=item
-    del(cls._stored_items[idx])
-    cls._access_order.insert(0, idx)
-  
-  @classmethod
-  def _size_in_memory(cls):
-    # Return size in bytes of all arrays in memory.
-    return sum([item.nbytes for item in cls._cached_items.values()])
-
-  @classmethod
-  def _get_name(cls, idx):
-    # return a name for a given item in temporary path
-    return os.path.join(TEMP_DIR, "BufferListItem_%06i.npy"%idx)     
-
-  @classmethod
-  def _store_if_larger(cls):
-    while cls._size_in_memory()>cls._limit:
-      # save the item not accessed for the longest time
-      cls._store(cls._access_order[-1])
-  
   def __getitem__(self, item):
     if type(item) is slice:
-      output_list=[]
-      for idx in self._associations[item.start:item.stop:item.step]:
-        output_list.append(BufferList._get_item(idx))
-      return BufferList(output_list)
+      get_item=self._manager.get
+      output_list=[get_item(idx) for idx in self._associations[item.start:item.stop:item.step]]
+      return BufferList(output_list, self._manager)
     else:
-      return BufferList._get_item(self._associations[item])
+      return self._manager.get(self._associations[item])
 
   def __setitem__(self, idx, item):
-    BufferList._set_item(self._associations[idx], item)
-  
+    self._manager.set(self._associations[idx], item)
+
   def __delitem__(self, idx):
-    BufferList._del_item(self._associations[idx])
-    self._associations.pop[idx]
-    
+    self._manager.remove(self._associations[idx])
+    self._associations.pop(idx)
+
   def __len__(self):
     return len(self._associations)
-  
+
   def __iter__(self):
+    get_item=self._manager.get
     for idx in self._associations:
-      yield BufferList._get_item(idx)
-  
+      yield get_item(idx)
+
   def append(self, item):
     if not hasattr(item, 'nbytes'):
       raise ValueError, "Can only store arrays"
-    # add an item to the list by storing it in the class and adding
+    # add an item to the list by storing it in the manager and adding
     # it's index to this objects associations list
-    self._associations.append(BufferList._add_item(item))
-  
+    self._associations.append(self._manager.add(item))
+
   def insert(self, idx, item):
     if not hasattr(item, 'nbytes'):
       raise ValueError, "Can only store arrays"
-    # add an item to the list by storing it in the class and adding
+    # add an item to the list by storing it in the manager and adding
     # it's index to this objects associations list
-    self._associations.insert(idx, BufferList._add_item(item))    
-  
+    self._associations.insert(idx, self._manager.add(item))
+
+  def append_stored(self, item_class, state, data, error=None):
+    '''
+      Append an item which is only loaded from the memory mapped
+      data when it is accessed the first time.
+    '''
+    self._associations.append(self._manager.add_stored(item_class, state,
+                                                       data, error))
+
+  def item_class(self, idx):
+    return self._manager.item_class(self._associations[idx])
+
   def pop(self, idx):
     item=self[idx]
     del(self[idx])
     return item
-  
+
   def index(self, item):
     return self.tolist().index(item)
-  
+
   def remove(self, item):
     idx=self.index(item)
     del(self[idx])
 
   def reverse(self):
     self._associations.reverse()
-    
+
   def tolist(self):
     return [item for item in self]
 
   def __add__(self, other):
     if isinstance(other, BufferList):
       other=other.tolist()
-    return BufferList(self.tolist()+other)
-  
+    return BufferList(self.tolist()+other, self._manager)
+
   def __eq__(self, other):
     return self.tolist()==other.tolist()
-  
+
   def __contains__(self, item):
     return item in self.tolist()
-  
+
   def __reversed__(self):
-    return BufferList(reversed(self.tolist()))
+    return BufferList(reversed(self.tolist()), self._manager)
 
   def __getstate__(self):
     return {'data': self.tolist()}
-  
+
   def __setstate__(self, state):
+    self._manager=spill_manager
     self._associations=[]
     map(self.append, state['data'])
 
   def __del__(self):
     '''
-      Remove all items from the class when object is deleted.
+      Remove all items from the manager when object is deleted.
     '''
-    map(BufferList._del_item, self._associations)
-    del(self._associations)
-  
+    manager=getattr(self, '_manager', None)
+    if manager is not None:
+      map(manager.remove, self._associations)
+    self._associations=[]
+
   def __str__(self):
     return str(self.tolist())
 
   def __repr__(self):
     return 'BufferList(%s)'%str(self)
-    
+
+class GrowingArray(object):
+  '''
+    A 2d array of rows which grows by doubling its capacity,
+    so appending single rows or blocks of rows is amortized O(1) per row.
+  '''
+
+  def __init__(self, num_columns, dtype=numpy.float64, capacity=1024):
+    self.num_columns=num_columns
+    self._data=numpy.empty((capacity, num_columns), dtype=dtype)
+    self._length=0
+
+  def __len__(self):
+    return self._length
+
+  def _reserve(self, length):
+    if length>len(self._data):
+      new_data=numpy.empty((max(length, 2*len(self._data)), self.num_columns),
+                           dtype=self._data.dtype)
+      new_data[:self._length]=self._data[:self._length]
+      self._data=new_data
+
+  def append(self, row):
+    '''
+      Append one row to the end of the data.
+    '''
+    length=self._length+1
+    self._reserve(length)
+    self._data[self._length]=row
+    self._length=length
+
+  def extend(self, rows):
+    '''
+      Append a 2d array of rows to the end of the data.
+    '''
+    length=self._length+len(rows)
+    self._reserve(length)
+    self._data[self._length:length]=rows
+    self._length=length
+
+  def get_array(self):
+    '''
+      Return the data as array of the exact size.
+    '''
+    return self._data[:self._length]
+
 
 #++++++++++++++++++++++++++++++++++++++    HugeMD-Class     +++++++++++++++++++++++++++++++++++++++++++++++++++++#
 
@@ -2272,9 +2831,11 @@ class LinkedList(list):
   '''
   link=None
 
-  def __init__(self, data):
+  def __init__(self, data, link=None):
     list.__init__(self, data)
-    self.link=data
+    if link is None:
+      link=data
+    self.link=link
 
   def __setitem__(self, index, item):
     list.__setitem__(self, index, item)
@@ -2753,6 +3314,80 @@ class PhysicalWarning(UserWarning):
     Warning raised when array operations don't make physical sense.
   '''
 
+class ErrorArray(numpy.ndarray):
+  '''
+    View of the error values returned by PhysicalProperty.error. Changing the
+    values in place marks the PhysicalProperty as changed, so data calculated
+    from it is recognized as outdated, and copies errors shared with other objects.
+  '''
+  # calculations with the errors return normal arrays
+  __array_priority__=-1.
+  owner=None  # : PhysicalProperty the errors belong to
+
+  def __array_finalize__(self, obj):
+    # views of the errors change the same values
+    if isinstance(obj, ErrorArray) and numpy.may_share_memory(self, obj):
+      self.owner=obj.owner
+    else:
+      self.owner=None
+
+  def __array_wrap__(self, out_arr, context=None):
+    if out_arr is self:
+      return self
+    out_arr=out_arr.view(numpy.ndarray)
+    if out_arr.ndim==0:
+      # reductions return scalars
+      return out_arr[()]
+    return out_arr
+
+  def __reduce__(self):
+    # stored errors are normal arrays
+    return self.view(numpy.ndarray).__reduce__()
+
+  def _changing(self):
+    '''
+      Mark the owner as changed and return the array to change. When the owner
+      had to copy errors shared with other objects, this is a view of the copy.
+    '''
+    owner=self.owner
+    if owner is None:
+      return self
+    owner._unshare_data()
+    owner.data_changed()
+    error=owner._error
+    if error is None or numpy.may_share_memory(self, error):
+      return self
+    if self.shape!=error.shape:
+      raise ValueError, "the errors have been copied, get them again from the error attribute"
+    return owner.error
+
+  def copy(self, *args, **opts):
+    '''
+      Return a copy of the values, which is independent of the PhysicalProperty.
+    '''
+    return numpy.ndarray.copy(self, *args, **opts).view(numpy.ndarray)
+
+  def __setitem__(self, i, item):
+    numpy.ndarray.__setitem__(self._changing(), i, item)
+
+  def __setslice__(self, i, j, items):
+    numpy.ndarray.__setslice__(self._changing(), i, j, items)
+
+  def __iadd__(self, other):
+    return numpy.ndarray.__iadd__(self._changing(), other)
+
+  def __isub__(self, other):
+    return numpy.ndarray.__isub__(self._changing(), other)
+
+  def __imul__(self, other):
+    return numpy.ndarray.__imul__(self._changing(), other)
+
+  def __idiv__(self, other):
+    return numpy.ndarray.__idiv__(self._changing(), other)
+
+  def __ipow__(self, other):
+    return numpy.ndarray.__ipow__(self._changing(), other)
+
 class PhysicalProperty(numpy.ndarray):
   '''
     Class for any physical property. Stores the data, unit and dimension
@@ -2792,6 +3427,10 @@ class PhysicalProperty(numpy.ndarray):
   '''
 
   unit_save=True  # : if true changes units after arithmetic operation and checks if correct
+  _version=0  # : counter of changes to the values, used to recognize altered data
+  _serial=-1  # : unique number of the array, as the id of an object can be reused
+  _views=None  # : weak references to the views of the data used by other objects
+  _shared=False  # : the data belongs to another array this view was created from
 
   def __new__(cls, dimension_in, unit_in, input_data=[], input_error=None, unit_save=True,
               dtype=numpy.float32):
@@ -2814,6 +3453,7 @@ class PhysicalProperty(numpy.ndarray):
     return obj
 
   def __array_finalize__(self, obj):
+    self._serial=next_serial()
     self.unit=getattr(obj, 'unit', PhysicalUnit(''))
     self.dimension=getattr(obj, 'dimension', "")
     self._error=getattr(obj, '_error', None)
@@ -2824,7 +3464,11 @@ class PhysicalProperty(numpy.ndarray):
       Method used by cPickle to get the object state
     '''
     state=list(numpy.ndarray.__reduce__(self))
-    state[2]=state[2]+tuple([self.__dict__])
+    attributes=dict(self.__dict__)
+    # the stored values are independent of other arrays
+    attributes.pop('_views', None)
+    attributes.pop('_shared', None)
+    state[2]=state[2]+tuple([attributes])
     return tuple(state)
 
   def __setstate__(self, state):
@@ -2833,14 +3477,69 @@ class PhysicalProperty(numpy.ndarray):
     '''
     numpy.ndarray.__setstate__(self, state[1:5])
     self.__dict__=state[5]
+    # the restored copy changes independent of the original
+    self._serial=next_serial()
 
   def asarray(self):
     return self.view(numpy.ndarray)
 
+  def data_changed(self):
+    '''
+      Mark the values as changed. Only needed after writing to the array
+      directly with numpy functions, as all methods of this class do it.
+    '''
+    self._version+=1
+
+  def shared_slice(self, start, stop):
+    '''
+      Return a view of the values and errors from start to stop, which is used by
+      another object. Before this array or the view is changed in place or resized,
+      the view gets its own copy of the data, so the change is not visible in the other.
+    '''
+    output=self[start:stop]
+    output._shared=True
+    views=[view for view in (self._views or []) if view() is not None]
+    views.append(ref(output))
+    self._views=views
+    return output
+
+  def _unshare_data(self, resize=False):
+    '''
+      Copy the data shared with other objects, before it gets changed.
+      
+      :param resize: The array gets resized, which is only possible if it owns the data
+    '''
+    if resize and not self.flags.owndata:
+      raise ValueError, "the data belongs to another array, only a copy can be resized"
+    if self._views is not None:
+      views=self._views
+      self._views=None
+      for view in views:
+        view=view()
+        if view is not None and view._shared:
+          view._copy_data()
+    if self._shared:
+      self._copy_data()
+
+  def _copy_data(self):
+    '''
+      Replace the memory of this view by a copy of the values and errors,
+      the object itself stays the same.
+    '''
+    self._shared=False
+    # views of this array use the same memory
+    self._unshare_data()
+    # like unpickled arrays the copy is a writable string buffer
+    numpy.ndarray.__setstate__(self, numpy.ndarray.__reduce__(self)[2])
+    if self.has_error:
+      self._error=numpy.array(self._error)
+
   def append(self, item):
     '''
       Append an item to the end of the data, if the array is to small it is enlarged.
     '''
+    self._unshare_data(resize=True)
+    self._version+=1
     if hasattr(item, 'dimension'):
       length=self.__len__()
       if self.has_error!=item.has_error:
@@ -2859,8 +3558,8 @@ class PhysicalProperty(numpy.ndarray):
           length=self.__len__()
           self.resize(length+1, refcheck=False)
           self.__setitem__(length, item[0])
-          self.error.resize(length+1, refcheck=False)
-          self.error.__setitem__(length, item[1])
+          self._error.resize(length+1, refcheck=False)
+          self._error.__setitem__(length, item[1])
         else:
           raise ValueError, "the input needs to be a scalar without error value"
       else:
@@ -2872,6 +3571,28 @@ class PhysicalProperty(numpy.ndarray):
       self.resize(length+1, refcheck=False)
       self.__setitem__(length, item)
 
+  def extend(self, values, errors=None):
+    '''
+      Append an array of values and errors to the end of the data,
+      the array is only enlarged once.
+    '''
+    self._unshare_data(resize=True)
+    self._version+=1
+    if errors is None:
+      if self.has_error:
+        raise ValueError, "need values with corresponding errors to append data"
+    elif not self.has_error:
+      if len(self)==0:
+        self.error=[]
+      else:
+        raise ValueError, "the input needs to be values without errors"
+    length=self.__len__()
+    self.resize(length+len(values), refcheck=False)
+    self.view(numpy.ndarray)[length:]=values
+    if errors is not None:
+      self._error.resize(length+len(values), refcheck=False)
+      self._error[length:]=errors
+
   def copy(self):
     '''
       Return a copy of self.
@@ -2923,9 +3644,11 @@ class PhysicalProperty(numpy.ndarray):
     '''
       Wrapper to simulate the old .values list
     '''
-    return LinkedList(self.view(numpy.ndarray))
+    return LinkedList(self.view(numpy.ndarray), self)
 
   def _set_values(self, values):
+    self._unshare_data(resize=True)
+    self._version+=1
     self.resize(len(values), refcheck=False)
     self.__setslice__(0, len(values), values)
     if self.has_error:
@@ -2935,13 +3658,28 @@ class PhysicalProperty(numpy.ndarray):
         # remove the error values, if the number of items differs
         self.error=None
 
+  def _changed_in_place(self, output):
+    '''
+      Keep the propagated errors of an augmented assignment, as the ufuncs
+      return them in a new view of the values.
+    '''
+    if output is not self:
+      self._error=output._error
+    return self
+
   def _get_has_error(self):
     return (self._error is not None)
 
   def _get_error(self):
-    return self._error
+    if self._error is None:
+      return None
+    # writing to the returned view changes the version of this array
+    output=self._error.view(ErrorArray)
+    output.owner=self
+    return output
 
   def _set_error(self, value):
+    self._version+=1
     if value is None:
       self._error=None
     else:
@@ -2967,6 +3705,7 @@ class PhysicalProperty(numpy.ndarray):
     if transfere[0]==self.unit:  # only transform if right 'from' parameter
       self.unit=PhysicalUnit(transfere[3])
       if self.has_error:
+        self._unshare_data()
         self._error*=transfere[1]
       self*=transfere[1]
       self+=transfere[2]
@@ -2983,6 +3722,7 @@ class PhysicalProperty(numpy.ndarray):
       self.unit=PhysicalUnit(transfere[5])
       self.dimension=transfere[4]
       if self.has_error:
+        self._unshare_data()
         self._error*=transfere[2]
       self*=transfere[2]
       self+=transfere[3]
@@ -3041,7 +3781,8 @@ class PhysicalProperty(numpy.ndarray):
     '''
       Get an item of the object.
     '''
-    if hasattr(item, '__iter__'):
+    if hasattr(item, '__iter__') or type(item) is slice:
+      # slices are views of the data
       output=numpy.ndarray.__getitem__(self, item).view(type(self))
     else:
       output=numpy.array([numpy.ndarray.__getitem__(self, item)]).view(type(self)).copy()
@@ -3066,6 +3807,8 @@ class PhysicalProperty(numpy.ndarray):
     '''
       Set an item of the object. If input and self has an error set this, too.
     '''
+    self._unshare_data()
+    self._version+=1
     numpy.ndarray.__setitem__(self, i, item)
     if hasattr(item, 'dimension') and (self.has_error and item.has_error):
       self._error.__setitem__(i, item.error)
@@ -3074,6 +3817,8 @@ class PhysicalProperty(numpy.ndarray):
     '''
       Define a slice from i to j. If input and self has an error set this, too.
     '''
+    self._unshare_data()
+    self._version+=1
     numpy.ndarray.__setslice__(self, i, j, items)
     if hasattr(items, 'dimension') and (self.has_error and items.has_error):
       self._error.__setslice__(i, j, items.error)
@@ -3153,13 +3898,15 @@ class PhysicalProperty(numpy.ndarray):
       
       :return: New instance of PhysicalProperty
     '''
+    self._unshare_data()
     if hasattr(other, 'unit'):
       if self.unit!=other.unit:
         try:
           other=other%self.unit
         except ValueError:
           raise ValueError, "Wrong unit, %s!=%s"%(self.unit, other.unit)
-    return numpy.ndarray.__iadd__(self, other)
+    self._version+=1
+    return self._changed_in_place(numpy.ndarray.__iadd__(self, other))
 
   def _radd__(self, other):
     return self+other
@@ -3188,13 +3935,15 @@ class PhysicalProperty(numpy.ndarray):
       
       :return: New instance of PhysicalProperty
     '''
+    self._unshare_data()
     if hasattr(other, 'unit'):
       if self.unit!=other.unit:
         try:
           other=other%self.unit
         except ValueError:
           raise ValueError, "Wrong unit, %s!=%s"%(self.unit, other.unit)
-    return numpy.ndarray.__isub__(self, other)
+    self._version+=1
+    return self._changed_in_place(numpy.ndarray.__isub__(self, other))
 
   def __rsub__(self, other):
     return-self+other
@@ -3218,9 +3967,11 @@ class PhysicalProperty(numpy.ndarray):
       
       :return: New instance of PhysicalProperty
     '''
+    self._unshare_data()
     if hasattr(other, 'unit'):
       self.unit*=other.unit
-    return numpy.ndarray.__imul__(self, other)
+    self._version+=1
+    return self._changed_in_place(numpy.ndarray.__imul__(self, other))
 
   def __rmul__(self, other):
     return self*other
@@ -3242,9 +3993,11 @@ class PhysicalProperty(numpy.ndarray):
       
       :return: New instance of PhysicalProperty
     '''
+    self._unshare_data()
     if hasattr(other, 'unit'):
       self.unit/=other.unit
-    return numpy.ndarray.__idiv__(self, other)
+    self._version+=1
+    return self._changed_in_place(numpy.ndarray.__idiv__(self, other))
 
   def __rdiv__(self, other):
     '''
@@ -3275,11 +4028,13 @@ class PhysicalProperty(numpy.ndarray):
       
       :return: This instance of PhysicalProperty altered
     '''
+    self._unshare_data()
     self.unit**=to_power
     if self.has_error and to_power in [2., 0.5]:
       # errorpropagation doesn't work properly for square and sqrt if done inline
       return self**to_power
-    return numpy.ndarray.__ipow__(self, to_power)
+    self._version+=1
+    return self._changed_in_place(numpy.ndarray.__ipow__(self, to_power))
 
   def __floordiv__(self, new_dim_unit):
     '''
@@ -1581,22 +1581,23 @@ class mpfit:
                         mperr=0
                         fjac=numpy.zeros(nall, dtype=float)
                         fjac[ifree]=1.0  # Specify which parameters need derivatives
-                        [status, fp]=self.call(fcn, xall, functkw, fjac=fjac)
+                        [status, fp, pderiv]=self.call(fcn, xall, functkw, fjac=fjac)
+                        if status<0:
+                                return None
+                        fjac=numpy.asarray(pderiv, dtype=float)
 
-                        if len(fjac)!=m*nall:
+                        if fjac.size!=m*nall:
                                 print 'ERROR: Derivative matrix was not computed properly.'
                                 return None
 
                         # This definition is consistent with CURVEFIT
                         # Sign error found (thanks Jesus Fernandez <fernande@irm.chu-caen.fr>)
-                        fjac.shape=[m, nall]
-                        fjac=-fjac
+                        fjac=-fjac.reshape(m, nall)
 
                         # Select only the free parameters
                         if len(ifree)<nall:
                                 fjac=fjac[:, ifree]
-                                fjac.shape=[m, n]
-                                return fjac
+                        return fjac
 
                 fjac=numpy.zeros([m, n], dtype=float)
 
@@ -2001,7 +2002,7 @@ class mpfit:
 
                 for j in range(n):
                         r[j:n, j]=r[j, j:n]
-                x=numpy.diagonal(r)
+                x=numpy.diagonal(r).copy()
                 wa=qtb.copy()
 
                 # Eliminate the diagonal matrix d using a givens rotation
@@ -1,6 +1,10 @@
 # -*- encoding: utf-8 -*-
 '''
- Functions to parallelize some functions of the program using the IPython multiprocessing features.
+ Functions to parallelize some functions of the program using local worker processes
+ or the IPython multiprocessing features.
+ 
+ Both backends are used through the module variable dview, which supports
+ execute, scatter, gather and item access for variables on all workers.
 '''
 
 __author__="Artur Glavic"
@@ -8,18 +12,22 @@ __credits__=[]
 from plotpy_info import __copyright__, __license__, __version__, __maintainer__, __email__ #@UnusedImport
 __status__="Development"
 
-from plot_script.config.parallel import CLIENT_KW, CLUSTER_PLOTPY_DIR
+from plot_script.config.parallel import CLIENT_KW, CLUSTER_PLOTPY_DIR, WORKERS, \
+                                        USE_IPCLUSTER, SHARED_MEMORY_DIR
 from plot_script.config import user_config
 if not 'Parallel' in user_config:
   user_config['Parallel']=CLIENT_KW
 
+import os
 import sys
 import numpy
-from time import sleep
-#try:
-#  import multiprocessing
-#except ImportError:
-multiprocessing=None
+from cPickle import dumps, loads
+from tempfile import mkstemp
+from traceback import format_exc
+try:
+  import multiprocessing
+except ImportError:
+  multiprocessing=None
 
 client=None
 dview=None
@@ -27,7 +35,31 @@ lview=None
 
 additional_actions=[]
 
+general_actions=[
+            'import numpy',
+            'import sys',
+            'import os',
+            'if not "%s" in sys.path: sys.path.append("%s");'%(CLUSTER_PLOTPY_DIR,
+                                                               CLUSTER_PLOTPY_DIR),
+            'import plot_script.plugins',
+            "user_folder=os.path.join(os.path.expanduser('~'), '.plotting_gui')",
+            '''if os.path.exists(user_folder) and os.path.exists(os.path.join(user_folder, 'plugins')) \
+and not os.path.join(user_folder, 'plugins') in sys.path: \
+sys.path.append(os.path.join(user_folder, 'plugins'));''',
+            'import plot_script.fit_data as fit_data',
+            ]
+
 def connect():
+  '''
+    Start the local worker processes or connect to the IPython cluster,
+    if configured.
+  '''
+  if USE_IPCLUSTER or multiprocessing is None:
+    return connect_cluster()
+  else:
+    return connect_processes()
+
+def connect_cluster():
   print "Initializing IPython parallel processing..."
   global client, dview, lview
   from IPython.parallel import Client
@@ -45,22 +77,9 @@ def connect():
   lview.block=True
   # prepare the client with the most common used modules
   print "\tpreparing necessary modules..."
-  general=[
-            'import numpy',
-            'import sys',
-            'import os',
-            'if not "%s" in sys.path: sys.path.append("%s");'%(CLUSTER_PLOTPY_DIR,
-                                                               CLUSTER_PLOTPY_DIR),
-            'import plot_script.plugins',
-            "user_folder=os.path.join(os.path.expanduser('~'), '.plotting_gui')",
-            '''if os.path.exists(user_folder) and os.path.exists(os.path.join(user_folder, 'plugins')) \
-and not os.path.join(user_folder, 'plugins') in sys.path: \
-sys.path.append(os.path.join(user_folder, 'plugins'));''',
-            'import plot_script.fit_data as fit_data',
-            ]
   l=0
   sys.stdout.write('\t\t')
-  for action in general+additional_actions:
+  for action in general_actions+additional_actions:
     sys.stdout.write('\b'*l+action)
     sys.stdout.flush()
     l=len(action)
@@ -72,8 +91,25 @@ sys.path.append(os.path.join(user_folder, 'plugins'));''',
   print "\n\tFinished!"
   return True
 
+def connect_processes():
+  global dview
+  if WORKERS is None:
+    workers=multiprocessing.cpu_count()
+  else:
+    workers=WORKERS
+  print "Initializing parallel processing with %i local processes..."%workers
+  try:
+    dview=Controller(workers, general_actions+additional_actions)
+  except RemoteError, error:
+    print "Could not prepare the worker processes:\n  %s"%error
+    return False
+  print "\tFinished!"
+  return True
+
 def disconnect():
   global client, dview, lview
+  if type(dview) is Controller:
+    dview.close()
   client=None
   dview=None
   lview=None
@@ -83,7 +119,7 @@ def add_actions(actions):
   global additional_actions
   if dview is None:
     additional_actions+=actions
-  elif not type(dview) is Controller:
+  elif type(dview) is Controller:
     for action in actions:
       if not action in additional_actions:
         additional_actions.append(action)
@@ -99,149 +135,148 @@ def add_actions(actions):
           print "Encountered an error on the remote machine!"
           e.raise_exception()
 
+class RemoteError(Exception):
+  '''
+    Exception raised in a worker process.
+  '''
+
+def _worker_loop(connection):
+  '''
+    Main loop of a worker process, executes the commands received from
+    the Controller in its own namespace and sends back the result.
+  '''
+  namespace={'__name__': '__parallel__'}
+  while True:
+    command=connection.recv()
+    action=command[0]
+    if action=='stop':
+      break
+    result=None
+    try:
+      if action=='execute':
+        exec command[1] in namespace
+      elif action=='set':
+        namespace[command[1]]=loads(command[2])
+      elif action=='share':
+        key, file_name, start, end=command[1:]
+        # only the memory mapped slice of the array is used
+        namespace[key]=numpy.asarray(numpy.load(file_name, mmap_mode='r')[start:end])
+      elif action=='get':
+        result=namespace[command[1]]
+      connection.send(('ok', result))
+    except Exception, error:
+      connection.send(('error', "%s: %s\n%s"%(type(error).__name__, error, format_exc())))
+
+class Controller(object):
+  '''
+    Controller for local worker processes. It is a replacement for the
+    IPython direct view, each worker keeps its own namespace.
+    Numpy arrays are scattered through a memory mapped file, so the
+    workers do not need to unpickle a copy of the data.
+  '''
+  # files mapped by the workers can't be removed on windows, so the arrays are pickled
+  share_arrays=(os.name!='nt')
+
+  def __init__(self, workers=None, startup_actions=[]):
+    if workers is None:
+      workers=multiprocessing.cpu_count()
+    self.workers=[]
+    for ignore in range(workers):
+      connection, worker_connection=multiprocessing.Pipe()
+      process=multiprocessing.Process(target=_worker_loop, args=(worker_connection,))
+      process.daemon=True
+      process.start()
+      self.workers.append((process, connection))
+    try:
+      for action in startup_actions:
+        self.execute(action)
+    except RemoteError:
+      self.close()
+      raise
 
-if multiprocessing is not None:
-  # equivalent multiprocessing interface
-  manager=multiprocessing.Manager()
-  class Worker(multiprocessing.Process):
+  def _call(self, commands):
     '''
-      Thread which executes arbitrary code from a never ending main loop.
+      Send one command to each worker and wait for all results.
     '''
+    for (ignore, connection), command in zip(self.workers, commands):
+      connection.send(command)
+    results=[]
+    errors=[]
+    for i, (process, connection) in enumerate(self.workers):
+      try:
+        status, result=connection.recv()
+      except EOFError:
+        status, result='error', 'worker process %i terminated'%process.pid
+      if status=='error':
+        errors.append('[Engine %i] %s'%(i, result))
+      results.append(result)
+    if len(errors)>0:
+      raise RemoteError, "\n".join(errors)
+    return results
+
+  def execute(self, action):
+    self._call([('execute', action)]*len(self.workers))
+
+  def __getitem__(self, key):
+    return self._call([('get', key)]*len(self.workers))
+
+  def __setitem__(self, key, value):
+    value=dumps(value, 2)
+    self._call([('set', key, value)]*len(self.workers))
 
-    def __init__(self, globals_={}, locals_={}):
-      self.locals=manager.dict(locals_)
-      self.globals=manager.dict(globals_)
-      self._options=manager.dict(
-                                execute=False,
-                                finished=True,
-                                stay_alive=True,
-                                ex_action='',
-                                last_exception=None,
-                                  )
-      multiprocessing.Process.__init__(self)
-
-    def run(self):
-      '''
-        Start the threads main loop.
-      '''
-      while self._options['stay_alive']:
-        if self._options['execute']:
-          self._do_execution()
-          self._options['execute']=False
-          self._options['finished']=True
-        else:
-          sleep(0.001)
-
-    def execute(self, action):
-      '''
-        Define the next action to be executed.
-      '''
-      self._options['ex_action']=action
-      self._options['finished']=False
-      self._options['last_exception']=None
-      self._options['execute']=True
-
-    def _do_execution(self):
+  def scatter(self, key, value):
+    N=len(self.workers)
+    L=len(value)
+    step=(L+N-1)//N
+    if self.share_arrays and type(value) is numpy.ndarray and not value.dtype.hasobject:
+      file_name=self._share_array(value)
       try:
-        global_dict=dict(self.globals)
-        local_dict=dict(self.locals)
-        exec self._options['ex_action'] in global_dict, local_dict
-        for key, value in global_dict.items():
-          if key!='__builtins__':
-            self.globals[key]=value
-        for key, value in local_dict.items():
-          if key!='__builtins__':
-            self.locals[key]=value
-      except Exception, error:
-        self._options['last_exception']=error
-
-  class Controller(object):
+        self._call([('share', key, file_name, i*step, (i+1)*step) for i in range(N)])
+      finally:
+        # the workers keep their maps open, which is only possible on posix systems
+        os.remove(file_name)
+    else:
+      self._call([('set', key, dumps(value[i*step:(i+1)*step], 2)) for i in range(N)])
+
+  def _share_array(self, value):
     '''
-      Worker thread controller object. Should be a replacement for the ipython
-      direct view of the multiprocessing facility.
+      Write an array to a file in shared memory, which is mapped by the workers.
     '''
+    if os.path.isdir(SHARED_MEMORY_DIR):
+      shared_dir=SHARED_MEMORY_DIR
+    else:
+      shared_dir=None
+    handle, file_name=mkstemp(prefix='plotpy_', suffix='.npy', dir=shared_dir)
+    os.close(handle)
+    shared=numpy.lib.format.open_memmap(file_name, mode='w+',
+                                        dtype=value.dtype, shape=value.shape)
+    shared[...]=value
+    del(shared)
+    return file_name
 
-    def __init__(self, max_threads=multiprocessing.cpu_count(), startup_actions=[]):
-      self.max_threads=max_threads
-      self.workers=[]
-      w0=Worker()
-      w0.start()
-      for action in startup_actions:
-        print action
-        w0.execute(action)
-        while not w0._finished:
-          sleep(0.001)
-      self.workers.append(w0)
-      for ignore in range(max_threads-1):
-        wi=Worker(w0.globals, w0.locals)
-        wi.start()
-        self.workers.append(wi)
-
-    def execute(self, action):
-      for worker in self.workers:
-        worker.execute(action)
-      while not all(map(lambda w: w._finished, self.workers)):
-        sleep(0.001)
-      # check for errors
-      for worker in self.workers:
-        if worker.last_exception is not None:
-          raise worker.last_exception.__class__, worker.last_exception.message
-
-    def __getitem__(self, key):
+  def gather(self, key):
+    outputs=self[key]
+    if type(outputs[0]) is list:
       output=[]
-      for worker in self.workers:
-        if key in worker.locals:
-          output.append(worker.locals[key])
-      return output
-
-    def __setitem__(self, key, value):
-      for worker in self.workers:
-        worker.locals[key]=value
-
-    def scatter(self, key, value):
-      N=len(self.workers)
-      L=len(value)
-      step=(L+N-1)//N
-      for i in range(N):
-        self.workers[i].locals[key]=value[i*step:(i+1)*step]
-
-    def gather(self, key):
-      output=self.workers[0].locals[key]
-      if type(output) is list:
-        output=list(output)
-        for worker in self.workers[1:]:
-          output+=worker.locals[key]
-      elif type(output) is numpy.ndarray:
-        output=output.copy()
-        for worker in self.workers[1:]:
-          output=numpy.append(output, worker.locals[key])
-      else:
-        raise NotImplementedError, 'only list and arrays are supported'
-      return output
-
-
-
-
-  def connect_threads():
-    global dview
-    print "Initializing threadding with %i threads..."%cpu_count() #@UndefinedVariable
-    general=[
-              'import numpy',
-              'import sys',
-              'import os',
-              'if not "%s" in sys.path: sys.path.append("%s");'%(CLUSTER_PLOTPY_DIR,
-                                                                 CLUSTER_PLOTPY_DIR),
-              'import plugins',
-              "user_folder=os.path.join(os.path.expanduser('~'), '.plotting_gui')",
-              '''if os.path.exists(user_folder) and os.path.exists(os.path.join(user_folder, 'plugins')) \
-  and not os.path.join(user_folder, 'plugins') in sys.path: \
-  sys.path.append(os.path.join(user_folder, 'plugins'));''',
-              'import fit_data',
-              ]
-    dview=Controller(startup_actions=general+additional_actions)
-    print "\n\tFinished!"
-
-
-else:
-  class Controller(object):
-    pass
\ No newline at end of file
+      for item in outputs:
+        output+=item
+    elif isinstance(outputs[0], numpy.ndarray):
+      output=numpy.concatenate(outputs)
+    else:
+      raise NotImplementedError, 'only list and arrays are supported'
+    return output
+
+  def close(self):
+    '''
+      Stop all worker processes.
+    '''
+    for process, connection in self.workers:
+      try:
+        connection.send(('stop',))
+      except IOError:
+        pass
+    for process, connection in self.workers:
+      process.join(1.)
+      if process.is_alive():
+        process.terminate()
+    self.workers=[]
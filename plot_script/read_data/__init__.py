@@ -6,19 +6,23 @@
 '''
 
 import os
+from collections import deque
+from itertools import chain
 
-from numpy import array, float32
+from numpy import array, float32, empty, fromstring, dtype as dtype_
 from qtiplot import read_data as read_qti
 from plot_script.option_types import *
 
 try: # For the use in external programs where no MeasurementData objects are available
-  from plot_script.measurement_data_structure import MeasurementData, PhysicalProperty
+  from plot_script.measurement_data_structure import MeasurementData, PhysicalProperty, GrowingArray
   CREATE_MDS=True
 except ImportError:
   CREATE_MDS=False
   config=None
 
 defined_filters=[]
+# files larger than this number of bytes are read in streaming mode
+STREAMING_FILE_SIZE=100*1024**2
 
 GENERIC_FORMATS={
       '.qti': ('QtiPlot', read_qti),
@@ -53,10 +57,12 @@ class AsciiImportFilter(object):
   separator=None
 
   # options to enamle fast readout on cost of stability
-  disable_datacheck=False # don't check if all data lines contain float values
-  skip_colcheck=False     # don't check if each line has the same number of columns
-                          # ignored if disable_datacheck is True
+  disable_datacheck=False # don't check the number of columns of each line and raise
+                          # an error instead of checking each line if the fast conversion fails
+  skip_colcheck=False     # don't check the number of columns of each line before the
+                          # fast conversion, only use for files without missing values
   skip_linestripping=False# don't strip empty strings from each line
+  data_dtype='float32'    # numpy type of the data, 'float64' for higher precision
 
   # define the columns to plot
   select_x=0
@@ -75,6 +81,7 @@ class AsciiImportFilter(object):
   _extracted_data={}
   _header_columns=[]
   _file_data=""
+  _bad_lines=[]
 
 
   def __init__(self, name, presets=None):
@@ -163,6 +170,7 @@ class AsciiImportFilter(object):
                             'select_z',
                             'auto_search',
                             'separator',
+                            'data_dtype',
 
                                ]
 
@@ -202,8 +210,26 @@ class AsciiImportFilter(object):
       due to any error. It also allows to read a file only once for test with several
       options.
       
+      Files larger than STREAMING_FILE_SIZE are read with iter_read_data.
+      
       :param input_file: Name of the file or file like object to be read from.
     '''
+    if self._can_stream() and type(input_file) is not file and \
+        not input_file.endswith('.gz') and os.path.getsize(input_file)>STREAMING_FILE_SIZE:
+      return list(self.iter_read_data(input_file))
+    return self._read_all(input_file)
+
+  def _can_stream(self):
+    '''
+      Return if the file can be read sequence by sequence, which is not possible
+      if the footer information is needed for all sequences.
+    '''
+    return CREATE_MDS and self.footer_lines!=1 and len(self.footer_search)==0
+
+  def _read_all(self, input_file):
+    '''
+      Read the whole file into memory and process it with all steps.
+    '''
     print "Trying to import ASCII (%s) '%s'."%(self.name, input_file)
     self._1clear_all()
     self._2read_lines(input_file)
@@ -217,6 +243,163 @@ class AsciiImportFilter(object):
     else:
       return self._data_arrays, self._extracted_data
 
+  def iter_read_data(self, input_file, chunk_size=1024*1024, block_lines=10000):
+    '''
+      Generator version of read_data, which reads the file in chunks and
+      yields each MeasurementData object as soon as its sequence is finished.
+      Only the lines of one block are kept as strings, the data is collected
+      in column buffers growing geometrically. Header information is available
+      for all sequences, filters with footer search fall back to read_data.
+      
+      :param input_file: Name of the file or file like object to be read from.
+      :param chunk_size: Number of bytes read from the file at once
+      :param block_lines: Number of data lines converted at once
+    '''
+    if not self._can_stream():
+      result=self._read_all(input_file)
+      if not CREATE_MDS:
+        yield result
+        return
+      for dataset in result:
+        yield dataset
+      return
+    print "Trying to import ASCII (%s) '%s' in streaming mode."%(self.name, input_file)
+    self._1clear_all()
+    input_file, close_after=self._open_input(input_file)
+    try:
+      lines=self._iter_lines(input_file, chunk_size)
+      # header of the file
+      self._header_lines, lines=self._read_header(lines)
+      self._extract_information(self._header_lines, self.header_search)
+      split=(self.split_sequences==1)
+      if split:
+        splitstring=self.split_sequences.value
+        footer_length=self.footer_lines.value
+        # the last sequence has its own footer and the file footer
+        pending_length=2*footer_length
+      else:
+        footer_length=0
+        pending_length=self.footer_lines.value
+      sequence=0
+      while True:
+        if split:
+          sequence_header, lines=self._read_header(lines)
+        else:
+          sequence_header=[]
+        data_buffer=None
+        line_offset=0
+        pending=deque()
+        block=[]
+        sequence_finished=False
+        for line in lines:
+          if split and splitstring in line:
+            sequence_finished=True
+            break
+          pending.append(line)
+          if len(pending)>pending_length:
+            block.append(pending.popleft())
+            if len(block)>=block_lines:
+              data_buffer, line_offset=self._extend_data_buffer(data_buffer, block,
+                                                                sequence, line_offset)
+              block=[]
+        pending=list(pending)
+        if sequence_finished:
+          sequence_footer=pending[len(pending)-footer_length:]
+          block+=pending[:len(pending)-footer_length]
+        else:
+          # end of file, remove file footer and sequence footer
+          file_footer_length=self.footer_lines.value
+          self._footer_lines=pending[len(pending)-file_footer_length:]
+          pending=pending[:len(pending)-file_footer_length]
+          sequence_footer=pending[len(pending)-footer_length:]
+          block+=pending[:len(pending)-footer_length]
+        data_buffer, line_offset=self._extend_data_buffer(data_buffer, block,
+                                                          sequence, line_offset)
+        if data_buffer is not None and len(data_buffer)>0:
+          yield self._create_md(sequence, data_buffer.get_array(),
+                                sequence_header+sequence_footer)
+        sequence+=1
+        if not sequence_finished:
+          break
+    finally:
+      if close_after:
+        input_file.close()
+
+  def _iter_lines(self, input_file, chunk_size):
+    '''
+      Yield the lines of a file reading chunk_size bytes at a time.
+    '''
+    remainder=''
+    while True:
+      chunk=input_file.read(chunk_size)
+      if chunk=='':
+        break
+      text=remainder+chunk
+      lines=text.splitlines()
+      if text.endswith('\r'):
+        # the line end could be '\r\n' split between two chunks
+        remainder=lines.pop()+'\r'
+      elif not text.endswith('\n'):
+        remainder=lines.pop()
+      else:
+        remainder=''
+      for line in lines:
+        yield line
+    for line in remainder.splitlines():
+      yield line
+
+  def _read_header(self, lines):
+    '''
+      Read the header lines from a line iterator, used by iter_read_data.
+      When searching for the header end the first data line is put
+      back in front of the returned iterator.
+    '''
+    header_lines=[]
+    if self.header_lines==0:
+      for ignore in range(self.header_lines.value):
+        try:
+          header_lines.append(lines.next())
+        except StopIteration:
+          break
+    elif self.header_lines==1:
+      sep=self.separator.value
+      for line in lines:
+        try:
+          float(line.strip().split(sep)[0])
+        except (ValueError, IndexError):
+          header_lines.append(line)
+          continue
+        else:
+          lines=chain([line], lines)
+          break
+    else:
+      raise NotImplementedError, "not defined for this option: %s"%self.header_lines
+    return header_lines, lines
+
+  def _extend_data_buffer(self, data_buffer, block, sequence, line_offset):
+    '''
+      Convert a block of data lines and add it to the sequence buffer.
+      
+      :param line_offset: Number of data lines of the sequence in previous blocks
+      
+      :return: The buffer and the line offset for the next block
+    '''
+    block=self._filter_comments(block)
+    if not self.skip_linestripping:
+      block=[line.strip() for line in block]
+    block=[line for line in block if line!='']
+    if len(block)==0:
+      return data_buffer, line_offset
+    if data_buffer is None:
+      data=self._extract_data(block, sequence, line_offset=line_offset)
+      if len(data)>0:
+        data_buffer=GrowingArray(data.shape[1], data.dtype)
+    else:
+      data=self._extract_data(block, sequence, data_buffer.num_columns, line_offset)
+    if data_buffer is not None:
+      data_buffer.extend(data)
+    return data_buffer, line_offset+len(block)
+
   def simulate_readout(self, input_file=None,
                        step_function=None,
                        report=None):
@@ -284,6 +467,7 @@ class AsciiImportFilter(object):
                                                            len(self._data_lines),
                                                            len(self._footer_lines))
     output+="        Data Sequences:   %i\n"%(len(self._splited_data))
+    output+="     Skipped Data Lines:   %i\n"%(len(self._bad_lines))
     if len(self._data_arrays)>0:
       output+="   First Sequence Data:   %i/%i Lines/Columns"%(len(self._data_arrays[0]),
                                                                  len(self._data_arrays[0][0]))
@@ -309,6 +493,7 @@ class AsciiImportFilter(object):
     output['footer']=len(self._footer_lines)
     output['data']=len(self._data_lines)
     output['sequences']=len(self._splited_data)
+    output['bad_lines']=self._bad_lines
     if len(self._data_arrays)>0:
       output['first_lines']=len(self._data_arrays[0])
       output['first_cols']=len(self._data_arrays[0][0])
@@ -330,12 +515,25 @@ class AsciiImportFilter(object):
     self._sequence_headers=[]
     self._splited_data=[]
     self._data_arrays=[]
+    self._bad_lines=[]
 
   def _2read_lines(self, input_file):
     '''
       Reads the raw ascii data from a text file, 
       gziped text file or file like object.
     '''
+    input_file, close_after=self._open_input(input_file)
+    # read the ascii data
+    self._file_data=input_file.read()
+    if close_after:
+      input_file.close()
+
+  def _open_input(self, input_file):
+    '''
+      Open a text file, gziped text file or use a file like object.
+      
+      :return: The file object and if it should be closed after reading
+    '''
     # test if input_file is a file-like object
     if not type(input_file) is file:
       close_after=True
@@ -349,10 +547,7 @@ class AsciiImportFilter(object):
     else:
       close_after=False
       self._extract_file_information(input_file.name)
-    # read the ascii data
-    self._file_data=input_file.read()
-    if close_after:
-      input_file.close()
+    return input_file, close_after
 
   def _3get_head_data_foot(self):
     # Process the raw lines
@@ -388,8 +583,9 @@ class AsciiImportFilter(object):
       Converts the ascii data into a 2d array of floats.
     '''
     output=[]
-    for data_lines in self._splited_data:
-      data_array=self._extract_data(data_lines)
+    self._bad_lines=[]
+    for i, data_lines in enumerate(self._splited_data):
+      data_array=self._extract_data(data_lines, i)
       output.append(data_array)
     self._data_arrays=output
     return output
@@ -397,50 +593,57 @@ class AsciiImportFilter(object):
   def _8create_mds(self):
     output=[]
     for j, data_array in enumerate(self._data_arrays):
-      self._extracted_data['sequence']=j
-      num_columns=len(data_array[0])
-      col_indices, dimensions, units, errors=self._get_columns(num_columns, self._header_lines+self._sequence_headers[j])
-      columns=[]
-      for i in col_indices:
-        columns.append(PhysicalProperty(dimensions[i], units[i], data_array[:, i]))
-        if i in errors:
-          columns[-1].error=data_array[:, errors[i]]
-      self._perform_postcalcs(columns)
-
-      dataset=MeasurementData()
-      dataset.data=columns
-      dataset.number=str(j)
-      dataset.info="\n".join(self._header_lines)
-      dataset.sample_name=str(eval(self.sample_name, globals(), dict(locals().items()+self._extracted_data.items())))
-      dataset.short_info=str(eval(self.short_info, globals(), dict(locals().items()+self._extracted_data.items())))
-
-      # define the x,y and z columns
-      dimensions=dataset.dimensions()
-      if self.select_x==0:
-        dataset.xdata=self.select_x.value
-      else:
-        for col_name in self.select_x.value:
-          if col_name in dimensions:
-            dataset.xdata=dimensions.index(col_name)
-            break
-      if self.select_y==0:
-        dataset.ydata=self.select_y.value
-      else:
-        for col_name in self.select_y.value:
-          if col_name in dimensions:
-            dataset.ydata=dimensions.index(col_name)
-            break
-      if self.select_z==0:
-        dataset.zdata=self.select_z.value
-      else:
-        for col_name in self.select_z.value:
-          if col_name in dimensions:
-            dataset.zdata=dimensions.index(col_name)
-            break
-
-      output.append(dataset)
+      output.append(self._create_md(j, data_array, self._sequence_headers[j]))
     return output
 
+  def _create_md(self, j, data_array, sequence_header):
+    '''
+      Create the MeasurementData object for one sequence.
+    '''
+    self._extracted_data['sequence']=j
+    num_columns=len(data_array[0])
+    col_indices, dimensions, units, errors=self._get_columns(num_columns, self._header_lines+sequence_header)
+    columns=[]
+    for i in col_indices:
+      columns.append(PhysicalProperty(dimensions[i], units[i], data_array[:, i],
+                                      dtype=data_array.dtype))
+      if i in errors:
+        columns[-1].error=data_array[:, errors[i]]
+    self._perform_postcalcs(columns)
+
+    dataset=MeasurementData()
+    dataset.data=columns
+    dataset.number=str(j)
+    dataset.info="\n".join(self._header_lines)
+    dataset.sample_name=str(eval(self.sample_name, globals(), dict(locals().items()+self._extracted_data.items())))
+    dataset.short_info=str(eval(self.short_info, globals(), dict(locals().items()+self._extracted_data.items())))
+
+    # define the x,y and z columns
+    dimensions=dataset.dimensions()
+    if self.select_x==0:
+      dataset.xdata=self.select_x.value
+    else:
+      for col_name in self.select_x.value:
+        if col_name in dimensions:
+          dataset.xdata=dimensions.index(col_name)
+          break
+    if self.select_y==0:
+      dataset.ydata=self.select_y.value
+    else:
+      for col_name in self.select_y.value:
+        if col_name in dimensions:
+          dataset.ydata=dimensions.index(col_name)
+          break
+    if self.select_z==0:
+      dataset.zdata=self.select_z.value
+    else:
+      for col_name in self.select_z.value:
+        if col_name in dimensions:
+          dataset.zdata=dimensions.index(col_name)
+          break
+
+    return dataset
+
 
   def _split_head_data_foot(self, file_lines):
     '''
@@ -573,39 +776,62 @@ class AsciiImportFilter(object):
         index=sstring.find(name_value_split, start)
     # use string search to extract column information from the header
 
-  def _extract_data(self, data_lines):
+  def _extract_data(self, data_lines, sequence=0, num_columns=None, line_offset=0):
     '''
       Convert the string lines into a floating point data matrix.
+      All lines are parsed in one numpy call, if every line has the right number
+      of columns. Otherwise the lines are checked one by one and lines which can
+      not be converted or have a wrong number of columns are reported and skipped.
+      
+      :param line_offset: Number of data lines of the sequence before these lines
     '''
     # Strip empty space before and after each line
     if not self.skip_linestripping:
-      data_lines=map(str.strip, data_lines)
-    # split each line into columns
+      data_lines=[line.strip() for line in data_lines]
+    data_lines=[line for line in data_lines if line!='']
+    dtype=dtype_(self.data_dtype)
+    if len(data_lines)==0:
+      return empty((0, 0), dtype=dtype)
     sep=self.separator.value
-    split_data=map(lambda line: line.split(sep), data_lines)
-    if self.disable_datacheck: # fast conversion without checking each line
-      data=array(split_data, dtype=float32)
-      return data
-    # Check data line by line
-    data=[]
-    for i, line in enumerate(split_data):
-      if data_lines[i].strip()=="":
-        # skip empty lines
+    if num_columns is None:
+      num_columns=len(data_lines[0].split(sep))
+    if self.skip_colcheck or self.disable_datacheck:
+      columns_checked=True
+    elif sep is None:
+      columns_checked=not False in [len(line.split())==num_columns for line in data_lines]
+    else:
+      # the total number of values can be right for lines with missing and additional values
+      separators=num_columns-1
+      columns_checked=not False in [line.count(sep)==separators for line in data_lines]
+    if columns_checked:
+      # fast conversion of all lines at once
+      data_text=" ".join(data_lines)
+      if sep is not None:
+        data_text=data_text.replace(sep, ' ')
+      data=fromstring(data_text, dtype=dtype, sep=' ')
+      if data.size==len(data_lines)*num_columns:
+        return data.reshape(len(data_lines), num_columns)
+    if self.disable_datacheck:
+      raise ValueError, "data lines could not be converted to a %i column array"%num_columns
+    # Check data line by line and write the valid lines to the output array
+    data=empty((len(data_lines), num_columns), dtype=dtype)
+    bad_lines=[]
+    j=0
+    for i, line in enumerate(data_lines):
+      split_line=line.split(sep)
+      if len(split_line)!=num_columns:
+        bad_lines.append((sequence, line_offset+i, line))
         continue
       try:
-        dline=map(float, line)
+        data[j]=map(float, split_line)
       except ValueError:
+        bad_lines.append((sequence, line_offset+i, line))
         continue
-      else:
-        data.append(dline)
-    if self.skip_colcheck:
-      return array(split_data, dtype=float32)
-    # remove lines which do not have correct columns.
-    line_len=len(data[0])
-    for i in reversed(range(len(data))):
-      if len(data[i])!=line_len:
-        data.pop(i)
-    return array(split_data, dtype=float32)
+      j+=1
+    for ignore, i, line in bad_lines:
+      print "\tSkipped sequence %i data line %i: '%s'"%(sequence+1, i+1, line)
+    self._bad_lines+=bad_lines
+    return data[:j]
 
   def _get_columns(self, num_columns, header_lines):
     '''
@@ -18,6 +18,8 @@ from plot_script.config import kws2 as config
 from plot_script.config import gnuplot_preferences
 import array as array_module
 import gzip
+import numpy
+from time import time
 
 __author__="Artur Glavic"
 __credits__=[]
@@ -30,6 +32,15 @@ detector_sensitivities={}
 background_data={}
 imported_edfs=[]
 import_subframes=False
+# pixel and q-arrays for each detector geometry
+edf_geometries={}
+# minimal number of frames summed by each worker process
+FRAMES_PER_PROCESS=4
+EDF_DATA_TYPES={
+                'UnsignedShort': numpy.uint16,
+                'SignedInteger': numpy.int32,
+                'FloatValue': numpy.float32,
+                }
 
 def read_data(file_name):
   '''
@@ -364,43 +375,23 @@ def read_edf_file(file_name, baseitem=None, baseuseindices=None, full_data_items
   countingtime=header_info['time']
   # subtract background
   if setup['BACKGROUND']:
-    input_array-=background_array*countingtime
+    input_array=input_array-background_array*countingtime
   sys.stdout.write('\tData Processing ...')
   sys.stdout.flush()
-  error_array=sqrt(input_array)
+  error_array=sqrt(maximum(input_array, 0.))
   corrected_data_array=input_array/countingtime
   corrected_error_array=error_array/countingtime
   if baseitem is None:
-    tth=0.
-    #if 'DetectorInfo' in header_settings and\
-    #   header_settings['DetectorInfo']=='Maxipix 4 Quadrants':
-    #  tth=float(header_settings['DetectorRotation_2'].split('_')[0])*pi/180.
-    # if data is scaled in file, rescale it to apply e.g. error calculations correctly
-    #if header_info['DataNormalization'] is not None:
-    #  input_array/=header_info['DataNormalization']
-    # define other quantities for the input data
-    x_array=linspace(0, header_info['xdim']*header_info['ydim']-1,
-                      header_info['xdim']*header_info['ydim'])%header_info['xdim']
-    y_array=linspace(0, header_info['xdim']*header_info['ydim']-1,
-                      header_info['xdim']*header_info['ydim'])//header_info['xdim']
-    qy_array=4.*pi/header_info['lambda_γ']*\
-             sin((arctan((x_array-center_x)*header_info['pixelsize_x']/detector_distance)+tth)/2.)
-    qz_array=-4.*pi/header_info['lambda_γ']*\
-             sin(arctan((y_array-center_y)*header_info['pixelsize_y']/detector_distance)/2.)
-    if setup['SWAP_YZ']:
-      # swap the directions
-      tmp=qz_array
-      qz_array=qy_array
-      qy_array=tmp
-    use_indices=where(((qy_array<q_window[0])+(qy_array>q_window[1])+\
-                (qz_array<q_window[2])+(qz_array>q_window[3]))==0)[0]
+    x_array, y_array, qy_array, qz_array, use_indices=get_edf_geometry(header_info, center_x, center_y,
+                                                                       detector_distance, setup['SWAP_YZ'],
+                                                                       q_window)
     # Insert columns
-    dataobj.data.append(PhysicalProperty('pixel_x', 'pix', x_array[use_indices]).astype(int16))
-    dataobj.data.append(PhysicalProperty('pixel_y', 'pix', y_array[use_indices]).astype(int16))
+    dataobj.data.append(PhysicalProperty('pixel_x', 'pix', x_array, dtype=int16))
+    dataobj.data.append(PhysicalProperty('pixel_y', 'pix', y_array, dtype=int16))
     dataobj.data.append(PhysicalProperty('intensity', 'counts/s', corrected_data_array[use_indices],
                                                       corrected_error_array[use_indices]))
-    dataobj.data.append(PhysicalProperty('Q_y', 'Å^{-1}', qy_array[use_indices]))
-    dataobj.data.append(PhysicalProperty('Q_z', 'Å^{-1}', qz_array[use_indices]))
+    dataobj.data.append(PhysicalProperty('Q_y', 'Å^{-1}', qy_array))
+    dataobj.data.append(PhysicalProperty('Q_z', 'Å^{-1}', qz_array))
   else:
     dataobj.data=deepcopy(baseitem.data)
     if baseuseindices is None:
@@ -424,6 +415,39 @@ def read_edf_file(file_name, baseitem=None, baseuseindices=None, full_data_items
     print "\tImport complete, ignoring file names belonging to the same series."
   return [dataobj]
 
+def get_edf_geometry(header_info, center_x, center_y, detector_distance, swap_yz, q_window):
+  '''
+    Calculate the pixel and q-values of the detector inside the q-window.
+    The arrays are only calculated once for each detector geometry.
+    
+    :return: pixel_x, pixel_y, Q_y and Q_z arrays and the indices of the used pixels
+  '''
+  key=(header_info['xdim'], header_info['ydim'], header_info['lambda_γ'],
+       header_info['pixelsize_x'], header_info['pixelsize_y'],
+       center_x, center_y, detector_distance, swap_yz, tuple(q_window))
+  if key in edf_geometries:
+    return edf_geometries[key]
+  tth=0.
+  # define other quantities for the input data
+  x_array=arange(header_info['xdim']*header_info['ydim'])%header_info['xdim']
+  y_array=arange(header_info['xdim']*header_info['ydim'])//header_info['xdim']
+  qy_array=4.*pi/header_info['lambda_γ']*\
+           sin((arctan((x_array-center_x)*header_info['pixelsize_x']/detector_distance)+tth)/2.)
+  qz_array=-4.*pi/header_info['lambda_γ']*\
+           sin(arctan((y_array-center_y)*header_info['pixelsize_y']/detector_distance)/2.)
+  if swap_yz:
+    # swap the directions
+    tmp=qz_array
+    qz_array=qy_array
+    qy_array=tmp
+  use_indices=where(((qy_array<q_window[0])+(qy_array>q_window[1])+\
+              (qz_array<q_window[2])+(qz_array>q_window[3]))==0)[0]
+  geometry=(x_array[use_indices].astype(int16), y_array[use_indices].astype(int16),
+            qy_array[use_indices].astype(float32), qz_array[use_indices].astype(float32),
+            use_indices)
+  edf_geometries[key]=geometry
+  return geometry
+
 def import_edf_set(file_name):
   '''
     Read a complete set of data and sum the files together.
@@ -446,25 +470,77 @@ def import_edf_set(file_name):
     if file_prefix+'_im_full.edf' in file_list:
       return import_edf_file(file_prefix+'_im_full.edf')
     is_list=False
-  file_name=file_list[0]
-  sys.stdout.write('\tReading file 1/%i'%len(file_list))
+  sys.stdout.write('\tReading %i files ...'%len(file_list))
   sys.stdout.flush()
-  input_array, header_settings, header_info=import_edf_file(file_name)
-  i=0
-  # import all other files and add them together
-  for i, file_name in enumerate(file_list[1:]):
-    sys.stdout.write('\b'*(len(str(i+1))+len(str(len(file_list))))+'\b%i/%i'%(i+2, len(file_list)))
-    sys.stdout.flush()
-    input_array_tmp, ignore, header_info_tmp=import_edf_file(file_name)
-    # add the collected data to the already imported
-    input_array+=input_array_tmp
-    header_info['time']+=header_info_tmp['time']
+  start=time()
+  ignore, header_settings, header_info=import_edf_file(file_list[0], header_only=True)
+  input_array, header_info['time']=sum_edf_frames(file_list)
+  duration=max(time()-start, 1e-6)
+  sys.stdout.write('\b'*3+'complete, %.1f frames/s'%(len(file_list)/duration))
   if not is_list:
-    sys.stdout.write('\b'*(len(str(i+2))+len(str(len(file_list))))+'\breadout complete, writing sum to %s!\n'%(file_prefix+'_im_full.edf'))
+    sys.stdout.write(', writing sum to %s!\n'%(file_prefix+'_im_full.edf'))
     sys.stdout.flush()
     write_edf_file(file_prefix, input_array, header_info['time'])
+  else:
+    sys.stdout.write('\n')
+    sys.stdout.flush()
   return input_array, header_settings, header_info
 
+def sum_edf_frames(file_list, processes=None):
+  '''
+    Sum the data of several edf files. Blocks of files are summed in separate processes
+    and the results are added pairwise. Only one frame per process is read at a time.
+    
+    :param file_list: List of file names with the same detector size
+    :param processes: Number of processes, None uses the WORKERS setting from config.parallel
+    
+    :return: Sum of the data and of the counting times
+  '''
+  import multiprocessing
+  if processes is None:
+    from plot_script.config.parallel import WORKERS
+    processes=WORKERS or multiprocessing.cpu_count()
+  processes=max(1, min(processes, len(file_list)//FRAMES_PER_PROCESS))
+  block_length=(len(file_list)+processes-1)//processes
+  blocks=[file_list[i:i+block_length] for i in range(0, len(file_list), block_length)]
+  if len(blocks)>1:
+    pool=multiprocessing.Pool(len(blocks))
+    try:
+      results=pool.map(_sum_edf_block, blocks, 1)
+    finally:
+      pool.terminate()
+  else:
+    results=map(_sum_edf_block, blocks)
+  # reduction tree of the partial sums
+  while len(results)>1:
+    reduced=[]
+    for i in range(0, len(results)-1, 2):
+      data, countingtime=results[i]
+      data+=results[i+1][0]
+      reduced.append((data, countingtime+results[i+1][1]))
+    if len(results)%2==1:
+      reduced.append(results[-1])
+    results=reduced
+  return results[0]
+
+def _sum_edf_block(file_list):
+  '''
+    Sum the data of a list of edf files in one process.
+  '''
+  total=None
+  countingtime=0.
+  for file_name in file_list:
+    data, ignore, header_info=import_edf_file(file_name, copy=False)
+    if total is None:
+      if data.dtype.kind=='f':
+        total=zeros(data.shape, dtype=numpy.float64)
+      else:
+        total=zeros(data.shape, dtype=numpy.int64)
+    total+=data
+    countingtime+=header_info['time']
+    del(data)
+  return total, countingtime
+
 def read_background_edf(background_file_name):
   '''
     Read the binary .edf (european data format) file including header.
@@ -572,9 +648,13 @@ def read_edf_header(file_handler):
     info['pixelsize_y']=float(settings['PSize_2'].rstrip('m'))*1e3
   return settings, info, header_lines
 
-def import_edf_file(file_name):
+def import_edf_file(file_name, header_only=False, copy=True):
   '''
-    Read the header and data from one edf file.
+    Read the header and data from one edf file. The data of uncompressed
+    files is mapped into memory instead of reading it.
+    
+    :param header_only: Don't read the data and return None instead
+    :param copy: If False the data of uncompressed files can be a read-only memory map
     
     :return: array of the data and the header string.
   '''
@@ -585,24 +665,28 @@ def import_edf_file(file_name):
     file_handler=open(file_name, 'rb')
   # read file header information
   header_settings, header_info, ignore=read_edf_header(file_handler)
+  if header_only:
+    file_handler.close()
+    return None, header_settings, header_info
+  if header_settings['DataType'] not in EDF_DATA_TYPES:
+    file_handler.close()
+    raise IOError, 'Unknown data format in header: %s'%header_settings['DataType']
+  data_type=numpy.dtype(EDF_DATA_TYPES[header_settings['DataType']])
+  items=header_info['xdim']*header_info['ydim']
+  if file_name.endswith('.gz'):
+    input_array=fromstring(file_handler.read(items*data_type.itemsize), dtype=data_type)
+  else:
+    input_array=numpy.memmap(file_name, dtype=data_type, mode='r',
+                             offset=file_handler.tell(), shape=(items,))
+  file_handler.close()
   if header_settings['DataType']=='UnsignedShort':
-    # load data as binary integer values
-    input_array=array_module.array('H')
-    input_array.fromstring(file_handler.read(header_info['xdim']*header_info['ydim']*2))
-    input_array=array(input_array)-200
-  elif header_settings['DataType']=='SignedInteger':
-    # load data as binary integer values
-    input_array=array_module.array('i')
-    input_array.fromstring(file_handler.read(header_info['xdim']*header_info['ydim']*4))
+    # the detector adds an offset of 200 counts
+    input_array=input_array.astype(numpy.int32)-200
   elif header_settings['DataType']=='FloatValue':
-    # load data as binary integer values
-    input_array=array_module.array('f')
-    input_array.fromstring(file_handler.read(header_info['xdim']*header_info['ydim']*4))
     input_array=maximum(0., input_array)
-  else:
-    raise IOError, 'Unknown data format in header: %s'%header_settings['DataType']
-  file_handler.close()
-  return array(input_array), header_settings, header_info
+  elif copy:
+    input_array=array(input_array)
+  return input_array, header_settings, header_info
 
 def write_edf_file(file_prefix, data, countingtime):
   '''
@@ -624,10 +708,7 @@ def write_edf_file(file_prefix, data, countingtime):
       write_file.write("DataType = SignedInteger ;\n")
     else:
       write_file.write(header_line)
-  output_array=array_module.array('i')
-  int_data=map(int, data.tolist())
-  output_array.fromlist(int_data)
-  output_array.tofile(write_file)
+  asarray(data).astype(numpy.int32).tofile(write_file)
   write_file.close()
 
 def read_p08_binary(file_name):
@@ -22,6 +22,10 @@ from plot_script.plotpy_info import __copyright__, __license__, __version__, __m
 __status__="Production"
 
 MARIA_REDUCE_RESOLUTION=False
+# minimal number of images integrated by each worker process
+IMAGES_PER_PROCESS=8
+# zip files opened by the image integration, one for each archive
+_zip_files={}
 
 class MeasurementDataTREFF(MeasurementData):
   '''
@@ -323,7 +327,6 @@ def integrate_pictures(data_lines, columns, const_information, data_path, calibr
     :return: MeasurementData objects for the map and the scan for this polarization channel
   '''
   detector_images=[]
-  sqrt=math.sqrt
   # create the data object
   scan_data_object=MeasurementDataTREFF([[columns['Scantype'], columns['Scanunit']],
                                ['2DWindow', 'counts'],
@@ -347,11 +350,8 @@ def integrate_pictures(data_lines, columns, const_information, data_path, calibr
   # alpha_i is used as main column for the line splitteng used for pm3d
   data_object.scan_line_constant=1
   data_object.scan_line=0
-  data_list=[]
   scan_data_list=[]
-  if (import_images  or return_detector_images):
-    sys.stdout.write('\t\t Image %03i/%03i'%(1, len(data_lines)))
-    sys.stdout.flush()
+  image_tasks=[]
   for index, line in enumerate(data_lines):
     if float(line[columns['Monitor']])==0.:
       continue # measurement error, nothing to do
@@ -366,30 +366,26 @@ def integrate_pictures(data_lines, columns, const_information, data_path, calibr
                                       line[columns['Time']])))
     if not (import_images  or return_detector_images):
       continue
-    sys.stdout.write('\b'*14+' Image %03i/%03i'%(index+1, len(data_lines)))
-    sys.stdout.flush()
     if treff_zip and line[columns['Image']] in treff_zip.namelist():
       # use data inside ziped file
-      img_file=treff_zip.open(line[columns['Image']], 'r')
+      image_source=('zip', treff_zip.filename, line[columns['Image']])
     elif treff_zip and line[columns['Image']]+'.gz' in treff_zip.namelist():
       # use data inside ziped file
       print "gziped files not supported inside of .zip file."
       continue
     elif os.path.exists(data_path+line[columns['Image']]+'.gz'):
       # gziped images
-      import gzip
-      img_file=gzip.open(data_path+line[columns['Image']]+'.gz', 'rb')
+      image_source=('gzip', data_path+line[columns['Image']]+'.gz')
     elif line[columns['Image']].endswith('.gz') and os.path.exists(data_path+line[columns['Image']]):
       # gziped images
-      import gzip #@Reimport
-      img_file=gzip.open(data_path+line[columns['Image']], 'rb')
+      image_source=('gzip', data_path+line[columns['Image']])
     elif os.path.exists(data_path+line[columns['Image']]):
       # unziped images
-      img_file=open(data_path+line[columns['Image']], 'r')
+      image_source=('plain', data_path+line[columns['Image']])
     else:
       # no image file
-      sys.stdout.write('\n\t\t\t'+data_path+line[columns['Image']]+\
-                    '(.gz) does not exist, check your files.\n\t\t Image %03i/%03i'%(1, len(data_lines)))
+      sys.stdout.write('\t\t\t'+data_path+line[columns['Image']]+\
+                    '(.gz) does not exist, check your files.\n')
       continue
     # define alphai and alphaf (for the detector center)
     if columns['omega']>=0:
@@ -402,53 +398,125 @@ def integrate_pictures(data_lines, columns, const_information, data_path, calibr
       alphaf_center=float(line[columns['detector']])-alphai
     else:
       alphaf_center=const_information['detector']-alphai
-    # integrate the image
-    detector_data, detector_image=integrate_one_picture_neu(img_file, line, columns, alphai, alphaf_center, calibration, PIXEL_WIDTH)
-    data_list+=detector_data
-    if return_detector_images:
-      # Create object for the detector image
-      imgobj=create_img_object(detector_image, alphai, alphaf_center, float(line[columns['Time']]))
-      imgobj.sample_name='Detector Image '+line[columns['Image']].rsplit('.', 1)[0]
-      try:
-        imgobj.short_info=line[columns['Image']].rsplit('.', 1)[1]
-      except IndexError:
-        imgobj.short_info=line[columns['Image']]
-      imgobj.number=str(index)
-      # write the data of the object to a file to save memory
-      imgobj.store_data()
-      del(detector_image)
-      detector_images.append(imgobj)
-    #data_list+=integrate_one_picture(img_file, line, columns, alphai, alphaf_center, calibration, PIXEL_WIDTH)
-  if (import_images  or return_detector_images):
+    image_tasks.append((index, image_source, line, alphai, alphaf_center))
+  data_list=[]
+  if len(image_tasks)>0:
+    sys.stdout.write('\t\t Image %03i/%03i'%(0, len(image_tasks)))
+    sys.stdout.flush()
+    for task, (detector_data, detector_image) in integrate_images(image_tasks, columns, calibration,
+                                                                  return_detector_images):
+      data_list.append(detector_data)
+      sys.stdout.write('\b'*14+' Image %03i/%03i'%(len(data_list), len(image_tasks)))
+      sys.stdout.flush()
+      if return_detector_images and detector_image is not None:
+        index, ignore, line, alphai, alphaf_center=task
+        # Create object for the detector image
+        imgobj=create_img_object(detector_image, alphai, alphaf_center, float(line[columns['Time']]))
+        imgobj.sample_name='Detector Image '+line[columns['Image']].rsplit('.', 1)[0]
+        try:
+          imgobj.short_info=line[columns['Image']].rsplit('.', 1)[1]
+        except IndexError:
+          imgobj.short_info=line[columns['Image']]
+        imgobj.number=str(index)
+        # write the data of the object to a file to save memory
+        imgobj.store_data()
+        del(detector_image)
+        detector_images.append(imgobj)
     print ""
-  if import_images:
-    data_append=data_object.append
+  if import_images and len(data_list)>0:
     # append the integrated data to the object
-    map(data_append, data_list)
-  scan_data_append=scan_data_object.append
-  # sqrt of intensities is error
-  if columns['Scanunit']=='mrad':
-    def sqrt_34_gtm(point):
-      point[0]=GRAD_TO_MRAD*point[0]
-      point[3]=sqrt(point[3])
-      point[4]=sqrt(point[4])
-      point[5]=point[1]/point[5]
-      point[6]=point[3]/point[6]
-      point[7]=point[1]/point[7]
-      point[8]=point[3]/point[8]
-  else:
-    def sqrt_34_gtm(point):
-      point[0]=point[0]*point[7]
-      point[3]=sqrt(point[3])
-      point[4]=sqrt(point[4])
-      point[5]=point[1]/point[5]
-      point[6]=point[3]/point[6]
-      point[7]=point[1]/point[7]
-      point[8]=point[3]/point[8]
-  map(sqrt_34_gtm, scan_data_list)
-  map(scan_data_append, scan_data_list)
+    data_object.extend(numpy.vstack(data_list))
+  if len(scan_data_list)>0:
+    scan_data=numpy.array(scan_data_list)
+    # sqrt of intensities is error
+    if columns['Scanunit']=='mrad':
+      scan_data[:, 0]*=GRAD_TO_MRAD
+    else:
+      scan_data[:, 0]*=scan_data[:, 7]
+    scan_data[:, 3]=numpy.sqrt(scan_data[:, 3])
+    scan_data[:, 4]=numpy.sqrt(scan_data[:, 4])
+    scan_data[:, 5]=scan_data[:, 1]/scan_data[:, 5]
+    scan_data[:, 6]=scan_data[:, 3]/scan_data[:, 6]
+    scan_data[:, 7]=scan_data[:, 1]/scan_data[:, 7]
+    scan_data[:, 8]=scan_data[:, 3]/scan_data[:, 8]
+    scan_data_object.extend(scan_data)
   return data_object, scan_data_object, detector_images
 
+def integrate_images(image_tasks, columns, calibration, return_detector_images=False):
+  '''
+    Open and integrate detector images in several processes. The results are
+    returned in the order of the tasks. If the images are returned, too,
+    only a few blocks are processed at a time to limit the memory usage.
+    
+    :param image_tasks: List of (index, image source, data line, alphai, alphaf_center) tuples
+    :param columns: Dictionary for the interesting columns
+    :param calibration: Calibration data for the 2d detector as List of integers
+    :param return_detector_images: Return the image arrays, too
+    
+    :return: Iterator over (task, (integrated data, detector image or None))
+  '''
+  import multiprocessing
+  from plot_script.config.parallel import WORKERS
+  processes=min(WORKERS or multiprocessing.cpu_count(), len(image_tasks)//IMAGES_PER_PROCESS)
+  constants={
+             'DETECTOR_PIXELS': DETECTOR_PIXELS,
+             'DETECTOR_REGION': DETECTOR_REGION,
+             'CENTER_PIXEL': CENTER_PIXEL,
+             'PIXEL_WIDTH': PIXEL_WIDTH,
+             'PI_4_OVER_LAMBDA': PI_4_OVER_LAMBDA,
+             }
+  arguments=[(task[1], task[2], columns, task[3], task[4], calibration, return_detector_images)
+             for task in image_tasks]
+  if processes<2:
+    try:
+      for task, argument in zip(image_tasks, arguments):
+        yield task, _integrate_image(argument)
+    finally:
+      for zip_file in _zip_files.values():
+        zip_file.close()
+      _zip_files.clear()
+    return
+  if return_detector_images:
+    block_length=processes*IMAGES_PER_PROCESS
+  else:
+    block_length=len(image_tasks)
+  pool=multiprocessing.Pool(processes, _init_integration, (constants,))
+  try:
+    for i in range(0, len(image_tasks), block_length):
+      results=pool.map(_integrate_image, arguments[i:i+block_length], IMAGES_PER_PROCESS)
+      for item in zip(image_tasks[i:i+block_length], results):
+        yield item
+  finally:
+    pool.terminate()
+
+def _init_integration(constants):
+  '''
+    Set the detector parameters in a worker process.
+  '''
+  globals().update(constants)
+
+def _integrate_image(arguments):
+  '''
+    Open and integrate one detector image.
+    
+    :return: Array of integrated detector columns and the detector image (or None)
+  '''
+  image_source, line, columns, alphai, alphaf_center, calibration, return_image=arguments
+  if image_source[0]=='zip':
+    if image_source[1] not in _zip_files:
+      _zip_files[image_source[1]]=ZipFile(image_source[1])
+    img_file=_zip_files[image_source[1]].open(image_source[2], 'r')
+  elif image_source[0]=='gzip':
+    import gzip
+    img_file=gzip.open(image_source[1], 'rb')
+  else:
+    img_file=open(image_source[1], 'r')
+  detector_data, detector_image=integrate_one_picture_neu(img_file, line, columns, alphai, alphaf_center,
+                                                          calibration, PIXEL_WIDTH)
+  if not return_image:
+    detector_image=None
+  return detector_data, detector_image
+
 def integrate_one_picture(img_file, line, columns, alphai, alphaf_center, calibration, pixel_width):
   '''
     Map detector columns to alphai, alphaf and intensities.
@@ -522,14 +590,14 @@ def integrate_one_picture_neu(img_file, line, columns, alphai, alphaf_center, ca
     :param calibration: Calibration data for the 2d detector as List of integers
     :param pixel_width: Width of one pixel on the 2d detector
 
-    :return: List of 256 detector columns with corresponding angle values and errors
+    :return: Array of 256 detector columns with corresponding angle values and errors
   '''
   # read the data of an image file and split the lines 
   img_data=numpy.fromstring(img_file.read(), int, sep=" ")
   try:
     img_data=img_data.reshape(DETECTOR_PIXELS,-1)
   except ValueError:
-    return [], None
+    return numpy.zeros((0, 8)), None
   img_file.close()
   cos=numpy.cos
   sin=numpy.sin
@@ -544,7 +612,7 @@ def integrate_one_picture_neu(img_file, line, columns, alphai, alphaf_center, ca
   try:
     intensities=img_intensities/monitor*calibration
   except ValueError:
-    return [], None
+    return numpy.zeros((0, 8)), None
   errors=numpy.sqrt(img_intensities)/monitor*calibration
   alphaf=alphaf_center+pixel_width*(CENTER_PIXEL-DETECTOR_REGION[2]-numpy.arange(DETECTOR_PIXELS))[filter_indices]
   # create importent columns
@@ -556,8 +624,7 @@ def integrate_one_picture_neu(img_file, line, columns, alphai, alphaf_center, ca
   data_list.append(PI_4_OVER_LAMBDA/2.*(sin(0.001*data_list[0])+sin(0.001*data_list[1])))
   data_list.append(intensities)
   data_list.append(errors)
-  data_list=numpy.array(data_list).transpose().tolist()
-  return data_list, img_data
+  return numpy.array(data_list).transpose(), img_data
 
 def read_simulation(file_name):
   '''
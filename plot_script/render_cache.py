@@ -0,0 +1,184 @@
+# -*- encoding: utf-8 -*-
+'''
+ Cache for images rendered by gnuplot.
+
+ Rendered plots are stored with a key calculated from the plotted data, the
+ settings of the datasets and the gnuplot script text, which includes the plot
+ options, terminal size and style settings. When the same dataset is plotted
+ again with unchanged settings the image can be reused without calling gnuplot.
+ A RenderPrefetcher can fill the cache using idle gnuplot processes of the
+ GnuplotPool, e.g. for the datasets the user will most likely look at next.
+'''
+
+import os
+from glob import glob
+from hashlib import md5
+from threading import Lock
+from collections import OrderedDict
+import config.gnuplot_preferences as gp
+
+__author__="Artur Glavic"
+__credits__=[]
+from plotpy_info import __copyright__, __license__, __version__, __maintainer__, __email__ #@UnusedImport
+__status__="Development"
+
+# dataset attributes which change the plot but are not part of the gnuplot script
+DATASET_ATTRIBUTES=['xdata', 'ydata', 'zdata', 'yerror', 'crop_zdata', 'scan_line',
+                    'scan_line_constant', 'is_matrix_data', 'gridsize_x', 'gridsize_y',
+                    'slice_width', 'slice_center']
+
+def data_hash(datasets):
+  '''
+    Calculate a hash of the data of all datasets and their attached datasets.
+    The data state changes with every modification of a column or the filters,
+    so the data itself does not need to be read.
+  '''
+  hasher=md5()
+  for dataset in datasets:
+    for attachedset in dataset.plot_together:
+      hasher.update(repr(attachedset._get_data_state()))
+      hasher.update(repr([getattr(attachedset, attribute, None) for attribute in DATASET_ATTRIBUTES]))
+  return hasher.hexdigest()
+
+def render_key(gnuplot_file_text, datasets):
+  '''
+    Return the cache key for an image created from datasets with the given script.
+  '''
+  hasher=md5(gnuplot_file_text)
+  hasher.update(data_hash(datasets))
+  return hasher.hexdigest()
+
+class RenderCache(object):
+  '''
+    Store rendered images with a limit on the total size, the least recently
+    used images are removed first. Thread save to be filled from other threads.
+  '''
+
+  def __init__(self, byte_limit=gp.RENDER_CACHE_SIZE):
+    self.byte_limit=byte_limit
+    self.items=OrderedDict()
+    self.size=0
+    self.hits=0
+    self.misses=0
+    self._lock=Lock()
+
+  def __contains__(self, key):
+    return key in self.items
+
+  def __len__(self):
+    return len(self.items)
+
+  def get(self, key):
+    '''
+      Return the image data and the printed gnuplot variables or None.
+    '''
+    self._lock.acquire()
+    try:
+      if key not in self.items:
+        self.misses+=1
+        return None
+      self.hits+=1
+      item=self.items.pop(key)
+      self.items[key]=item
+      return item
+    finally:
+      self._lock.release()
+
+  def put(self, key, image, variables):
+    '''
+      Store an image and remove old ones if the size limit is exceeded.
+    '''
+    if len(image)>self.byte_limit:
+      return
+    self._lock.acquire()
+    try:
+      if key in self.items:
+        self.size-=len(self.items.pop(key)[0])
+      self.items[key]=(image, list(variables))
+      self.size+=len(image)
+      while self.size>self.byte_limit:
+        ignore, item=self.items.popitem(last=False)
+        self.size-=len(item[0])
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    self._lock.acquire()
+    self.items.clear()
+    self.size=0
+    self._lock.release()
+
+class RenderPrefetcher(object):
+  '''
+    Render plots with low priority in the gnuplot pool and store the
+    images in a RenderCache. The data export of the plots can be postponed
+    with the dispatch function (e.g. to the idle time of the GUI main loop),
+    it has to run in the thread which owns the datasets.
+  '''
+
+  def __init__(self, pool, cache, dispatch=None):
+    self.pool=pool
+    self.cache=cache
+    self.pending=set()
+    if dispatch is None:
+      dispatch=lambda function, *args: function(*args)
+    self.dispatch=dispatch
+
+  def prefetch(self, key, gnuplot_file_text, output_file, file_prefix=None):
+    '''
+      Queue a script for rendering, the data files have to be exported already.
+      
+      :param key: Key of the image in the cache
+      :param gnuplot_file_text: Script creating the image
+      :param output_file: Name of the image file created by the script
+      :param file_prefix: Prefix of the data files to be removed after rendering
+    '''
+    if key in self.cache or key in self.pending:
+      return
+    self.pending.add(key)
+    self._submit(key, gnuplot_file_text, output_file, file_prefix)
+
+  def prefetch_later(self, key, prepare, file_prefix):
+    '''
+      Prepare a plot with the dispatch function and queue it for rendering.
+      
+      :param key: Key of the image in the cache
+      :param prepare: Function exporting the data files and returning the script
+                      and the name of the image file it creates
+      :param file_prefix: Prefix of the data files to be removed after rendering
+    '''
+    if key in self.cache or key in self.pending:
+      return
+    self.pending.add(key)
+    self.dispatch(self._prepare, key, prepare, file_prefix)
+
+  def _prepare(self, key, prepare, file_prefix):
+    '''
+      Export the data of a plot and submit it to the gnuplot pool.
+    '''
+    try:
+      gnuplot_file_text, output_file=prepare()
+    except Exception:
+      # the dataset could have been changed or removed in the mean time
+      for file_name in glob(file_prefix+'*'):
+        os.remove(file_name)
+      self.pending.discard(key)
+      return
+    self._submit(key, gnuplot_file_text, output_file, file_prefix)
+
+  def _submit(self, key, gnuplot_file_text, output_file, file_prefix):
+    self.pool.submit(gnuplot_file_text,
+                     lambda output, variables: self._finished(key, output_file, output, variables),
+                     priority=1, file_prefix=file_prefix)
+
+  def _finished(self, key, output_file, output, variables):
+    '''
+      Store the rendered image and remove the file.
+    '''
+    if output=='' and os.path.exists(output_file):
+      self.cache.put(key, open(output_file, 'rb').read(), variables)
+    try:
+      os.remove(output_file)
+    except OSError:
+      pass
+    self.pending.discard(key)
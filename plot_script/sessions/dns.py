@@ -10,12 +10,13 @@ import sys
 from glob import glob
 exit=sys.exit #@ReservedAssignment
 # if possible use the numpy functions as they work with complete arrays
-from numpy import pi, cos, sin, sqrt, array, where, nan_to_num, maximum, zeros
+from numpy import pi, cos, sin, sqrt, array, where, nan_to_num, maximum, zeros, \
+                  empty, newaxis, vstack, asarray, minimum
 use_numpy=True
 
 # import GenericSession, which is the parent class for the squid_session
 from generic import GenericSession
-from plot_script.measurement_data_structure import MeasurementData
+from plot_script.measurement_data_structure import MeasurementData, PhysicalProperty
 # importing data readout
 from plot_script.read_data import dns as read_data
 from plot_script.config import dns as config
@@ -112,6 +113,68 @@ def correct_flipping_ratio(flipping_ratio, pp_data, pm_data,
   # scale the output by total measured intensity
   return nsf_scattering*total, sf_scattering*total, False
 
+# lookup tables for background and vanadium corrections, shared by all maps
+correction_tables={}
+CORRECTION_TABLES_SIZE=16
+
+def store_correction_table(key, table):
+  '''
+    Store a lookup table for the corrections. The table keeps a reference to
+    the data objects it was created from, so their id can't be reused while
+    the table is stored.
+  '''
+  if len(correction_tables)>=CORRECTION_TABLES_SIZE:
+    correction_tables.clear()
+  correction_tables[key]=table
+
+def get_background_table(background_data):
+  '''
+    Create a lookup table for a set of background files, which is only
+    calculated once for every set and reused for all maps.
+    
+    :param background_data: Dictionary of background datasets for each detector bank position
+    
+    :return: Sorted detector bank positions, index of the background file for each position,
+             first detector of each file and array of the columns for each file
+  '''
+  key=('background',)+tuple(sorted([(angle, id(value)) for angle, value in background_data.items()]))
+  if not key in correction_tables:
+    items=sorted(background_data.items())
+    bg_files=[]
+    bg_ids=[]
+    bg_index=[]
+    for ignore, value in items:
+      if not id(value) in bg_ids:
+        bg_files.append(value)
+        bg_ids.append(id(value))
+      bg_index.append(bg_ids.index(id(value)))
+    positions=array([item[0] for item in items], dtype=float)
+    first_detectors=array([float(value.data[0][0]) for value in bg_files])
+    columns=min([len(value.data) for value in bg_files])-1
+    length=max([len(value.data[0]) for value in bg_files])
+    table=zeros((len(bg_files), columns, length))
+    for i, value in enumerate(bg_files):
+      for j in range(columns):
+        table[i, j, :len(value.data[0])]=value.data[j+1]
+    store_correction_table(key, (bg_files, positions, array(bg_index), first_detectors, table))
+  return correction_tables[key][1:]
+
+def get_vanadium_table(vanadium_data):
+  '''
+    Create a lookup table of the sorted 2Θ values of a vanadium dataset,
+    which is only calculated once and reused for all maps.
+    
+    :param vanadium_data: Vanadium dataset with 2Θ values in the first column
+    
+    :return: Sorted 2Θ values and their indices in the dataset
+  '''
+  key=('vanadium', id(vanadium_data))
+  if not key in correction_tables:
+    tth=asarray(vanadium_data.data[0])
+    order=tth.argsort(kind='mergesort')
+    store_correction_table(key, (vanadium_data, tth[order], order))
+  return correction_tables[key][1:]
+
 
 class DNSSession(GUI, GenericSession):
   '''
@@ -725,11 +788,24 @@ class DNSSession(GUI, GenericSession):
       else:
         return "%s: \n"%(self.active_file_name)
 
+  def join_scans(self, scans, counts, errors):
+    '''
+      Create a new scan from a list of scans at the same position with the
+      given counts and errors, the other columns are copied from the
+      first scan.
+    '''
+    from copy import deepcopy
+    joint=deepcopy(scans[0])
+    joint.data[1]=PhysicalProperty(joint.data[1].dimension, joint.data[1].unit, counts)
+    joint.data[2]=PhysicalProperty(joint.data[2].dimension, joint.data[2].unit, errors)
+    if getattr(joint, 'name', False):
+      joint.name='+'.join([joint.name]+[add.name for add in scans[1:]])
+    return joint
+
   def sum_same_omega_tth(self, scans):
     '''
       Find scan files with same omega and tth value and sum them up.
     '''
-    from copy import deepcopy
     print '\tSumming up files with same positions [ω,2θ]'
     scandict={}
     for scan in scans:
@@ -746,30 +822,19 @@ class DNSSession(GUI, GenericSession):
       if len(value)==1:
         outscans.append(value[0])
       else:
-        joint=deepcopy(value[0])
-        # unscale the counts
-        joint.data[1]*=joint.dns_info[scale]
-        # square the errors
-        joint.data[2]*=joint.dns_info[scale]
-        joint.data[2]**=2
-        time=joint.dns_info[scale]
-        for add in value[1:]:
-          joint.data[1]+=(add.data[1]*add.dns_info[scale])
-          joint.data[2]+=(add.data[2]*add.dns_info[scale])**2
-          time+=add.dns_info[scale]
-          if getattr(joint, 'name', False):
-            joint.name+='+'+add.name
-        joint.data[1]/=time
-        joint.data[2]/=time
-        joint.data[2]**=0.5
-        outscans.append(joint)
+        # unscale the counts and errors of all scans at once
+        scaling=array([add.dns_info[scale] for add in value], dtype=float)[:, newaxis]
+        counts=array([add.data[1] for add in value], dtype=float)*scaling
+        errors=array([add.data[2] for add in value], dtype=float)*scaling
+        time=scaling.sum()
+        outscans.append(self.join_scans(value, counts.sum(axis=0)/time,
+                                        sqrt((errors**2).sum(axis=0)/time)))
     return outscans
 
   def sum_same_tth(self, scans):
     '''
       Find scan files with same omega and tth value and sum them up.
     '''
-    from copy import deepcopy
     scandict={}
     for scan in scans:
       key=(scan.dns_info['detector_bank_2T'],
@@ -784,20 +849,47 @@ class DNSSession(GUI, GenericSession):
       if len(value)==1:
         outscans.append(value[0])
       else:
-        joint=deepcopy(value[0])
-        # square the errors
-        joint.data[2]**=2
-        for add in value[1:]:
-          joint.data[1]+=add.data[1]
-          joint.data[2]+=add.data[2]**2
-          if getattr(joint, 'name', False):
-            joint.name+='+'+add.name
-        joint.data[1]/=len(value)
-        joint.data[2]/=len(value)
-        joint.data[2]**=0.5
-        outscans.append(joint)
+        counts=array([add.data[1] for add in value], dtype=float)
+        errors=array([add.data[2] for add in value], dtype=float)
+        outscans.append(self.join_scans(value, counts.mean(axis=0),
+                                        sqrt((errors**2).mean(axis=0))))
     return outscans
 
+  def get_map_rows(self, scan, index, omega_offset, detector_angles):
+    '''
+      Calculate the rows of a DNS map for all points of one scan at once.
+      
+      :param scan: Raw data object of one file
+      :param index: Number of the file in the sequence
+      :param omega_offset: Offset of the sample rotation
+      :param detector_angles: The raw data contains the 2Θ values of each detector (D7)
+      
+      :return: Array with one row per point of the scan
+    '''
+    data=scan.get_filtered_data_matrix().astype(float)
+    detector_bank_2T=scan.dns_info['detector_bank_2T']
+    omega=scan.dns_info['omega']
+    if detector_angles:
+      rows=empty((data.shape[1], 12))
+      rows[:, 1]=round(omega-omega_offset, 1)
+      rows[:, 2]=round(omega, 1)
+      rows[:, 3]=data[3]
+      rows[:, 5:7]=data[1:3].transpose()
+      rows[:, 7:9]=data[1:3].transpose()
+    else:
+      channels=data.shape[0]-1
+      rows=empty((data.shape[1], 2*channels+8))
+      rows[:, 1]=round(omega-omega_offset-detector_bank_2T, 1)
+      rows[:, 2]=round(omega-detector_bank_2T, 1)
+      rows[:, 3]=data[0]*config.DETECTOR_ANGULAR_INCREMENT+config.FIRST_DETECTOR_ANGLE-detector_bank_2T
+      rows[:, 5:5+channels]=data[1:].transpose()
+      rows[:, 5+channels:5+2*channels]=data[1:].transpose()
+    rows[:, 0]=detector_bank_2T
+    rows[:, 4]=data[0]
+    rows[:, -3:-1]=0
+    rows[:, -1]=index
+    return rows
+
   def create_maps(self, file_name):
     '''
       Crates a MeasurementData object which can be used to
@@ -816,30 +908,11 @@ class DNSSession(GUI, GenericSession):
     increment=self.file_options[file_name][2]
     #num_range=self.file_options[file_name][3]
     #postfix=self.file_options[file_name][4]
-    if 'detector_angles' in scans[0].dns_info:
-      # Functoin used to append data to the object
-      def append_to_map(point):
-        return [detector_bank_2T,
-                round(omega-omega_offset, 1),
-                round(omega, 1),
-                point[3],
-                point[0],
-                point[1],
-                point[2],
-                point[1],
-                point[2],
-                0, 0, i]
-    else:
-      # Functoin used to append data to the object
-      def append_to_map(point):
-        return [detector_bank_2T,
-                round(omega-omega_offset-detector_bank_2T, 1),
-                round(omega-detector_bank_2T, 1),
-                point[0]*config.DETECTOR_ANGULAR_INCREMENT+config.FIRST_DETECTOR_ANGLE-detector_bank_2T,
-                point[0]
-                ]+point[1:]+point[1:]+[0, 0, i]
+    detector_angles=('detector_angles' in scans[0].dns_info)
     if self.COMBINE_SAME_OMEGA_TTH:
       scans=self.sum_same_omega_tth(scans)
+    # collect the map rows of all scans for each polarization chanel
+    map_blocks=[[] for ignore in range(increment)]
     # go through every raw data object.
     for i, scan in enumerate(scans):
       if i<increment:
@@ -847,7 +920,7 @@ class DNSSession(GUI, GenericSession):
           channels=['x', 'x', 'y', 'y', 'z', 'z']
           scan.dns_info['pol_channel']=channels[i]
         # Create the objects for every polarization chanel
-        if 'detector_angles' in scans[0].dns_info:
+        if detector_angles:
           sub=2
         else:
           sub=1
@@ -871,11 +944,9 @@ class DNSSession(GUI, GenericSession):
         active_map.info="\n".join(map(lambda item: item[0]+': '+str(item[1]),
                                     sorted(scan.dns_info.items())))
       # add the data
-      data=[list(point) for point in scan]
-      detector_bank_2T=scan.dns_info['detector_bank_2T']
-      omega=scan.dns_info['omega']
-      map(self.file_data[file_name][i%increment].append, map(append_to_map, data))
-      #append_combine_data()
+      map_blocks[i%increment].append(self.get_map_rows(scan, i, omega_offset, detector_angles))
+    for active_map, blocks in zip(self.file_data[file_name], map_blocks):
+      active_map.extend(vstack(blocks))
     # perform calculations
     self.active_file_data=self.file_data[file_name]
     if self.CORRECT_FLIPPING:
@@ -1160,6 +1231,12 @@ class DNSSession(GUI, GenericSession):
         print "Plotting '"+name+"' sequences."
         print self.plot_active()
 
+  def get_export_items(self):
+    '''
+      Return the (file name, dataset) items to be exported without the raw data.
+    '''
+    return [item for item in GenericSession.get_export_items(self) if not item[0].endswith("|raw_data")]
+
   def set_transformations(self):
     '''
       Set the transformation options from q_x to dx*,dy* 
@@ -1917,30 +1994,17 @@ class DNSMeasurementData(MeasurementData):
         :return: Changed list of arrays
       '''
       nc=self.number_of_channels
-      # find the background for the right detectors
-      # create a list of all columns in the background files
-      background_data=self.background_data
-      detector_positions=point[0]
-      detectors=point[4]
-      #bg_items=[background_data[det_pos] for det_pos in detector_positions]
-      bg=[zeros(len(detector_positions)) for i in range(nc*2)]
-      for key, value in background_data.items():
-        first_det=value.data[0][0]
-        indices=where(detector_positions==key)[0]
-        detector_indices=(detectors[indices]-first_det).astype(int)
-        for i in range(nc*2):
-          bg[i][indices]=value.data[i+1][detector_indices]
-      #  print indices
-      #  bg_items[indices]=background_data[key]
-      #if 'detector_angles' in background_data.values()[0].dns_info:
-      #  bg_columns=[[] , []]
-      #else:
-      #  bg_columns=[[] for i in range(len(background_data.values()[0].data)-1)]
-      #for i, detector in enumerate(detectors):
-      #  bg_data=bg_items[i].data
-      #  for j, column in enumerate(bg_columns):
-      #    column.append(bg_data[j+1].values[bg_data[0].values.index(detector)])
-      #bg=map(array, bg_columns)
+      # find the background file and detector for each point in the lookup table
+      positions, bg_index, first_detectors, table=get_background_table(self.background_data)
+      detector_positions=asarray(point[0])
+      detectors=asarray(point[4])
+      positions=positions.astype(detector_positions.dtype)
+      slots=minimum(positions.searchsorted(detector_positions), len(positions)-1)
+      found=where(positions[slots]==detector_positions)[0]
+      files=bg_index[slots[found]]
+      detector_indices=(detectors[found]-first_detectors[files]).astype(int)
+      bg=zeros((nc*2, len(detector_positions)))
+      bg[:, found]=table[files, :nc*2, detector_indices].transpose()
       for i in range(nc):
         point[i+2*nc+5]=point[i+5]-bg[i]
         point[i+3*nc+5]=sqrt(point[i+nc+5]**2+bg[i+nc]**2)
@@ -1966,10 +2030,12 @@ class DNSMeasurementData(MeasurementData):
         # the detector minus the first detector name is the index
         vn_indices=(point[4]-vn_list[0][0]).astype(int)
       else:
-        # get indices for tth values
-        vn_indices=array(map(lambda tth: vn_list[0].index(
-                    [item for item in vn_list[0] if item<=tth][-1]),
-                    point[3])).astype(int)
+        # get indices of the first point with the largest tth value below each point
+        sorted_tth, order=get_vanadium_table(self.vanadium_data)
+        below=sorted_tth.searchsorted(asarray(point[3]), side='right')-1
+        if (below<0).any():
+          raise IndexError, "2Θ values below the vanadium data range"
+        vn_indices=order[sorted_tth.searchsorted(sorted_tth[below], side='left')]
       # create a list of arrays with the corresponding intensities
       vn=vn_list[1][vn_indices]
       errvn=vn_list[2][vn_indices]
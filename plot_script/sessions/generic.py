@@ -10,11 +10,13 @@ import os
 import sys
 
 from time import sleep
+from threading import Lock
 import subprocess
-from cPickle import load, dumps, dump
 from plot_script import  measurement_data_structure
 from plot_script import  measurement_data_plotting
 from plot_script import  parallel
+from plot_script.snapshots import read_snapshot, write_snapshot
+from plot_script.import_cache import import_cache, reader_version
 from plot_script.config import gnuplot_preferences, transformations, user_config
 from plot_script.config import templates as template_config
 from plot_script.read_data import GENERIC_FORMATS
@@ -71,8 +73,8 @@ Options:
 
 \tInput/Output settings:
 \t-gs\t\tUse gnuplot in script mode, in the case Gnuplot.py is not working (slower)
-\t-rd\t\tRead file directly, do not use .mds file created in earlier runs.
-\t-no-mds\t\tDon't create .mds files. (.mds files are used for faster reaccessing)
+\t-rd\t\tRead file directly, do not use the import cache filled in earlier runs.
+\t-no-mds\t\tDon't store imported data in the import cache. (The cache is used for faster reaccessing)
 
 \tPlott settings:
 \t-e\t\tPlot with errorbars
@@ -80,6 +82,9 @@ Options:
 \t-logy\t\tPlot logarithmic in y
 \t-logz\t\tPlot logarithmic in z
 \t-scp\t\tUse script mode, no GUI will be shown
+\t-export [pattern]\tExport the plots of all datasets without GUI, the image names are created
+\t\t\tfrom the pattern as in the GUI export (e.g. "[name]_[nr].png")
+\t-export-workers [n]\tNumber of gnuplot processes used for the export
 
 \tGeneral Data treatment:
 \t-ipy "[line]"\tAfter opening the GUI start the ipython console and execute a line given in "".
@@ -90,7 +95,7 @@ Options:
 
 \tAdvanced settings:
 \t-ipdrop \tRead data and drop to IPython console without running the GUI
-\t-ipmp \tConnect to IPython multiprocessing cluster for e.g. faster fit calculation
+\t-ipmp \tStart parallel worker processes (or connect to IPython cluster) for e.g. faster fit calculation
 \t--nolimit\tDon't limit the amount of memory consumed by the program so there will not be a MemoryError 
 \t\t\t(be carefull, can lead to a non responsive system from operations causing to high memory usage)
 \t--debug\t\tDon't redirect the output to any GUI windows but show it on the command line, writes additional 
@@ -131,7 +136,7 @@ The gnuplot graph parameters are set in the gnuplot_preferences.py file, if you
   # known command line options list
   COMMANDLINE_OPTIONS=['s', 's2', 'i', 'gs', 'rd', 'no-mds', 'o', 'ni', 'c', 'sc', 'st', 'sxy', 'e', 'logx', 'logy', 'logz', 'scp',
                         'template', 'no-trans', '-help', '-debug', '-nolimit', 'startuppath', 'mpl',
-                        'ipy', 'ipr', 'ipdrop', 'ipmp']
+                        'ipy', 'ipr', 'ipdrop', 'ipmp', 'export', 'export-workers']
   # options:
   use_gui=True # activate graphical user interface
   seq=[1, 10000] # use sequences from 1 to 10 000
@@ -149,13 +154,16 @@ The gnuplot graph parameters are set in the gnuplot_preferences.py file, if you
   logz=False # plot logarithmic in z direction
   picture_width='1600'
   picture_height='1200'
+  export_naming=None # naming pattern for the batch export of all plots
+  export_workers=None # number of gnuplot processes used for the batch export
   font_size=24.
   # TODO: command line file printing hast to be added.
   print_plot=False # send plots to printer
   unit_transformation=True # make transformations as set in preferences file
   TRANSFORMATIONS=[] # a list of unit TRANSFORMATIONS, that will be performed on the data
-  read_directly=False # don't use pickled file, read the data diretly
-  mds_create=True
+  read_directly=False # don't use the import cache, read the data diretly
+  mds_create=True # store imported data in the import cache
+  IMPORT_OPTIONS=[] # attributes which change the data read from a file
   ONLY_IMPORT_MULTIFILE=False
   DEBUG=False
   ipdrop=False
@@ -217,11 +225,13 @@ The gnuplot graph parameters are set in the gnuplot_preferences.py file, if you
           self.active_file_data=self.file_data[files[0].rsplit('.mdd', 1)[0].rsplit('.mds', 1)[0]]
           self.active_file_name=files[0].rsplit('.mdd', 1)[0].rsplit('.mds', 1)[0]
 
-  def initialize_gnuplot(self):
+  def initialize_gnuplot(self, workers=None):
     '''
-      Start a gnuplot instance for the main plotting.
+      Start the pool of gnuplot instances for the main plotting.
+      
+      :param workers: Number of gnuplot processes, default from gnuplot_preferences
     '''
-    if measurement_data_plotting.gnuplot_instance is None:
+    if measurement_data_plotting.gnuplot_pool is None:
       # if fontconfig is available use it to set GDLibrarayPath
       from plot_script.config import fontconfig
       if fontconfig.font_config is not None:
@@ -240,14 +250,8 @@ The gnuplot graph parameters are set in the gnuplot_preferences.py file, if you
                       shell=False)
           test.stdin.write('exit\n')
           test.communicate()
-        # run the real instance
-        measurement_data_plotting.gnuplot_instance=subprocess.Popen([program],
-                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                  shell=gnuplot_preferences.EMMULATE_SHELL,
-                  creationflags=gnuplot_preferences.PROCESS_FLAGS)
-        # try to set encoding once, it is not altered by the reset function
-        measurement_data_plotting.gnuplot_instance.stdin.write(#@UndefinedVariable
-                  'set encoding '+gnuplot_preferences.ENCODING+'\n')
+        # run the real instances
+        measurement_data_plotting.gnuplot_pool=measurement_data_plotting.GnuplotPool(program, workers)
 
       except:
         raise RuntimeError, "Problem communicating with Gnuplot, please check your system settings! Gnuplot command used: %s"%program
@@ -312,6 +316,13 @@ The gnuplot graph parameters are set in the gnuplot_preferences.py file, if you
           elif last_argument_option[1]=='ipr':
             self.ipython_commands.append("run -i %s"%argument)
             last_argument_option=[False, '']
+          elif last_argument_option[1]=='export':
+            self.export_naming=argument
+            self.use_gui=False
+            last_argument_option=[False, '']
+          elif last_argument_option[1]=='export-workers':
+            self.export_workers=int(argument)
+            last_argument_option=[False, '']
           else:
             found_add, last_argument_option=self.read_argument_add(argument, last_argument_option, input_file_names)
             if not found_add:
@@ -436,8 +447,7 @@ The gnuplot graph parameters are set in the gnuplot_preferences.py file, if you
     '''
     # close gnuplot
     try:
-      measurement_data_plotting.gnuplot_instance.stdin.write('exit') #@UndefinedVariable
-      measurement_data_plotting.gnuplot_instance.communicate() #@UndefinedVariable
+      measurement_data_plotting.gnuplot_pool.close() #@UndefinedVariable
     except:
       pass
     # remove temp files
@@ -549,13 +559,6 @@ The gnuplot graph parameters are set in the gnuplot_preferences.py file, if you
       
       :return: A list of datasets that have been found in the file.
     '''
-    # for faster access the MeasurementData objects are saved via cPickle
-    # when this file exists it is used to reload it.
-    # This can be ignored by the command line option '-rd'
-    # if the script is newer than the .mds file, reimport it
-    own_path=os.path.abspath(__file__)
-    if 'library.zip' in own_path:
-      own_path=own_path.split('library.zip')[0]+'library.zip'
     if filename.endswith('.mds.gz') or filename.endswith('.mds') or \
       filename.endswith('.mdd.gz') or filename.endswith('.mdd'):
       # import binary files from this program
@@ -566,25 +569,16 @@ The gnuplot graph parameters are set in the gnuplot_preferences.py file, if you
         return self.active_file_data
       else:
         return []
-    if filename.endswith('.gz'):
-      zip_mds=True
-      mds_name=filename.rsplit('.', 1)[0]+'.mds.gz'
-    else:
-      zip_mds=False
-      mds_name=filename+'.mds'
-    # only use mds file if it is newer than the original data and this script
-    if os.path.exists(mds_name) and not self.read_directly and \
-        (os.path.getmtime(own_path)<os.path.getmtime(mds_name)) and \
-        (not os.path.exists(filename) or \
-        (os.path.getmtime(filename)<os.path.getmtime(mds_name))):
-      print "Importing previously saved data from '"+mds_name+"'."
-      if zip_mds:
-        import gzip
-        pickled=gzip.open(mds_name, 'rb')
-      else:
-        pickled=open(mds_name, 'rb')
-      datasets=load(pickled)
-      pickled.close()
+    # for faster access the imported datasets are stored in the import cache,
+    # this can be ignored by the command line option '-rd'
+    cache_key=None
+    if (self.mds_create or not self.read_directly) and os.path.isfile(filename):
+      cache_key=import_cache.key(filename, reader_version(self), self.get_import_options())
+    datasets=None
+    if cache_key is not None and not self.read_directly:
+      datasets=import_cache.get(cache_key)
+    if datasets is not None:
+      print "Importing previously read data of '"+filename+"' from cache."
     else:
       print "Trying to import '"+filename+"'."
       is_generic=False
@@ -595,14 +589,8 @@ The gnuplot graph parameters are set in the gnuplot_preferences.py file, if you
           break
       if not is_generic:
         datasets=self.read_file(filename)
-      if datasets!=[] and datasets!='NULL' and self.mds_create:
-        if zip_mds:
-          import gzip #@Reimport
-          pickling=gzip.open(mds_name, 'wb')
-        else:
-          pickling=open(mds_name, 'wb')
-        dump(datasets, pickling, 2)
-        pickling.close()
+      if cache_key is not None and datasets!=[] and datasets!='NULL' and self.mds_create:
+        import_cache.put(cache_key, datasets)
     if datasets=='NULL':
       return []
     datasets=self.create_numbers(datasets) # enumerate the sequences and sort out unselected
@@ -611,6 +599,13 @@ The gnuplot graph parameters are set in the gnuplot_preferences.py file, if you
     self.new_file_data_treatment(datasets)
     return datasets # for reuse in child class
 
+  def get_import_options(self):
+    '''
+      Return the settings of this session which change the data read from a file,
+      they are used for the key of the import cache.
+    '''
+    return [self.__class__.__name__]+[(name, getattr(self, name, None)) for name in self.IMPORT_OPTIONS]
+
   def new_file_data_treatment(self, datasets):
     '''
       Perform common datatreatment tasks on all Datasets.
@@ -669,6 +664,74 @@ The gnuplot graph parameters are set in the gnuplot_preferences.py file, if you
       self.active_file_data=self.file_data[name]
       self.plot_active()
 
+  def get_export_items(self):
+    '''
+      Return a list of (file name, dataset) items to be exported by export_all.
+    '''
+    items=[]
+    for name in self:
+      items+=[(name, dataset) for dataset in self.file_data[name]]
+    return items
+
+  def export_all(self, naming='[name]_[nr].png', folder='', workers=None):
+    '''
+      Export the plots of all datasets of all files without the GUI.
+      The data of one plot is exported while the gnuplot processes of the pool
+      render the plots before, so the work is split across the datasets.
+      Only about as many plots as gnuplot processes are exported in advance
+      to limit the number of temporary data files.
+      
+      :param naming: Pattern for the image names, [name] is replaced by the import file name
+      :param folder: Destination folder of the images
+      :param workers: Number of gnuplot processes, default from gnuplot_preferences
+      
+      :return: List of (file name, dataset number, error message) for all failed plots
+    '''
+    pool=measurement_data_plotting.gnuplot_pool
+    if pool is not None and workers is not None and len(pool.workers)!=workers:
+      pool.close()
+      measurement_data_plotting.gnuplot_pool=None
+    self.initialize_gnuplot(workers)
+    items=self.get_export_items()
+    failures=[]
+    progress=[0]
+    lock=Lock()
+    def export_finished(output, ignore, name, number):
+      lock.acquire()
+      progress[0]+=1
+      if output!='':
+        failures.append((name, number, output))
+      print 'Exported plot %i/%i'%(progress[0], len(items))
+      lock.release()
+    workers=len(measurement_data_plotting.gnuplot_pool.workers)
+    requests=[]
+    for name, dataset in items:
+      # keep one plot waiting for each gnuplot process, the data files of
+      # a plot are removed after it has been rendered
+      while len(requests)>workers:
+        requests.pop(0).finished.wait()
+      file_name_raw=os.path.split(name)[1]
+      output_file=os.path.join(folder, naming.replace('[name]', file_name_raw))
+      try:
+        requests.append(measurement_data_plotting.gnuplot_plot_script(self,
+                                    dataset.plot_together,
+                                    name,
+                                    '.out',
+                                    dataset.short_info,
+                                    [ds.short_info for ds in dataset.plot_together],
+                                    self.plot_with_errorbars,
+                                    output_file,
+                                    callback=lambda output, variables, name=name, number=dataset.number:
+                                        export_finished(output, variables, name, number)))
+      except Exception, error:
+        export_finished(str(error) or error.__class__.__name__, [], name, dataset.number)
+    for request in requests:
+      request.finished.wait()
+    print 'Export Done! %i plots created, %i failed.'%(len(items)-len(failures), len(failures))
+    for name, number, output in failures:
+      print "  %s #%s: %s"%(name, number, output.splitlines()[-1])
+    return failures
+
   def plot(self, datasets, file_name_prefix, title, names):
     '''
       Plot one or a list of datasets.
@@ -707,26 +770,16 @@ The gnuplot graph parameters are set in the gnuplot_preferences.py file, if you
   def store_snapshot(self, name=None, multiplots=False):
     '''
       Create a snapshot of the active measurement to reload it later.
-      The method uses cPickle to create a file with the content of
-      the active_file_data list and stores it in active_file_name.mdd.
+      The active_file_data list is stored in active_file_name.mdd with
+      the columnar format of the snapshots module.
     '''
     dump_obj=self.create_snapshot_obj(multiplots=multiplots)
-    dump_str=dumps(dump_obj,-1)
     if not name:
-      if len(dump_str)>(1024*1024*10):
-        name=self.active_file_name+'.mdd.gz'
-      else:
-        name=self.active_file_name+'.mdd'
-    if name.endswith('.gz'):
-      import gzip
-      dump_file=gzip.open(name, 'wb')
-    else:
-      if not (name.endswith('.mdd') or name.endswith('.mds')):
-        name+='.mdd'
-      dump_file=open(name, 'wb')
+      name=self.active_file_name+'.mdd'
+    if not (name.endswith('.gz') or name.endswith('.mdd') or name.endswith('.mds')):
+      name+='.mdd'
     print "Writing snapshot to file %s..."%(os.path.split(name)[1])
-    dump_file.write(dump_str)
-    dump_file.close()
+    write_snapshot(dump_obj, name)
 
   def reload_snapshot(self, name=None):
     '''
@@ -739,24 +792,13 @@ The gnuplot graph parameters are set in the gnuplot_preferences.py file, if you
         name=self.active_file_name+'.mdd.gz'
       else:
         name=self.active_file_name
-    if name.endswith('.gz'):
-      import gzip
-      if os.path.exists(name):
-        dump_file=gzip.open(name, 'rb')
-      else:
-        print "No snapshot file found."
-        return False
-    else:
-      if not (name.endswith('.mdd') or name.endswith('.mds')):
-        name+='.mdd'
-      if os.path.exists(name):
-        dump_file=open(name, 'rb')
-      else:
-        print "No snapshot file found."
-        return False
+    if not (name.endswith('.gz') or name.endswith('.mdd') or name.endswith('.mds')):
+      name+='.mdd'
+    if not os.path.exists(name):
+      print "No snapshot file found."
+      return False
     print "Reading snapshot from file %s..."%name
-    dump_obj=load(dump_file)
-    dump_file.close()
+    dump_obj=read_snapshot(name)
     return self.extract_snapshot_obj(dump_obj)
 
   def create_snapshot_obj(self, multiplots=False):
@@ -824,19 +866,13 @@ def read_full_snapshot(name):
     if not os.path.exists(name):
       print "No snapshot file found."
       return None
-    if name.endswith('.gz'):
-      import gzip
-      dump_file=gzip.open(name, 'rb')
-    else:
-      dump_file=open(name, 'rb')
     # prepare plugin folders
     user_folder=os.path.join(os.path.expanduser('~'), '.plotting_gui')
     if not os.path.join(user_folder, 'plugins') in sys.path:
       sys.path.append(os.path.join(user_folder, 'plugins'))
     from plot_script.plugins import global_plugins #@UnusedImport
     print "Reading snapshot from file %s..."%name
-    dump_obj=load(dump_file)
-    dump_file.close()
+    dump_obj=read_snapshot(name)
     if type(dump_obj) is dict:
       data=dump_obj['data']
       file_name=dump_obj['origin']
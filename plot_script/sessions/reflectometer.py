@@ -9,10 +9,12 @@ import sys
 import math
 import subprocess
 import time
+import numpy
 # import GenericSession, which is the parent class for the squid_session
 from generic import GenericSession
 # import parameter class for fits
 from reflectometer_fit.reflectometer import * #@UnusedWildImport
+from reflectometer_fit.parratt import ReflectivityFunction
 # importing preferences and data readout
 from plot_script.read_data import reflectometer as read_data
 # use own datastructure also for templates
@@ -73,6 +75,7 @@ class ReflectometerSession(GUI, ReflectometerFitGUI, GenericSession):
   #++++++++++++++++++ local variables +++++++++++++++++
   FILE_WILDCARDS=[('D8 reflectometer', '*.[Uu][Xx][Dd]', '*.[Uu][Xx][Dd].gz', '*.raw'), ('Philips X\'Pert', '*.txt', '*.xrdml')]
   COMMANDLINE_OPTIONS=GenericSession.COMMANDLINE_OPTIONS+['fit', 'ref']
+  IMPORT_OPTIONS=['DATA_COLUMNS'] # attributes which change the data read from a file
   #options:
   show_counts=False # dont convert to conts/s
   export_for_fit=False # make the changes needed for the fit program to work
@@ -331,6 +334,43 @@ class ReflectometerSession(GUI, ReflectometerFitGUI, GenericSession):
                         )
     return process
 
+  def native_fit(self, dataset, max_iter, xfrom=None, xto=None):
+    '''
+      Fit the dataset with the reflectivity calculated in python, which gives the same
+      result as the fit.f90 program without compiling and starting it.
+      The refined parameters are those selected in the fit object.
+      
+      :param dataset: MeasurementData object with q as x-values
+      :param max_iter: Maximum number of iterations, 0 for only a simulation
+      :param xfrom: Lower limit of the fitted q-range
+      :param xto: Upper limit of the fitted q-range
+      
+      :return: Simulation as MeasurementData and the parameters and errors as dictionaries like in read_fit_file
+    '''
+    fit_object=self.active_file_data.fit_object
+    function=ReflectivityFunction(fit_object)
+    data=dataset.get_filtered_data_matrix()
+    x=data[dataset.xdata]
+    y=data[dataset.ydata]
+    if max_iter>0 and len(function.refine_parameters)>0:
+      function.max_iter=max_iter
+      function.x_from=xfrom
+      function.x_to=xto
+      ignore, covariance=function.refine(x, y)
+      parameters, errors=function.get_fit_results(covariance)
+    else:
+      parameters={}
+      errors={}
+      for index in fit_object.fit_params:
+        parameters[index]=function.parameters[index-1]
+        errors[index]=0.
+    # simulate in the q-range of fit.f90
+    q=numpy.linspace(0., x.max(), 1001)[1:]
+    simu=read_data.MeasurementData([['Q', 'Å^{-1}'], ['Intensity', 'counts/s'], ['error', 'counts']], [], 0, 1, 2)
+    simu.info='Simulation'
+    simu.extend(numpy.array([q, function(q), numpy.zeros_like(q)]).transpose())
+    return simu, parameters, errors
+
   def find_total_reflection(self, dataset):
     '''
       try to find the angle of total reflection by
@@ -357,6 +397,12 @@ class ReflectometerSession(GUI, ReflectometerFitGUI, GenericSession):
                    only_fitted_columns=True, xfrom=0.005,
                    xto=self.find_total_reflection(dataset))
     self.active_file_data.fit_object.set_fit_parameters(scaling=True) # fit only scaling factor
+    if config.NATIVE_SIMULATION:
+      ignore, parameters, ignore=self.native_fit(dataset, 20, xfrom=0.005,
+                                                 xto=self.find_total_reflection(dataset))
+      self.active_file_data.fit_object.get_parameters(parameters)
+      self.active_file_data.fit_object.fit=0
+      return None
     # create the .ent file
     ent_file=open(self.TEMP_DIR+'fit_temp.ent', 'w')
     ent_file.write(self.active_file_data.fit_object.get_ent_str()+'\n')
@@ -388,6 +434,11 @@ class ReflectometerSession(GUI, ReflectometerFitGUI, GenericSession):
                    print_info=False, only_fitted_columns=True,
                    xfrom=self.find_total_reflection(dataset))
     self.active_file_data.fit_object.set_fit_parameters(layer_params=layer_dict, substrate_params=[2]) # set all roughnesses to be fit
+    if config.NATIVE_SIMULATION:
+      ignore, parameters, ignore=self.native_fit(dataset, 20, xfrom=self.find_total_reflection(dataset))
+      self.active_file_data.fit_object.get_parameters(parameters)
+      self.active_file_data.fit_object.fit=0
+      return None
     # create the .ent file
     ent_file=open(self.TEMP_DIR+'fit_temp.ent', 'w')
     ent_file.write(self.active_file_data.fit_object.get_ent_str()+'\n')
@@ -459,6 +510,10 @@ class ReflectometerSession(GUI, ReflectometerFitGUI, GenericSession):
     ent_file.write(self.active_file_data.fit_object.get_ent_str()+'\n')
     ent_file.close()
     print "Simulate the measurement"
+    if config.NATIVE_SIMULATION:
+      simu, ignore, ignore=self.native_fit(dataset, 0)
+      numpy.savetxt(export_file_prefix+'.sim', numpy.array([simu.x, simu.y]).transpose())
+      return
     self.proc=self.call_fit_program(export_file_prefix+'.ent',
                                                              export_file_prefix+'.res',
                                                              export_file_prefix, 20)
@@ -85,6 +85,21 @@ class FitParameters:
     ent_string+='### End of layers.\n'
     return ent_string, layer_index, para_index
 
+  def __get_parameter_list_layers__(self, use_roughness_gradient=True):
+    '''
+      Return the parameters of all layers in the order of the .ent file parameter indices.
+      The function has to be used in get_parameter_list from derived class.
+    '''
+    parameters=[]
+    for layer in self.layers:
+      if layer.multilayer:
+        parameters+=layer.get_parameter_list(use_roughness_gradient=use_roughness_gradient)
+      else:
+        parameters+=layer.get_parameter_list()
+    # substrate data without thickness
+    parameters+=self.substrate.get_parameter_list()[1:]
+    return parameters
+
   def __get_ent_str_substrate__(self, layer_index, para_index):
     '''
       Create string for substrate part of .ent file for the fit script from given parameters.
@@ -328,6 +343,20 @@ class MultilayerParam:
     except ValueError:
       None
 
+  def get_parameter_list(self, use_roughness_gradient=True):
+    '''
+      Return the parameters of all repeated layers in the order of the .ent file.
+    '''
+    parameters=[]
+    for i in range(self.repititions):
+      if self.repititions>1 and use_roughness_gradient:
+        add_roughness=float(self.repititions-i-1)/(self.repititions-1)*self.roughness_gradient
+      else:
+        add_roughness=0.
+      for layer in self.layers:
+        parameters+=layer.get_parameter_list(add_roughness)
+    return parameters
+
   def get_ent_text(self, layer_index, para_index, use_roughness_gradient=True):
     '''
       Function to get the text lines for the .ent file.
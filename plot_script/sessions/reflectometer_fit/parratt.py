@@ -0,0 +1,372 @@
+# -*- encoding: utf-8 -*-
+'''
+  Numpy implementation of the reflectivity simulations of the fortran programs fit.f90 (x-ray
+  reflectivity with the Parratt recursion) and pnr_multi (polarized neutron reflectivity with
+  2x2 spin matrices). All scattering vectors are calculated at once, so a simulation takes only
+  a few milliseconds and no compiler is needed.
+
+  The fit functions take their parameters from RefFitParameters or TreffFitParameters objects.
+  The parameter with index i in the .ent file is parameters[i-1] of the function, so the
+  results can be used with get_parameters and get_errors as the ones read from the fortran output.
+'''
+
+import numpy
+from numpy import pi, sqrt, exp, sin, cos, arcsin
+from plot_script.fit_data import FitFunction
+
+__author__="Artur Glavic"
+__credits__=[]
+from plot_script.plotpy_info import __copyright__, __license__, __version__, __maintainer__, __email__ #@UnusedImport
+__status__="Development"
+
+# number of points used for the convolution with the gaussian resolution in the range of ±4σ
+RESOLUTION_POINTS=41
+# The fit of all polarization channels uses x=channel*CHANNEL_SPACING+Θ[mrad]
+CHANNEL_SPACING=10000.
+# polarization of the incoming and analyzed beam for the channels ++, --, +-, -+ as
+# function of polarizer-, analyzer-, first flipper- and second flipper-efficiency
+CHANNEL_POLARIZATIONS=[
+                       lambda pol1, pol2, fl1, fl2: (pol1*fl1, pol2),
+                       lambda pol1, pol2, fl1, fl2: (-pol1, -pol2*fl2),
+                       lambda pol1, pol2, fl1, fl2: (pol1*fl1, -pol2*fl2),
+                       lambda pol1, pol2, fl1, fl2: (-pol1, pol2),
+                       ]
+
+def gauss_convolution(function, x, sigma):
+  '''
+    Convolute a function with a gaussian in the range of ±4σ.
+
+    :param function: Function calculated for a flat array of x-values
+    :param x: Array of x-values
+    :param sigma: Width of the gaussian, scalar or one value for each x
+
+    :return: Array of convoluted function values
+  '''
+  steps=numpy.linspace(-4., 4., RESOLUTION_POINTS)
+  weights=exp(-0.5*steps**2)*(steps[1]-steps[0])/sqrt(2.*pi)
+  weights[0]*=0.5
+  weights[-1]*=0.5
+  sigma=numpy.asarray(sigma, dtype=numpy.float64)[..., numpy.newaxis]
+  x_points=x[:, numpy.newaxis]+sigma*steps[numpy.newaxis, :]
+  y_points=function(x_points.flatten()).reshape(x_points.shape)
+  return (y_points*weights).sum(axis=1)
+
+def parratt(q, wavelength, thickness, delta, beta, roughness):
+  '''
+    Calculate the specular reflectivity of a layer system with the Parratt recursion
+    and Névot-Croce roughness factors.
+
+    :param q: Array of scattering vector values in Å^{-1}
+    :param wavelength: Wavelength in Å
+    :param thickness: Thicknesses of the layers from top to bottom
+    :param delta: δ of the layers and the substrate
+    :param beta: β of the layers and the substrate
+    :param roughness: Roughness of the top interface of each layer and the substrate
+
+    :return: Array of reflectivity values
+  '''
+  alpha=arcsin(q*wavelength/(4.*pi))
+  # the first medium is vacuum
+  index=1.-numpy.hstack([[0.], delta])+1j*numpy.hstack([[0.], beta])
+  kz=2.*pi/wavelength*sqrt(index[:, numpy.newaxis]**2-(cos(alpha)**2)[numpy.newaxis, :])
+  z=-numpy.hstack([[0.], numpy.cumsum(thickness)])
+  X=numpy.zeros(q.shape, dtype=numpy.complex128)
+  for j in range(len(thickness),-1,-1):
+    r=(kz[j]-kz[j+1])/(kz[j]+kz[j+1])*exp(-2.*roughness[j]**2*kz[j]*kz[j+1])
+    phase=exp(2j*kz[j+1]*z[j])
+    X=exp(-2j*kz[j]*z[j])*(r+X*phase)/(1.+r*X*phase)
+  return numpy.abs(X)**2
+
+def _spin_matrix(plus, minus, bx, by, bz):
+  '''
+    Combine values for the spin states parallel and antiparallel to the
+    magnetization direction (bx,by,bz) to 2x2 matrices.
+  '''
+  output=numpy.empty(numpy.broadcast(plus, bx).shape+(2, 2), dtype=numpy.complex128)
+  output[..., 0, 0]=0.5*((1.+bz)*plus+(1.-bz)*minus)
+  output[..., 1, 1]=0.5*((1.-bz)*plus+(1.+bz)*minus)
+  output[..., 0, 1]=0.5*(bx-1j*by)*(plus-minus)
+  output[..., 1, 0]=0.5*(bx+1j*by)*(plus-minus)
+  return output
+
+def _inverse(matrices):
+  '''
+    Inverse of an array of 2x2 matrices.
+  '''
+  determinant=matrices[..., 0, 0]*matrices[..., 1, 1]-matrices[..., 0, 1]*matrices[..., 1, 0]
+  output=numpy.empty_like(matrices)
+  output[..., 0, 0]=matrices[..., 1, 1]/determinant
+  output[..., 1, 1]=matrices[..., 0, 0]/determinant
+  output[..., 0, 1]=-matrices[..., 0, 1]/determinant
+  output[..., 1, 0]=-matrices[..., 1, 0]/determinant
+  return output
+
+def polarized_reflection(q, thickness, nb_real, nb_imag, np_magnetic, theta, phi, roughness):
+  '''
+    Calculate the 2x2 reflection matrices for polarized neutrons as in pnr_multi.
+
+    :param q: Array of scattering vector values in Å^{-1}
+    :param thickness: Thicknesses of the layers from top to bottom
+    :param nb_real: Real part of the nuclear scattering length density of the layers and the substrate
+    :param nb_imag: Imaginary part of the nuclear scattering length density
+    :param np_magnetic: Magnetic scattering length density
+    :param theta: Angle of the magnetization to the surface normal in rad
+    :param phi: In-plane angle of the magnetization in rad
+    :param roughness: Roughness of the top interface of each layer and the substrate
+
+    :return: Array of reflection matrices with shape (len(q), 2, 2)
+  '''
+  p0=q/2.
+  p0_complex=p0.astype(numpy.complex128)[numpy.newaxis, :]
+  nuclear=(4.*pi*(nb_real-1j*nb_imag))[:, numpy.newaxis]
+  magnetic=(4.*pi*numpy.asarray(np_magnetic))[:, numpy.newaxis]
+  # the vacuum has no magnetization direction, as in pnr_multi the roughness
+  # factors of the first interface are averaged for both spin states
+  p_plus=numpy.vstack([p0_complex, sqrt(p0**2-nuclear-magnetic+0j)])
+  p_minus=numpy.vstack([p0_complex, sqrt(p0**2-nuclear+magnetic+0j)])
+  bx=numpy.hstack([[0.], cos(phi)*sin(theta)])[:, numpy.newaxis]
+  by=numpy.hstack([[0.], sin(phi)*sin(theta)])[:, numpy.newaxis]
+  bz=numpy.hstack([[0.], cos(theta)])[:, numpy.newaxis]
+  p_matrix=_spin_matrix(p_plus, p_minus, bx, by, bz)
+  inverse_p=_spin_matrix(1./p_plus, 1./p_minus, bx, by, bz)
+  sigma2=(numpy.asarray(roughness)**2)[:, numpy.newaxis]
+  damping=_spin_matrix(exp(-2.*sigma2*p_plus[:-1]*p_plus[1:]),
+                       exp(-2.*sigma2*p_minus[:-1]*p_minus[1:]),
+                       bx[:-1], by[:-1], bz[:-1])
+  d=numpy.asarray(thickness)[:, numpy.newaxis]
+  phases=_spin_matrix(exp(1j*p_plus[1:-1]*d), exp(1j*p_minus[1:-1]*d),
+                      bx[1:-1], by[1:-1], bz[1:-1])
+  identity=numpy.identity(2)
+  X=numpy.zeros(q.shape+(2, 2), dtype=numpy.complex128)
+  for m in range(len(thickness),-1,-1):
+    transfer=numpy.matmul(inverse_p[m], p_matrix[m+1])
+    transfer_plus=identity+transfer
+    transfer_minus=numpy.matmul(identity-transfer, damping[m])
+    numerator=numpy.matmul(transfer_plus, X)+transfer_minus
+    denominator=numpy.matmul(transfer_minus, X)+transfer_plus
+    X=numpy.matmul(numerator, _inverse(denominator))
+    if m>0:
+      X=numpy.matmul(numpy.matmul(phases[m-1], X), phases[m-1])
+  return X
+
+def polarized_intensity(reflection, polarization_in, polarization_out):
+  '''
+    Reflected intensity for the incoming and analyzed polarization along
+    the field direction y.
+
+    :param reflection: Array of reflection matrices from polarized_reflection
+    :param polarization_in: Polarization of the incoming beam
+    :param polarization_out: Polarization selected by the analyzer
+
+    :return: Array of intensities
+  '''
+  rho_in=0.5*numpy.array([[1., -1j*polarization_in], [1j*polarization_in, 1.]])
+  rho_out=0.5*numpy.array([[1., -1j*polarization_out], [1j*polarization_out, 1.]])
+  reflection_h=numpy.conjugate(numpy.swapaxes(reflection,-1,-2))
+  result=numpy.matmul(rho_out, numpy.matmul(reflection, numpy.matmul(rho_in, reflection_h)))
+  return (result[..., 0, 0]+result[..., 1, 1]).real
+
+def illumination(theta, slits, sample_length, distances):
+  '''
+    Part of the beam hitting the sample, as in pnr_multi.
+
+    :param theta: Array of incident angles in rad
+    :param slits: First and second slit opening
+    :param sample_length: Length of the sample
+    :param distances: Distance of the first and second slit to the sample
+  '''
+  s1, s2=slits
+  d1, d2=distances
+  a=abs(s2/2.+d2/2./(d1-d2)*(s2-s1))
+  b=0.5*(s2+(s1+s2)/(d1-d2)*d2)
+  illumination_max=a+b
+  p=sample_length*sin(theta)
+  if a!=b:
+    partial=2.*(a+1./(8.*(a-b))*(p**2-4.*b*p-4.*a**2+8.*a*b))/illumination_max
+  else:
+    partial=numpy.ones_like(p)
+  return numpy.where(p<=2.*a, p/illumination_max, numpy.where(p<=2.*b, partial, 1.))
+
+def q_resolution(theta, wavelength, slits, sample_length, distances):
+  '''
+    Width of the q-resolution defined by the slits and the wavelength spread, as in pnr_multi.
+
+    :param theta: Array of incident angles in rad
+    :param wavelength: Wavelength and wavelength spread
+  '''
+  lambda_n, delta_lambda=wavelength
+  s1, s2=slits
+  d1, d2=distances
+  dtheta1=(s1+s2)/(d1-d2)/2.
+  dtheta2=(s1+sample_length*sin(theta))/d1/2.
+  dtheta=numpy.minimum(dtheta1, dtheta2)/2.35
+  return sqrt((4.*pi/lambda_n*cos(theta)*dtheta)**2+(4.*pi/lambda_n**2*sin(theta)*delta_lambda)**2)
+
+class ReflectivityFitFunction(FitFunction):
+  '''
+    Fit function with the parameters of a FitParameters object. The fit_params and
+    constrains set in the object define the refined parameters.
+  '''
+  fit_logarithmic=True
+  max_iter=50
+  parameters_per_layer=4
+
+  def __init__(self, fit_object):
+    parameters=fit_object.get_parameter_list()
+    self.parameters=parameters
+    self.parameter_names=['p%i'%(i+1) for i in range(len(parameters))]
+    FitFunction.__init__(self, parameters)
+    self.fit_object=fit_object
+    self.layers=(len(parameters)-self.parameters_per_layer-self.global_parameters+1)/self.parameters_per_layer
+    refine_parameters=[index-1 for index in fit_object.fit_params]
+    constrains={}
+    for constrain in fit_object.constrains:
+      # the fortran programs keep all parameters equal to the first one
+      first=min(constrain)
+      for index in constrain:
+        if index!=first:
+          constrains[index-1]={'tied': '[p%i]'%first}
+          if not index-1 in refine_parameters:
+            refine_parameters.append(index-1)
+    self.refine_parameters=sorted(refine_parameters)
+    if len(constrains)>0:
+      self.constrains=constrains
+
+  def get_fit_results(self, covariance):
+    '''
+      Return the refined parameters and errors as dictionaries with the .ent file indices
+      like read_fit_file. The errors are multiplied by the normalized χ as in the fortran programs.
+
+      :param covariance: Covariance matrix returned by refine
+    '''
+    result=self.last_fit_output
+    chi=sqrt(result.fnorm/max(result.dof, 1))
+    parameters={}
+    errors={}
+    for index in self.fit_object.fit_params:
+      parameters[index]=self.parameters[index-1]
+      errors[index]=sqrt(abs(covariance[index-1][index-1]))*chi
+    return parameters, errors
+
+class ReflectivityFunction(ReflectivityFitFunction):
+  '''
+    X-ray reflectivity as simulated by fit.f90 for a RefFitParameters object.
+  '''
+  name="X-Ray Reflectivity"
+  fit_function_text='Parratt'
+  global_parameters=3
+
+  def __init__(self, fit_object):
+    ReflectivityFitFunction.__init__(self, fit_object)
+    self.wavelength=12398.4/fit_object.radiation[0]
+    self.theta_max=fit_object.theta_max*pi/180.
+
+  def reflectivity(self, p, q):
+    '''
+      Reflectivity with the correction for angles below theta_max.
+    '''
+    layers=self.layers
+    layer_parameters=numpy.array(p[:4*layers], dtype=numpy.float64).reshape(layers, 4)
+    substrate=p[4*layers:4*layers+3]
+    delta=numpy.hstack([layer_parameters[:, 1], substrate[0]])*1e-6
+    beta=delta/numpy.abs(numpy.hstack([layer_parameters[:, 2], substrate[1]]))
+    roughness=numpy.abs(numpy.hstack([layer_parameters[:, 3], substrate[2]]))
+    y=parratt(q, self.wavelength, numpy.abs(layer_parameters[:, 0]), delta, beta, roughness)
+    alpha=arcsin(q*self.wavelength/(4.*pi))
+    return numpy.where(alpha<self.theta_max, y*alpha/self.theta_max, y)
+
+  def fit_function(self, p, x):
+    '''
+      Reflectivity convoluted with the resolution, scaled and with background.
+    '''
+    q=numpy.asarray(x, dtype=numpy.float64)
+    background, resolution, scaling=p[-3:]
+    sigma=abs(resolution)*1e-3
+    if sigma<1e-6:
+      y=self.reflectivity(p, q)
+    else:
+      y=gauss_convolution(lambda qi: self.reflectivity(p, qi), q, sigma)
+    return y*abs(scaling)*1e6+abs(background)
+
+class PolarizedReflectivityFunction(ReflectivityFitFunction):
+  '''
+    Polarized neutron reflectivity as simulated by pnr_multi for a TreffFitParameters object.
+    All four channels are fitted together with x=channel*CHANNEL_SPACING+Θ[mrad].
+  '''
+  name="Polarized Neutron Reflectivity"
+  fit_function_text='PNR'
+  parameters_per_layer=7
+  global_parameters=6
+
+  def __init__(self, fit_object):
+    ReflectivityFitFunction.__init__(self, fit_object)
+    self.wavelength=list(fit_object.wavelength)
+    self.slits=list(fit_object.slits)
+    self.sample_length=fit_object.sample_length
+    self.distances=list(fit_object.distances)
+
+  def reflection(self, p, q):
+    '''
+      Reflection matrices for the parameters p.
+    '''
+    layers=self.layers
+    layer_parameters=numpy.array(p[:7*layers], dtype=numpy.float64).reshape(layers, 7)
+    substrate=p[7*layers:7*layers+6]
+    nb_real=numpy.hstack([numpy.abs(layer_parameters[:, 1]), substrate[0]])*1e-6
+    nb_imag=numpy.hstack([layer_parameters[:, 2], abs(substrate[1])])*1e-6
+    np_magnetic=numpy.hstack([layer_parameters[:, 3], substrate[2]])*1e-6
+    theta=numpy.hstack([layer_parameters[:, 4], substrate[3]])*pi/180.
+    phi=numpy.hstack([layer_parameters[:, 5], substrate[4]])*pi/180.
+    roughness=numpy.abs(numpy.hstack([layer_parameters[:, 6], substrate[5]]))
+    q=numpy.where(q>0., q, 1e-10)
+    return polarized_reflection(q, numpy.abs(layer_parameters[:, 0]), nb_real, nb_imag,
+                                np_magnetic, theta, phi, roughness)
+
+  def simulate_channels(self, p, channel_angles):
+    '''
+      Calculate the intensities of the polarization channels.
+
+      :param p: Parameter list
+      :param channel_angles: List of Θ arrays in mrad for the channels ++, --, +-, -+
+
+      :return: List of intensities, q-values and q-resolutions for each channel
+    '''
+    cal=abs(p[7*self.layers+6])
+    background=abs(p[7*self.layers+7])*1e-6
+    polarizations=numpy.abs(p[7*self.layers+8:7*self.layers+12])
+    channel_angles=[numpy.asarray(angles, dtype=numpy.float64)/1000. for angles in channel_angles]
+    channel_q=[4.*pi/self.wavelength[0]*sin(angles) for angles in channel_angles]
+    channel_sigma=[q_resolution(angles, self.wavelength, self.slits, self.sample_length, self.distances)
+                   for angles in channel_angles]
+    # the reflection matrices are independent of the polarization,
+    # so they are calculated only once for all channels
+    all_q=numpy.hstack(channel_q)
+    all_sigma=numpy.hstack(channel_sigma)
+    steps=numpy.linspace(-4., 4., RESOLUTION_POINTS)
+    q_points=all_q[:, numpy.newaxis]+all_sigma[:, numpy.newaxis]*steps[numpy.newaxis, :]
+    reflection=self.reflection(p, q_points.flatten()).reshape(q_points.shape+(2, 2))
+    output=[]
+    start=0
+    for i, angles in enumerate(channel_angles):
+      end=start+len(angles)
+      polarization_in, polarization_out=CHANNEL_POLARIZATIONS[i](*polarizations)
+      # points with q<=0 are excluded from the convolution
+      intensity=numpy.where(q_points[start:end]>0.,
+                            polarized_intensity(reflection[start:end], polarization_in, polarization_out), 0.)
+      intensity=gauss_convolution(lambda ignore: intensity.flatten(), channel_q[i], channel_sigma[i])
+      output.append((illumination(angles, self.slits, self.sample_length, self.distances)*intensity*cal+background,
+                     channel_q[i], channel_sigma[i]))
+      start=end
+    return output
+
+  def fit_function(self, p, x):
+    '''
+      Intensities of all channels with x=channel*CHANNEL_SPACING+Θ[mrad].
+    '''
+    x=numpy.asarray(x, dtype=numpy.float64)
+    channels=(x//CHANNEL_SPACING).astype(int)
+    channel_angles=[x[channels==i]-i*CHANNEL_SPACING for i in range(4)]
+    output=numpy.zeros_like(x)
+    for i, result in enumerate(self.simulate_channels(p, channel_angles)):
+      output[channels==i]=result[0]
+    return output
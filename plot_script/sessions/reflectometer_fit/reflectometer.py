@@ -107,6 +107,14 @@ class RefFitParameters(FitParameters):
     return ent_string
 
 
+  def get_parameter_list(self, use_roughness_gradient=True):
+    '''
+      Return all parameters as list, the parameter with index i in the .ent file is item i-1.
+    '''
+    parameters=self.__get_parameter_list_layers__(use_roughness_gradient)
+    parameters+=[self.background, self.resolution, self.scaling_factor]
+    return parameters
+
   def set_fit_parameters(self, layer_params={}, substrate_params=[], background=False, resolution=False, scaling=False):
     '''
       set fit parameters depending on (multi)layers
@@ -359,6 +367,12 @@ class RefLayerParam(LayerParam):
     else:
       LayerParam.set_param(self, index, 3, value)
 
+  def get_parameter_list(self, add_roughness=0.):
+    '''
+      Return the layer parameters in the order of the .ent file.
+    '''
+    return [self.thickness, self.delta, self.d_over_b, self.roughness+add_roughness]
+
   def get_ent_text(self, layer_index, para_index, add_roughness=0., use_roughness_gradient=True):
     '''
       Function to get the text lines for the .ent file.
@@ -209,6 +209,15 @@ class TreffFitParameters(FitParameters):
     ent_string+='### End of layers.\n'
     return ent_string, layer_index, para_index
 
+  def get_parameter_list(self, use_roughness_gradient=True):
+    '''
+      Return all parameters as list, the parameter with index i in the .ent file is item i-1.
+      Multilayers are expanded as if the file is created with use_multilayer=False.
+    '''
+    parameters=self.__get_parameter_list_layers__(use_roughness_gradient)
+    parameters+=[self.scaling_factor, self.background]+list(self.polarization_parameters)
+    return parameters
+
   def set_fit_parameters(self, layer_params={}, substrate_params=[], background=False,
                          polarizer_efficiancy=False, analyzer_efficiancy=False,
                          flipper0_efficiancy=False, flipper1_efficiancy=False,
@@ -646,6 +655,13 @@ class TreffLayerParam(LayerParam):
     else:
       LayerParam.set_param(self, index, 6, value)
 
+  def get_parameter_list(self, add_roughness=0.):
+    '''
+      Return the layer parameters in the order of the .ent file.
+    '''
+    return [self.thickness, self.scatter_density_Nb, self.scatter_density_Nb2,
+            self.scatter_density_Np, self.theta, self.phi, self.roughness+add_roughness]
+
   def get_ent_text(self, layer_index, para_index, add_roughness=0., use_roughness_gradient=True):
     '''
       Function to get the text lines for the .ent file.
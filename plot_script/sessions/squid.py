@@ -65,6 +65,7 @@ Data columns and unit transformations are defined in config.squid.py.
   dia_mag_offset=0. # user offset of diamagnetic correction factor
   para=[0, 0] # paramagnetic correction factor and T-offset
   COMMANDLINE_OPTIONS=GenericSession.COMMANDLINE_OPTIONS+['dia', 'dia-calc', 'para']
+  IMPORT_OPTIONS=['COLUMNS_MAPPING', 'MEASUREMENT_TYPES'] # attributes which change the data read from a file
   #------------------ local variables -----------------
 
 
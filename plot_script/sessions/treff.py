@@ -13,6 +13,7 @@ from copy import deepcopy
 from generic import GenericSession
 # import parameter class for fits
 from reflectometer_fit.parameters import FitParameters, LayerParam, MultilayerParam
+from reflectometer_fit.parratt import PolarizedReflectivityFunction, CHANNEL_SPACING
 from plot_script.measurement_data_structure import MeasurementData, PhysicalProperty
 # importing data readout
 from plot_script.read_data import treff as read_data
@@ -54,53 +55,71 @@ class FitList(list):
     self.fit_object_future=[]
     self.fit_datasets=[None, None, None, None] # a list of datasets used for fit [++,--,+-,-+]
 
-def calc_intensities_general(S, P):
+def stack_matrices(elements):
   '''
-    A general formalism to calculate measured intensities from simulated scattering and
-    the polarization parameters. The matrices used can be found in:
+    Create an array of 4x4 matrices from a 4x4 nested list of scalars or arrays.
+    
+    :return: Array of shape (N, 4, 4)
+  '''
+  elements=numpy.broadcast_arrays(*[numpy.atleast_1d(numpy.asarray(element, dtype=numpy.float64))
+                                    for row in elements for element in row])
+  return numpy.array(elements).reshape(16,-1).transpose().reshape(-1, 4, 4)
+
+def wildes_matrix(P):
+  '''
+    Efficiency matrix of the polarization components for the channels '++','+-','-+','--'
+    as used in:
     
         A.R.Wildes, Review of Scientivic Instruments, Vol. 70, 11 (1999)
     
-    :param S: Dictionary of intensities for the Scattering channels '++','--','+-','-+'
-    :param P: Dictionary of the instrumental parameters 'F1','F2','p1','p2'
+    :param P: Dictionary of the instrumental parameters 'F1','F2','p1','p2' (scalars or arrays)
     
-    :return: Dictionary of the calculated intensities
+    :return: Array of 4x4 matrices, one for each item of the parameter arrays
   '''
-  F1=P['F1']
-  F2=P['F2']
-  p1=P['p1']
-  p2=P['p2']
-  # create a column vector for Σ
-  Sigma=numpy.array([S['++'], S['+-'], S['-+'], S['--']])
-  # Define the transformation matrices
-  o=numpy.zeros_like(F1)
-  i=numpy.zeros_like(F1)+1.
-  M1=numpy.array([
+  F1=numpy.asarray(P['F1'], dtype=numpy.float64)
+  F2=numpy.asarray(P['F2'], dtype=numpy.float64)
+  p1=numpy.asarray(P['p1'], dtype=numpy.float64)
+  p2=numpy.asarray(P['p2'], dtype=numpy.float64)
+  o=0.
+  i=1.
+  M1=stack_matrices([
                      [      i, o, o, o     ],
                      [      o, i, o, o     ],
                      [     F1, o, (i-F1), o     ],
                      [      o, F1, o, (i-F1), ],
                      ])
-  M2=numpy.array([
+  M2=stack_matrices([
                      [      i, o, o, o     ],
                      [     F2, (i-F2), o, o     ],
                      [      o, o, i, o     ],
                      [      o, o, F2, (i-F2), ],
                      ])
-  M3=numpy.array([
+  M3=stack_matrices([
                      [   (i-p1), o, p1, o     ],
                      [      o, (i-p1), o, p1     ],
                      [     p1, o, (i-p1), o     ],
                      [      o, p1, o, (i-p1)  ],
                      ])
-  M4=numpy.array([
+  M4=stack_matrices([
                      [   (i-p2), p2, o, o     ],
                      [     p2, (i-p2), o, o     ],
                      [      o, o, (i-p2), p2     ],
                      [      o, o, p2, (i-p2)  ],
                      ])
-  Mall=dot_matrix(dot_matrix(M1, M2), dot_matrix(M3, M4))
-  Intensity=dot_vector(Mall, Sigma)
+  return numpy.matmul(numpy.matmul(M1, M2), numpy.matmul(M3, M4))
+
+def calc_intensities_general(S, P):
+  '''
+    A general formalism to calculate measured intensities from simulated scattering and
+    the polarization parameters, see wildes_matrix.
+    
+    :param S: Dictionary of intensities for the Scattering channels '++','--','+-','-+'
+    :param P: Dictionary of the instrumental parameters 'F1','F2','p1','p2'
+    
+    :return: Dictionary of the calculated intensities
+  '''
+  Sigma=numpy.array([S['++'], S['+-'], S['-+'], S['--']], dtype=numpy.float64).transpose()
+  Intensity=numpy.matmul(wildes_matrix(P), Sigma[..., numpy.newaxis])[..., 0].transpose()
   return {
           '++': Intensity[0],
           '+-': Intensity[1],
@@ -108,61 +127,94 @@ def calc_intensities_general(S, P):
           '--': Intensity[3],
           }
 
-def dot_matrix(M1, M2):
+def solve_polarization(M, intensities, errors=None):
   '''
-    Calculate the matrix product of a 4x4 matrix of arrays.
+    Invert the efficiency matrices for all points at once.
+    Points where the matrix is singular are set to nan.
+    
+    :param M: Array of 4x4 matrices, with one item or one for each point
+    :param intensities: Array of measured intensities with shape (N, 4)
+    :param errors: Array of errors of the intensities with shape (N, 4) or None
+    
+    :return: Corrected intensities and their errors (or None)
   '''
-  # create empty output matrix
-  Mout=[[None for i in range(4)] for j in range(4)]
-  for i in range(4):
-    for j in range(4):
-      Mout[i][j]=(M1[i]*M2.transpose(1, 0, 2)[j]).sum(axis=0)
-  return numpy.array(Mout)
-
-def dot_vector(M, v):
+  M=numpy.array(M, dtype=numpy.float64)
+  singular=numpy.abs(numpy.linalg.det(M))<1e-12
+  M[singular]=numpy.identity(4)
+  M_inverse=numpy.linalg.inv(M)
+  result=numpy.matmul(M_inverse, intensities[..., numpy.newaxis])[..., 0]
+  if errors is not None:
+    # Gaussian error propagation of the linear transformation
+    errors=numpy.sqrt(numpy.matmul(M_inverse**2, (errors**2)[..., numpy.newaxis])[..., 0])
+  if singular.any():
+    if len(singular)==1:
+      singular=numpy.ones(len(result), dtype=bool)
+    result[singular]=numpy.nan
+    if errors is not None:
+      errors[singular]=numpy.nan
+  return result, errors
+
+def separate_scattering_d17(datasets, P):
   '''
-    Calculate the 4x4 matix·vector product of a matrix of arrays.
+    Calculate the scattering channels from the measured intensities by inverting
+    the efficiency matrices of wildes_matrix for every point.
+    
+    :param datasets: A list of MeasurementData objects for ++, --, +- and -+ channel
+    :param P: Dictionary of the instrumental parameters 'F1','F2','p1','p2'
+    
+    :return: FitList of new MeasurementData objects with the corrected intensities
   '''
-  vout=[None for i in range(4)]
-  for i in range(4):
-    vout[i]=(M[i]*v).sum(axis=0)
-  return vout
-
-def separate_scattering_d17(datasets, P, break_condition=1e-3):
-  I={
-    '++': deepcopy(datasets[0].z),
-    '--': deepcopy(datasets[1].z),
-    '+-': deepcopy(datasets[2].z),
-    '-+': deepcopy(datasets[3].z),
-    }
-  normalization_factor=sum(I.values())
-  normalization_factor[numpy.where(normalization_factor==0.)]=1.
-  for value in I.values():
-    value/=normalization_factor
-  S=deepcopy(I)
-  _converged=False
-  for ignore in range(100):
-    I_neu=calc_intensities_general(S, P)
-    I_div={}
-    sum_of_divs=0.
-    for key in I.keys():
-      I_div[key]=I[key]-I_neu[key]
-      S[key]+=I_div[key]
-      sum_of_divs+=numpy.abs(I_div[key]).sum()
-    if (sum_of_divs<break_condition):
-      _converged=True
-      break
-  for value in S.values():
-    value*=normalization_factor
-  output_data=FitList(deepcopy(datasets))
-  output_data[0].z=S['++']
-  output_data[1].z=S['--']
-  output_data[2].z=S['+-']
-  output_data[3].z=S['-+']
+  # channel order of the Wildes matrix
+  order=[0, 2, 3, 1]
+  intensities=numpy.array([datasets[i].z.view(numpy.ndarray) for i in order],
+                          dtype=numpy.float64).transpose()
+  if all([datasets[i].z.error is not None for i in order]):
+    errors=numpy.array([datasets[i].z.error for i in order], dtype=numpy.float64).transpose()
+  else:
+    errors=None
+  S, S_errors=solve_polarization(wildes_matrix(P), intensities, errors)
+  output_data=FitList(deepcopy(datasets[:4]))
+  for j, i in enumerate(order):
+    z=datasets[i].z
+    if S_errors is None:
+      output_data[i].z=PhysicalProperty(z.dimension, z.unit, S[:, j])
+    else:
+      output_data[i].z=PhysicalProperty(z.dimension, z.unit, S[:, j], S_errors[:, j])
   for data in output_data:
     data.short_info='S('+data.short_info+')'
   return output_data
 
+def polarization_matrix(P):
+  '''
+    Matrix of the polarization component efficiencies to calculate intensities
+    of the channels ++, --, +-, -+ from the reflectivities in the same order.
+    Contributions of third and higher order in the inefficiencies are neglected.
+    
+    :param P: Dictionary of polarizer,flipper1,flipper2,analyzer polarization component efficiencies (scalars)
+  '''
+  p=P['polarizer']
+  f1=P['flipper1']
+  f2=P['flipper2']
+  a=P['analyzer']
+  return numpy.array([
+        [p*f1*a+(1.-p)*(1.-f1)*a,
+         (1.-p)*f1*(1.-a)+p*(1.-f1)*(1.-a),
+         p*f1*(1.-a)+(1.-p)*(1.-f1)*(1.-a),
+         (1.-p)*f1*a+p*(1.-f1)*a],
+        [(1.-p)*f2*(1.-a)+(1.-p)*(1.-f2)*a,
+         p*f2*a+p*(1.-f2)*(1.-a),
+         (1.-p)*f2*a+(1.-p)*(1.-f2)*(1.-a),
+         p*f2*(1.-a)+p*(1.-f2)*a],
+        [p*f1*f2*(1.-a)+p*f1*(1.-f2)*a,
+         (1.-p)*f1*f2*a+p*(1.-f1)*f2*a,
+         p*f1*f2*a+(1.-p)*(1.-f1)*f2*a,
+         (1.-p)*f1*f2*(1.-a)+p*(1.-f1)*f2*(1.-a)+(1.-p)*f1*(1.-f2)*a+p*(1.-f1)*(1.-f2)*a],
+        [(1.-p)*a,
+         p*(1.-a),
+         (1.-p)*(1.-a),
+         p*a],
+        ], dtype=numpy.float64)
+
 def calc_intensities(R, P):
   '''
     Calculate intensities from given reflectivity channels R and given polarizations P.
@@ -170,46 +222,11 @@ def calc_intensities(R, P):
     :param R: Dictionary of ++, --, +-, -+ reflectivities (arrays)
     :param P: Dictionary of polarizer,flipper1,flipper2,analyzer polarization component efficiencies (scalars)
   '''
-  I={}
-  # calculate up-up intensity
-  I['++']=R['++']*(P['polarizer']*P['flipper1']*P['analyzer']+\
-                    (1.-P['polarizer'])*(1.-P['flipper1'])*P['analyzer'])+\
-          R['--']*((1.-P['polarizer'])*P['flipper1']*(1.-P['analyzer'])+\
-                    P['polarizer']*(1.-P['flipper1'])*(1.-P['analyzer']))+\
-          R['+-']*(P['polarizer']*P['flipper1']*(1.-P['analyzer'])+\
-                    (1.-P['polarizer'])*(1.-P['flipper1'])*(1.-P['analyzer']))+\
-          R['-+']*((1.-P['polarizer'])*P['flipper1']*P['analyzer']+\
-                    P['polarizer']*(1.-P['flipper1'])*P['analyzer'])
-  # calculate down-down intensity
-  I['--']=R['--']*(P['polarizer']*P['flipper2']*P['analyzer']+\
-                    P['polarizer']*(1.-P['flipper2'])*(1.-P['analyzer']))+\
-          R['++']*((1.-P['polarizer'])*P['flipper2']*(1.-P['analyzer'])+\
-                    (1.-P['polarizer'])*(1.-P['flipper2'])*P['analyzer'])+\
-          R['-+']*(P['polarizer']*P['flipper2']*(1.-P['analyzer'])+\
-                    P['polarizer']*(1.-P['flipper2'])*P['analyzer'])+\
-          R['+-']*((1.-P['polarizer'])*P['flipper2']*P['analyzer']+\
-                    (1.-P['polarizer'])*(1.-P['flipper2'])*(1.-P['analyzer']))
-  # calculate up-down intensity
-  I['+-']=R['+-']*(P['polarizer']*P['flipper1']*P['flipper2']*P['analyzer']+\
-                    (1.-P['polarizer'])*(1.-P['flipper1'])*P['flipper2']*P['analyzer'])+\
-          R['-+']*((1.-P['polarizer'])*P['flipper1']*P['flipper2']*(1.-P['analyzer'])+\
-                    P['polarizer']*(1.-P['flipper1'])*P['flipper2']*(1.-P['analyzer'])+\
-                    (1.-P['polarizer'])*P['flipper1']*(1.-P['flipper2'])*P['analyzer']+\
-                    P['polarizer']*(1.-P['flipper1'])*(1.-P['flipper2'])*P['analyzer'])+\
-          R['++']*(P['polarizer']*P['flipper1']*P['flipper2']*(1.-P['analyzer'])+\
-                    P['polarizer']*P['flipper1']*(1.-P['flipper2'])*P['analyzer'])+\
-          R['--']*((1.-P['polarizer'])*P['flipper1']*P['flipper2']*P['analyzer']+\
-                    P['polarizer']*(1.-P['flipper1'])*P['flipper2']*P['analyzer']) # + O((1-p)^3) + (1-P)^4
-  # calculate down-up intensity
-  I['-+']=R['-+']*(P['polarizer']*P['analyzer'])+\
-          R['+-']*((1.-P['polarizer'])*(1.-P['analyzer']))+\
-          R['--']*(P['polarizer']*(1.-P['analyzer']))+\
-          R['++']*((1.-P['polarizer'])*P['analyzer'])
+  keys=['++', '--', '+-', '-+']
+  intensities=numpy.dot(polarization_matrix(P), numpy.array([R[key] for key in keys]))
   # normalize intensities for output
-  scale_by=1./sum(I.values())
-  for key in I.keys():
-    I[key]*=scale_by
-  return I
+  intensities/=intensities.sum(axis=0)
+  return dict(zip(keys, intensities))
 
 def seperate_scattering(datasets, P):
   '''
@@ -218,42 +235,18 @@ def seperate_scattering(datasets, P):
     :param datasets: A list of MeasurementData objects for ++, --, +- and -+ channel
     :param P: Dictionary of polarizer,flipper1,flipper2,analyzer polarization component efficiencies
   '''
-  maximum_iterations=100
-  stop_iteration_at=1e-10
-  I={}
   min_length=min(map(len, datasets[:4]))
   if datasets[0].zdata<0:
-    I['++']=numpy.array(datasets[0].data[datasets[0].ydata].values[:min_length])
-    I['--']=numpy.array(datasets[1].data[datasets[0].ydata].values[:min_length])
-    I['+-']=numpy.array(datasets[2].data[datasets[0].ydata].values[:min_length])
-    I['-+']=numpy.array(datasets[3].data[datasets[0].ydata].values[:min_length])
+    intensities=[numpy.array(dataset.data[datasets[0].ydata].view(numpy.ndarray)[:min_length])
+                 for dataset in datasets[:4]]
   else:
-    I['++']=numpy.maximum(numpy.array(datasets[0].data[datasets[0].zdata].values[:min_length]), 1e-8)
-    I['--']=numpy.maximum(numpy.array(datasets[1].data[datasets[0].zdata].values[:min_length]), 1e-8)
-    I['+-']=numpy.maximum(numpy.array(datasets[2].data[datasets[0].zdata].values[:min_length]), 1e-8)
-    I['-+']=numpy.maximum(numpy.array(datasets[3].data[datasets[0].zdata].values[:min_length]), 1e-8)
-  normalization_factor=sum(I.values())
-  for key in I.keys():
-    I[key]/=normalization_factor
-  R=deepcopy(I)
-
-  for i in range(maximum_iterations):
-    I_neu=calc_intensities(R, P)
-    I_div={}
-    sum_of_divs=0.
-    for key in I.keys():
-      I_div[key]=I[key]-I_neu[key]
-      R[key]+=I_div[key]
-      sum_of_divs+=numpy.abs(I_div[key]).sum()
-      print "Iteration %i: Sum of I_div=%.8f"%(i+1, sum_of_divs)
-      if (sum_of_divs<stop_iteration_at):
-        break
-  output=[]
-  output.append(R['++']*normalization_factor)
-  output.append(R['--']*normalization_factor)
-  output.append(R['+-']*normalization_factor)
-  output.append(R['-+']*normalization_factor)
-  return output
+    intensities=[numpy.maximum(numpy.array(dataset.data[datasets[0].zdata].view(numpy.ndarray)[:min_length]), 1e-8)
+                 for dataset in datasets[:4]]
+  intensities=numpy.array(intensities, dtype=numpy.float64).transpose()
+  R, ignore=solve_polarization(polarization_matrix(P)[numpy.newaxis], intensities)
+  # the reflectivities keep the total measured intensity
+  R*=(intensities.sum(axis=1)/R.sum(axis=1))[:, numpy.newaxis]
+  return [R[:, 0], R[:, 1], R[:, 2], R[:, 3]]
 
 class TreffSession(GUI, ReflectometerFitGUI, GenericSession):
   '''
@@ -292,6 +285,7 @@ class TreffSession(GUI, ReflectometerFitGUI, GenericSession):
                   ]
   import_images=True
   import_detector_images=False
+  IMPORT_OPTIONS=['maria', 'import_images'] # attributes which change the data read from a file
   x_from=5 # fit only x regions between x_from and x_to
   x_to=''
   max_iter=50 # maximal iterations in fit
@@ -562,6 +556,68 @@ class TreffSession(GUI, ReflectometerFitGUI, GenericSession):
     ent_file.close()
 
 
+  def native_fit(self, max_iter):
+    '''
+      Fit the polarization channels with the reflectivity calculated in python, which gives
+      the same result as the pnr_multi program without compiling and starting it.
+      The refined parameters are those selected in the fit object.
+      
+      :param max_iter: Maximum number of iterations, 0 for only a simulation
+      
+      :return: List of simulations as MeasurementData or None for each channel and
+               the parameters and errors as dictionaries like in read_fit_file
+    '''
+    fit_object=self.active_file_data.fit_object
+    fit_object.set_fit_constrains()
+    function=PolarizedReflectivityFunction(fit_object)
+    x_from=self.x_from
+    x_to=self.x_to or None
+    x=[]
+    y=[]
+    theta_max=[]
+    for i, dataset in enumerate(self.active_file_data.fit_datasets):
+      if dataset:
+        dataset.unit_trans([['°', math.pi/180.*1000., 0, 'mrad'],
+                            ['rad', 1000., 0, 'mrad']])
+        dataset.unit_trans([['2Θ', 'mrad', 0.5, 0, 'Θ', 'mrad']])
+        data=dataset.get_filtered_data_matrix()
+        theta=data[dataset.xdata]
+        window=(theta>=(x_from or theta.min()))&(theta<=(x_to or theta.max()))
+        x.append(theta[window]+i*CHANNEL_SPACING)
+        y.append(data[dataset.ydata][window])
+        theta_max.append(theta[window].max())
+      elif not fit_object.simulate_all_channels and not i==0:
+        theta_max.append(None)
+      else:
+        theta_max.append(150.)
+    if max_iter>0 and len(x)>0 and len(function.refine_parameters)>0:
+      function.max_iter=max_iter
+      ignore, covariance=function.refine(numpy.hstack(x), numpy.hstack(y))
+      parameters, errors=function.get_fit_results(covariance)
+    else:
+      parameters={}
+      errors={}
+      for index in fit_object.fit_params:
+        parameters[index]=function.parameters[index-1]
+        errors[index]=0.
+    # simulate 500 points for each channel as pnr_multi
+    channel_angles=[]
+    for channel_max in theta_max:
+      if channel_max is None:
+        channel_angles.append(numpy.array([]))
+      else:
+        channel_angles.append(numpy.linspace(0., channel_max, 501)[1:])
+    simulations=[]
+    for i, result in enumerate(function.simulate_channels(function.parameters, channel_angles)):
+      if theta_max[i] is None:
+        simulations.append(None)
+        continue
+      simu=MeasurementData([['Θ', 'mrad'], ['Intensity', 'a.u.'], ['Unknown', 'counts/s'], ['Unknown2', 'counts/s']], [], 0, 1, 2)
+      simu.info='Simulation'
+      simu.extend(numpy.array([channel_angles[i], result[0], result[1], result[2]]).transpose())
+      simulations.append(simu)
+    return simulations, parameters, errors
+
   def call_fit_program(self, file_ent, force_compile=False):
     '''
       This function calls the fit_pnr program and if it is not compiled with 
@@ -892,6 +948,15 @@ class TreffFitParameters(FitParameters):
     ent_string+='### End of layers.\n'
     return ent_string, layer_index, para_index
 
+  def get_parameter_list(self, use_roughness_gradient=True):
+    '''
+      Return all parameters as list, the parameter with index i in the .ent file is item i-1.
+      Multilayers are expanded as if the file is created with use_multilayer=False.
+    '''
+    parameters=self.__get_parameter_list_layers__(use_roughness_gradient)
+    parameters+=[self.scaling_factor, self.background]+list(self.polarization_parameters)
+    return parameters
+
   def set_fit_parameters(self, layer_params={}, substrate_params=[], background=False,
                          polarizer_efficiancy=False, analyzer_efficiancy=False,
                          flipper0_efficiancy=False, flipper1_efficiancy=False,
@@ -1329,6 +1394,13 @@ class TreffLayerParam(LayerParam):
     else:
       LayerParam.set_param(self, index, 6, value)
 
+  def get_parameter_list(self, add_roughness=0.):
+    '''
+      Return the layer parameters in the order of the .ent file.
+    '''
+    return [self.thickness, self.scatter_density_Nb, self.scatter_density_Nb2,
+            self.scatter_density_Np, self.theta, self.phi, self.roughness+add_roughness]
+
   def get_ent_text(self, layer_index, para_index, add_roughness=0., use_roughness_gradient=True):
     '''
       Function to get the text lines for the .ent file.
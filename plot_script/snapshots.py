@@ -0,0 +1,200 @@
+# -*- encoding: utf-8 -*-
+'''
+ Reading and writing of snapshot (.mdd) files.
+
+ Snapshots are stored in a columnar container format, the data columns are
+ written as contiguous, aligned blocks followed by an index header containing
+ the pickled snapshot object with references to these blocks.
+ When reading, the file is memory mapped and the columns are only copied into
+ memory when they are accessed (see SpillManager.add_stored).
+
+ ======================    =================================================
+ File Layout               Description
+ ======================    =================================================
+ magic                     'PLOTPYSNAP' (10 bytes)
+ ----------------------    -------------------------------------------------
+ preamble                  format version (uint16), index offset and index
+                           length (uint64 each), little endian
+ ----------------------    -------------------------------------------------
+ blocks                    column values and errors, aligned to 64 bytes
+ ----------------------    -------------------------------------------------
+ index                     pickled snapshot object, BufferList objects are
+                           replaced by lists of block references
+ ======================    =================================================
+
+ Old snapshots (plain or gzip compressed pickles) are still readable.
+'''
+
+import os
+import struct
+from cPickle import Pickler, Unpickler, load, dumps
+from cStringIO import StringIO
+import numpy
+from measurement_data_structure import BufferList
+
+__author__="Artur Glavic"
+__credits__=[]
+from plotpy_info import __copyright__, __license__, __version__, __maintainer__, __email__ #@UnusedImport
+__status__="Development"
+
+MAGIC='PLOTPYSNAP'
+FORMAT_VERSION=1
+PREAMBLE=struct.Struct('<HQQ')
+ALIGNMENT=64
+
+class SnapshotWriter(object):
+  '''
+    Write a snapshot object to a columnar snapshot file.
+  '''
+
+  def __init__(self, file_name):
+    self.file_name=file_name
+
+  def _write_block(self, array):
+    '''
+      Write an array as aligned block and return it's reference.
+    '''
+    array=numpy.ascontiguousarray(array.view(numpy.ndarray))
+    offset=self._file.tell()
+    padding=(-offset)%ALIGNMENT
+    self._file.write('\0'*padding)
+    offset+=padding
+    array.tofile(self._file)
+    return (offset, array.dtype.str, array.shape)
+
+  def _persistent_id(self, obj):
+    '''
+      Replace BufferList objects by a list of column block references.
+    '''
+    if type(obj) is not BufferList:
+      return None
+    columns=[]
+    for item in obj:
+      state=getattr(item, '__dict__', None)
+      error=None
+      if state is not None:
+        state=dict(state)
+        error=state.pop('_error', None)
+      if error is not None:
+        error=self._write_block(error)
+      columns.append((item.__class__, state, self._write_block(item), error))
+    return ('BufferList', columns)
+
+  def write(self, dump_obj):
+    '''
+      Store the snapshot object in the file. The data is written to a
+      temporary file first, as the old file could still be memory mapped
+      or read by another process.
+    '''
+    tmp_name='%s.%i.tmp'%(self.file_name, os.getpid())
+    self._file=open(tmp_name, 'wb')
+    try:
+      self._file.write(MAGIC)
+      self._file.write(PREAMBLE.pack(FORMAT_VERSION, 0, 0))
+      index=StringIO()
+      pickler=Pickler(index, 2)
+      pickler.persistent_id=self._persistent_id
+      pickler.dump(dump_obj)
+      index=index.getvalue()
+      index_offset=self._file.tell()
+      self._file.write(index)
+      self._file.seek(len(MAGIC))
+      self._file.write(PREAMBLE.pack(FORMAT_VERSION, index_offset, len(index)))
+    finally:
+      self._file.close()
+      self._file=None
+    if os.name=='nt' and os.path.exists(self.file_name):
+      os.remove(self.file_name)
+    os.rename(tmp_name, self.file_name)
+
+class SnapshotReader(object):
+  '''
+    Read a snapshot object from a columnar snapshot file.
+    The columns reference the memory mapped file, so only the index
+    is read from disk directly.
+  '''
+
+  def __init__(self, file_name):
+    self.file_name=file_name
+
+  def _get_block(self, block):
+    offset, dtype, shape=block
+    dtype=numpy.dtype(dtype)
+    length=dtype.itemsize*int(numpy.prod(shape))
+    return self._map[offset:offset+length].view(dtype).reshape(shape)
+
+  def _persistent_load(self, pid):
+    '''
+      Create a BufferList with columns not yet loaded into memory.
+    '''
+    if pid[0]!='BufferList':
+      raise IOError, "unknown reference '%s' in snapshot"%pid[0]
+    output=BufferList([])
+    for item_class, state, data, error in pid[1]:
+      if error is not None:
+        error=self._get_block(error)
+      output.append_stored(item_class, state, self._get_block(data), error)
+    return output
+
+  def read(self):
+    '''
+      Return the snapshot object stored in the file.
+    '''
+    snapshot_file=open(self.file_name, 'rb')
+    try:
+      if snapshot_file.read(len(MAGIC))!=MAGIC:
+        raise IOError, "'%s' is not a columnar snapshot file"%self.file_name
+      version, index_offset, index_length=PREAMBLE.unpack(
+                                          snapshot_file.read(PREAMBLE.size))
+      if version>FORMAT_VERSION:
+        raise IOError, "snapshot format version %i is not supported (<=%i)"%(
+                                                      version, FORMAT_VERSION)
+      snapshot_file.seek(index_offset)
+      index=snapshot_file.read(index_length)
+    finally:
+      snapshot_file.close()
+    # the map stays open as long as any column references it
+    self._map=numpy.memmap(self.file_name, dtype=numpy.uint8, mode='r')
+    unpickler=Unpickler(StringIO(index))
+    unpickler.persistent_load=self._persistent_load
+    return unpickler.load()
+
+def is_columnar_snapshot(file_name):
+  '''
+    Check if a file is stored in the columnar snapshot format.
+  '''
+  if file_name.endswith('.gz'):
+    return False
+  snapshot_file=open(file_name, 'rb')
+  magic=snapshot_file.read(len(MAGIC))
+  snapshot_file.close()
+  return magic==MAGIC
+
+def write_snapshot(dump_obj, file_name):
+  '''
+    Write a snapshot object to a file. Names ending with .gz are written as
+    compressed pickle as the columnar format can only be memory mapped
+    without compression.
+  '''
+  if file_name.endswith('.gz'):
+    import gzip
+    dump_file=gzip.open(file_name, 'wb')
+    dump_file.write(dumps(dump_obj,-1))
+    dump_file.close()
+  else:
+    SnapshotWriter(file_name).write(dump_obj)
+
+def read_snapshot(file_name):
+  '''
+    Read a snapshot object from a columnar or pickled snapshot file.
+  '''
+  if is_columnar_snapshot(file_name):
+    return SnapshotReader(file_name).read()
+  if file_name.endswith('.gz'):
+    import gzip
+    dump_file=gzip.open(file_name, 'rb')
+  else:
+    dump_file=open(file_name, 'rb')
+  dump_obj=load(dump_file)
+  dump_file.close()
+  return dump_obj
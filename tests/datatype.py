@@ -3,9 +3,11 @@
   Testing the datatype framewok.
 '''
 
-from plot_script.measurement_data_structure import PhysicalProperty
-from numpy import array, ndarray, arange, float32, sqrt, zeros_like, ones_like, pi, sin
+from plot_script.measurement_data_structure import PhysicalProperty, MeasurementData, BufferList, SpillManager
+from numpy import array, ndarray, arange, float32, float64, sqrt, zeros_like, ones_like, pi, sin
 import unittest
+import os
+from tempfile import mkstemp
 
 class TestPhysicalProperty(unittest.TestCase):
   '''
@@ -78,6 +80,784 @@ class TestPhysicalProperty(unittest.TestCase):
     self.assertEqual(degsin.tolist(), radsin.tolist(),
                      "Unit auto conversion in sin(x)")
 
+class TestBufferList(unittest.TestCase):
+  '''
+    Check the spilling of arrays to disk.
+  '''
+
+  def setUp(self):
+    self.manager=SpillManager(limit=1000)
+    self.values=arange(200., dtype=float32)
+    self.data=BufferList([PhysicalProperty('x', 'm', self.values, 2.*self.values),
+                          PhysicalProperty('y', 's', self.values)], self.manager)
+
+  def test_spill(self):
+    # only the last added item stays in memory
+    stats=self.manager.statistics()
+    self.assertEqual(stats['items_resident'], 1, "Items in memory")
+    self.assertEqual(stats['items_spilled'], 1, "Items on disk")
+    self.assertEqual(stats['bytes_spilled'], 2*self.values.nbytes, "Size of item with error")
+
+  def test_restore(self):
+    # reloading keeps values, error, unit and dimension
+    x=self.data[0]
+    self.assertEqual(x.tolist(), self.values.tolist(), "Restored values")
+    self.assertEqual(x.error.tolist(), (2.*self.values).tolist(), "Restored errors")
+    self.assertEqual((x.dimension, x.unit), ('x', 'm'), "Restored attributes")
+    self.assertEqual(self.manager.restores, 1, "Restore counter")
+
+  def test_remove(self):
+    del(self.data[0])
+    del(self.data[0])
+    stats=self.manager.statistics()
+    self.assertEqual(stats['bytes_resident']+stats['bytes_spilled'], 0, "Removed items")
+
+class TestSnapshot(unittest.TestCase):
+  '''
+    Check writing and reading of columnar snapshot files.
+  '''
+
+  def setUp(self):
+    from plot_script.measurement_data_structure import MeasurementData
+    self.dataset=MeasurementData()
+    self.dataset.append_column(PhysicalProperty('x', 'm', arange(100.)))
+    self.dataset.append_column(PhysicalProperty('y', 's', arange(100.)**2, ones_like(arange(100.))))
+    self.dataset.short_info='test'
+    handle, self.file_name=mkstemp(suffix='.mdd')
+    os.close(handle)
+
+  def tearDown(self):
+    os.remove(self.file_name)
+
+  def test_reload(self):
+    from plot_script.snapshots import write_snapshot, read_snapshot, is_columnar_snapshot
+    write_snapshot({'data': [self.dataset]}, self.file_name)
+    self.assertTrue(is_columnar_snapshot(self.file_name), "Columnar format")
+    dataset=read_snapshot(self.file_name)['data'][0]
+    self.assertEqual(dataset.short_info, 'test', "Attributes")
+    self.assertEqual(dataset.y.tolist(), self.dataset.y.tolist(), "Values")
+    self.assertEqual(dataset.y.error.tolist(), self.dataset.y.error.tolist(), "Errors")
+    self.assertEqual(str(dataset.y.unit), 's', "Units")
+
+class TestAppend(unittest.TestCase):
+  '''
+    Check point by point construction of MeasurementData objects.
+  '''
+
+  def setUp(self):
+    from plot_script.measurement_data_structure import MeasurementData
+    self.dataset=MeasurementData([['x', 'm'], ['y', 's']], [], 0, 1)
+
+  def test_append(self):
+    for i in range(3000):
+      self.dataset.append((i, (2.*i, 1.)))
+    self.assertEqual(len(self.dataset), 3000, "Buffered length")
+    self.assertEqual(self.dataset.y.tolist(), (2.*arange(3000.)).tolist(), "Values")
+    self.assertEqual(self.dataset.y.error.tolist(), ones_like(arange(3000.)).tolist(), "Errors")
+    self.dataset.append([3000., 6000., 2.])
+    self.assertEqual(self.dataset.y.error[-1], 2., "Appending after read")
+    self.assertRaises(ValueError, self.dataset.append, (1., 2.))
+    self.assertEqual(len(self.dataset.x), 3001, "Error leaves data unchanged")
+
+  def test_extend(self):
+    self.dataset.extend(array([[1., 2.], [3., 4.]]))
+    self.dataset.extend([[5., 6.]])
+    self.assertEqual(self.dataset.x.tolist(), [1., 3., 5.], "Extended values")
+
+class TestExport(unittest.TestCase):
+  '''
+    Check the binary export used for gnuplot.
+  '''
+
+  def setUp(self):
+    from plot_script.measurement_data_structure import MeasurementData
+    self.dataset=MeasurementData()
+    x=array([0., 1., 2.]*2)
+    y=array([0.]*3+[1.]*3)
+    self.dataset.append_column(PhysicalProperty('x', 'm', x))
+    self.dataset.append_column(PhysicalProperty('y', 'm', y))
+    self.dataset.append_column(PhysicalProperty('z', 's', x*y))
+    self.dataset.zdata=2
+    handle, self.file_name=mkstemp(suffix='.dat')
+    os.close(handle)
+
+  def tearDown(self):
+    os.remove(self.file_name)
+
+  def test_binary(self):
+    from numpy import fromfile
+    clause=self.dataset.export_binary(self.file_name)
+    self.assertEqual(clause, 'binary record=3:3 format="%float%float%float"', "Records and format")
+    data=fromfile(self.file_name, dtype=float32).reshape(-1, 3)
+    self.assertEqual(data[:, 2].tolist(), [0., 0., 0., 0., 1., 2.], "Values")
+
+  def test_binary_dtype(self):
+    # one double precision column is enough to export all as double
+    self.dataset.data[2]=PhysicalProperty('z', 's', self.dataset.z, dtype=float64)
+    clause=self.dataset.export_binary(self.file_name)
+    self.assertEqual(clause, 'binary record=3:3 format="%double%double%double"', "Format")
+
+  def test_binary_empty(self):
+    # gnuplot does not accept empty records, the data is written as text
+    self.dataset.filters=[(0, -1., -0.5, True)]
+    self.assertEqual(self.dataset.export_binary(self.file_name), '', "Text export")
+    self.assertTrue(open(self.file_name).read().startswith('#'), "Text header")
+
+  def test_scan_lines(self):
+    # small differences of the coordinates are ignored
+    self.dataset.data[0]=self.dataset.x+array([0., 0., 0., 0.001, 0., 0.])
+    data, split_indices=self.dataset.get_export_data()
+    self.assertEqual(split_indices, [3, 6], "Scan lines")
+    self.assertEqual(data[0].tolist(), [0., 1., 2., 0.001, 1., 2.], "Sort order")
+
+class TestParratt(unittest.TestCase):
+  '''
+    Check the python reflectivity simulation.
+  '''
+
+  def test_fresnel(self):
+    # a bare substrate gives the Fresnel reflectivity
+    from plot_script.sessions.reflectometer_fit.parratt import parratt
+    from numpy import linspace, arcsin, cos, abs as nabs
+    q=linspace(0.001, 0.3, 100)
+    wavelength=1.54
+    n=1.-7.6e-6+1.7e-7j
+    alpha=arcsin(q*wavelength/(4.*pi))
+    kz=sin(alpha)
+    kz_substrate=sqrt(n**2-cos(alpha)**2)
+    fresnel=nabs((kz-kz_substrate)/(kz+kz_substrate))**2
+    reflectivity=parratt(q, wavelength, array([]), array([7.6e-6]), array([1.7e-7]), array([0.]))
+    self.assertTrue((nabs(reflectivity-fresnel)<1e-10).all(), "Fresnel reflectivity")
+
+class TestController(unittest.TestCase):
+  def setUp(self):
+    from plot_script.parallel import Controller
+    self.controller=Controller(2, ['import numpy'])
+
+  def tearDown(self):
+    self.controller.close()
+
+  def test_scatter(self):
+    values=arange(11.)
+    self.controller.scatter('x', values)
+    self.controller.execute('y=x**2')
+    self.assertEqual(self.controller.gather('y').tolist(), (values**2).tolist(), "Shared array")
+    # arrays are pickled where mapped files can't be removed
+    self.controller.share_arrays=False
+    self.controller.scatter('x', values)
+    self.controller.execute('y=x+1.')
+    self.assertEqual(self.controller.gather('y').tolist(), (values+1.).tolist(), "Pickled array")
+    self.controller.scatter('l', range(5))
+    self.assertEqual(self.controller.gather('l'), range(5), "List")
+
+  def test_error(self):
+    from plot_script.parallel import RemoteError
+    self.controller['a']=2
+    self.assertEqual(self.controller['a'], [2, 2], "Items")
+    self.assertRaises(RemoteError, self.controller.execute, 'b=unknown')
+
+class TestImportCache(unittest.TestCase):
+  '''
+    Check storing and eviction of imported datasets.
+  '''
+
+  def setUp(self):
+    from tempfile import mkdtemp
+    from plot_script.measurement_data_structure import MeasurementData
+    from plot_script.import_cache import ImportCache
+    self.cache_dir=mkdtemp()
+    self.cache=ImportCache(self.cache_dir, 1024**2)
+    self.dataset=MeasurementData()
+    self.dataset.append_column(PhysicalProperty('x', 'm', arange(100.)))
+    handle, self.file_name=mkstemp(suffix='.dat')
+    os.write(handle, 'raw data')
+    os.close(handle)
+
+  def tearDown(self):
+    from shutil import rmtree
+    rmtree(self.cache_dir)
+    os.remove(self.file_name)
+
+  def test_cache(self):
+    key=self.cache.key(self.file_name, ['version'], ['options'])
+    self.assertEqual(self.cache.get(key), None, "Empty cache")
+    self.assertTrue(self.cache.put(key, [self.dataset]), "Stored")
+    self.assertEqual(self.cache.get(key)[0].x.tolist(), arange(100.).tolist(), "Values")
+    self.assertNotEqual(self.cache.key(self.file_name, ['version'], ['other']), key, "Options in key")
+    self.cache.evict(0)
+    self.assertEqual(self.cache.get(key), None, "Evicted")
+
+class TestFilterCache(unittest.TestCase):
+  '''
+    Check the recalculation of the cached filtered data.
+  '''
+
+  def setUp(self):
+    from plot_script.measurement_data_structure import MeasurementData
+    self.dataset=MeasurementData()
+    self.dataset.append_column(PhysicalProperty('x', 'm', arange(10.)))
+    self.dataset.append_column(PhysicalProperty('y', 's', arange(10.)**2))
+
+  def test_cache(self):
+    data=self.dataset.get_filtered_data_matrix()
+    self.assertTrue(data is self.dataset.get_filtered_data_matrix(), "Cached matrix")
+    self.dataset.data[1][0]=5.
+    self.assertEqual(self.dataset.get_filtered_data_matrix()[1, 0], 5., "Changed values")
+    self.dataset.filters=[(0, 2., 5., True)]
+    self.assertEqual(self.dataset.get_filtered_column(1).tolist(), [4., 9., 16., 25.], "Filtered column")
+    self.dataset.data[0]=self.dataset.data[0]+1.
+    self.assertEqual(self.dataset.get_filtered_column(1).tolist(), [1., 4., 9., 16.], "Replaced column")
+
+  def test_error_change(self):
+    self.dataset.data[1].error=ones_like(arange(10.))
+    self.assertEqual(self.dataset.get_filtered_data_matrix()[2, 3], 1., "Errors")
+    self.dataset.data[1].error[3]=4.
+    self.assertEqual(self.dataset.get_filtered_data_matrix()[2, 3], 4., "Changed error")
+    error=self.dataset.data[1].error
+    error*=2.
+    self.assertEqual(self.dataset.get_filtered_data_matrix()[2, 3], 8., "Multiplied errors")
+    self.dataset.filters=[(2, 3., 10., True)]
+    self.assertEqual(self.dataset.get_filtered_column(0).tolist(), [3.], "Filtered by error")
+    self.dataset.data[1].error[5]=5.
+    self.assertEqual(self.dataset.get_filtered_column(0).tolist(), [3., 5.], "Filter on changed error")
+
+class TestProjection(unittest.TestCase):
+  '''
+    Check the projections of 3d data.
+  '''
+
+  def setUp(self):
+    from plot_script.measurement_data_structure import MeasurementData
+    self.dataset=MeasurementData()
+    x=array([0., 1., 2., 3.]*2)
+    y=array([0.]*4+[1.]*4)
+    self.dataset.append_column(PhysicalProperty('x', 'm', x))
+    self.dataset.append_column(PhysicalProperty('y', 'm', y))
+    self.dataset.append_column(PhysicalProperty('z', 's', x+4.*y, ones_like(x)))
+    self.dataset.zdata=2
+
+  def test_projections(self):
+    px, pz=self.dataset.get_xprojection(2)
+    self.assertEqual(px.tolist(), [0.75, 2.25], "Bin centers")
+    self.assertEqual(pz.tolist(), [2.5, 4.5], "Mean values")
+    self.assertEqual(pz.error.tolist(), [0.5, 0.5], "Mean errors")
+    self.dataset.plot_options.xrange=[None, 1.5]
+    projections=self.dataset.get_projections(2)
+    self.assertEqual(projections['y']['count'].tolist(), [2, 2], "Points in range")
+    self.assertTrue(projections is self.dataset.get_projections(2), "Cached projections")
+
+class TestSubset(unittest.TestCase):
+  '''
+    Check slicing and indexing of MeasurementData objects.
+  '''
+
+  def setUp(self):
+    from plot_script.measurement_data_structure import MeasurementData
+    self.dataset=MeasurementData()
+    self.dataset.append_column(PhysicalProperty('x', 'm', arange(10.)))
+    self.dataset.append_column(PhysicalProperty('y', 's', arange(10.)**2, ones_like(arange(10.))))
+
+  def test_slice(self):
+    from numpy import may_share_memory
+    subset=self.dataset[2:5]
+    self.assertEqual(subset.y.tolist(), [4., 9., 16.], "Values")
+    self.assertEqual(subset.y.error.tolist(), [1., 1., 1.], "Errors")
+    self.assertTrue(may_share_memory(subset.x, self.dataset.x), "Shared data")
+    # changes are only applied to the subset
+    subset.data[1]*=2.
+    subset.append([5., 50., 1.])
+    self.assertEqual(subset.y.tolist(), [8., 18., 32., 50.], "Changed subset")
+    self.assertEqual(self.dataset.y[2:5].tolist(), [4., 9., 16.], "Unchanged dataset")
+
+  def test_parent_change(self):
+    # the subset keeps its values, when the dataset changes
+    subset=self.dataset[2:5]
+    for i in range(100):
+      self.dataset.append([10.+i, (1., 1.)])
+    self.dataset.data[1]*=2.
+    self.assertEqual(subset.x.tolist(), [2., 3., 4.], "Values after append")
+    self.assertEqual(subset.y.tolist(), [4., 9., 16.], "Values after change")
+    self.assertEqual(self.dataset.y[2:5].tolist(), [8., 18., 32.], "Changed dataset")
+    self.assertRaises(ValueError, subset.x.append, 1.)
+
+  def test_parent_write(self):
+    # the dataset stays writable after slicing
+    subset=self.dataset[2:5]
+    inner=subset[1:3]
+    self.dataset.x=arange(10.)+1.
+    self.dataset.data[1][3]=-1.
+    self.dataset.y.error[2]=5.
+    for col in self.dataset.data:
+      col*=2.
+    self.assertEqual(self.dataset.x[2:5].tolist(), [6., 8., 10.], "Changed x")
+    self.assertEqual(self.dataset.y[2:5].tolist(), [8., -2., 32.], "Changed y")
+    self.assertEqual(self.dataset.y.error[2:5].tolist(), [10., 2., 2.], "Changed errors")
+    self.assertEqual(subset.x.tolist(), [2., 3., 4.], "Subset x")
+    self.assertEqual(subset.y.tolist(), [4., 9., 16.], "Subset y")
+    self.assertEqual(subset.y.error.tolist(), [1., 1., 1.], "Subset errors")
+    self.assertEqual(inner.y.tolist(), [9., 16.], "Slice of the subset")
+    # and the subset only changes itself
+    subset.y.error[0]=3.
+    for col in subset.data:
+      col+=1.
+    self.assertEqual(subset.y.tolist(), [5., 10., 17.], "Changed subset")
+    self.assertEqual(subset.y.error.tolist(), [3., 1., 1.], "Changed subset errors")
+    self.assertEqual(inner.y.tolist(), [9., 16.], "Unchanged slice of the subset")
+    self.assertEqual(self.dataset.y[2:5].tolist(), [8., -2., 32.], "Unchanged dataset")
+    self.assertEqual(self.dataset.y.error[2:5].tolist(), [10., 2., 2.], "Unchanged errors")
+
+  def test_index(self):
+    self.assertEqual(self.dataset[[1, 3]].x.tolist(), [1., 3.], "Indexed values")
+    self.assertEqual(self.dataset[self.dataset.x.view(ndarray)>7.].x.tolist(), [8., 9.], "Masked values")
+
+class TestAsciiImport(unittest.TestCase):
+  '''
+    Check the conversion of data lines by the ascii import filter.
+  '''
+
+  def setUp(self):
+    from plot_script.read_data import AsciiImportFilter
+    self.import_filter=AsciiImportFilter('test')
+    self.import_filter._bad_lines=[]
+
+  def test_ragged_lines(self):
+    # the number of values fits, but not the lines
+    data=self.import_filter._extract_data(["1 2", "3 4 5", "6", "7 8"])
+    self.assertEqual(data.tolist(), [[1., 2.], [7., 8.]], "Valid lines")
+    self.assertEqual([item[1] for item in self.import_filter._bad_lines], [1, 2], "Reported lines")
+
+  def test_streaming(self):
+    # reading the file in small blocks gives the same result
+    import plot_script.read_data as read_data
+    lines=['# comment']+['%i %i'%(i, i*i) for i in range(20)]
+    lines[12]='11 x'
+    handle, file_name=mkstemp(suffix='.dat')
+    os.write(handle, '\n'.join(lines)+'\n')
+    os.close(handle)
+    try:
+      self.import_filter.header_lines.value=0
+      dataset=self.import_filter._read_all(file_name)[0]
+      bad_lines=self.import_filter._bad_lines
+      streamed=list(self.import_filter.iter_read_data(file_name, chunk_size=16, block_lines=3))
+      self.assertEqual(len(streamed), 1, "Sequences")
+      self.assertEqual(streamed[0].y.tolist(), dataset.y.tolist(), "Values")
+      self.assertEqual(self.import_filter._bad_lines, bad_lines, "Bad line numbers")
+      self.assertEqual(bad_lines, [(0, 11, '11 x')], "Reported line")
+      # large files are read in streaming mode
+      streaming_size=read_data.STREAMING_FILE_SIZE
+      read_data.STREAMING_FILE_SIZE=0
+      try:
+        self.assertEqual(self.import_filter.read_data(file_name)[0].y.tolist(), dataset.y.tolist(),
+                         "Streaming import")
+      finally:
+        read_data.STREAMING_FILE_SIZE=streaming_size
+    finally:
+      os.remove(file_name)
+
+class TestFitJacobian(unittest.TestCase):
+  def check_jacobian(self, fit_class, parameters):
+    # compare the analytic derivatives with central differences
+    from numpy import linspace, zeros, abs as nabs
+    function=fit_class(parameters)
+    x=linspace(1., 3., 21)
+    jacobian=function.fit_jacobian(parameters, x)
+    self.assertEqual(jacobian.shape, (len(x), len(parameters)), fit_class.__name__+" shape")
+    for i in range(len(parameters)):
+      step=zeros(len(parameters))
+      step[i]=1e-6*max(1., abs(parameters[i]))
+      numeric=(function.fit_function(array(parameters)+step, x)-
+               function.fit_function(array(parameters)-step, x))/(2.*step[i])
+      # the magnitude of the derivatives depends on the function
+      scale=max(nabs(numeric).max(), 1e-300)
+      self.assertTrue((nabs(jacobian[:, i]-numeric)<=1e-5*(scale+nabs(numeric))).all(),
+                      "%s parameter %s"%(fit_class.__name__, function.parameter_names[i]))
+
+  def test_jacobians(self):
+    import plot_script.fit_data as fit_data
+    self.check_jacobian(fit_data.FitLinear, [1.5, -0.3])
+    self.check_jacobian(fit_data.FitQuadratic, [0.5, -1.2, 0.3])
+    self.check_jacobian(fit_data.FitPowerlaw, [1.5, 0.2, 2.3, 0.1])
+    self.check_jacobian(fit_data.FitExponential, [1.5, 0.5, 0.1])
+    self.check_jacobian(fit_data.FitOneOverX, [1.5, 0.2, 0.1])
+    self.check_jacobian(fit_data.FitGaussian, [2., 1.5, 0.7, 0.1])
+    self.check_jacobian(fit_data.FitLorentzian, [2., 1.5, 0.7, 0.1])
+    self.check_jacobian(fit_data.FitVoigt, [2., 1.5, 0.3, 0.4, 0.1])
+    self.check_jacobian(fit_data.FitBrillouineB, [1e22, 2., 2., 3.])
+    self.check_jacobian(fit_data.FitBrillouineT, [1e22, 2., 2., 3., 0.1])
+
+class TestPolarizationCorrection(unittest.TestCase):
+  channels=['++', '+-', '-+', '--']
+
+  def setUp(self):
+    from numpy import linspace
+    self.S={
+            '++': linspace(1., 0.1, 5),
+            '+-': linspace(0.01, 0.05, 5),
+            '-+': linspace(0.02, 0.04, 5),
+            '--': linspace(0.8, 0.2, 5),
+            }
+    self.P={'F1': linspace(0.9, 0.99, 5), 'F2': 0.95, 'p1': 0.02, 'p2': linspace(0.01, 0.05, 5)}
+
+  def test_round_trip(self):
+    from plot_script.sessions.treff import wildes_matrix, calc_intensities_general, solve_polarization
+    from numpy import allclose
+    I=calc_intensities_general(self.S, self.P)
+    intensities=array([I[key] for key in self.channels]).transpose()
+    S, errors=solve_polarization(wildes_matrix(self.P), intensities, sqrt(intensities))
+    for i, key in enumerate(self.channels):
+      self.assertTrue(allclose(S[:, i], self.S[key]), "Channel "+key)
+    self.assertEqual(errors.shape, (5, 4), "Error shape")
+
+  def test_singular(self):
+    from plot_script.sessions.treff import wildes_matrix, solve_polarization
+    from numpy import isnan, ones
+    # a polarizer with 50% efficiency mixes the channels irreversibly
+    P=dict(self.P)
+    P['p1']=array([0.02, 0.5, 0.02, 0.02, 0.02])
+    S, ignore=solve_polarization(wildes_matrix(P), ones((5, 4)))
+    self.assertEqual(isnan(S).all(axis=1).tolist(), [False, True, False, False, False], "Singular point")
+    P['p1']=0.5
+    S, ignore=solve_polarization(wildes_matrix(P), ones((5, 4)))
+    self.assertTrue(isnan(S).all(), "Singular matrix for all points")
+
+  def test_seperate_scattering(self):
+    from plot_script.sessions.treff import calc_intensities, seperate_scattering
+    from plot_script.measurement_data_structure import MeasurementData
+    from numpy import allclose
+    P={'polarizer': 0.97, 'flipper1': 0.99, 'flipper2': 0.98, 'analyzer': 0.96}
+    keys=['++', '--', '+-', '-+']
+    intensities=calc_intensities(self.S, P)
+    datasets=[]
+    for key in keys:
+      dataset=MeasurementData(zdata=-1)
+      dataset.append_column(PhysicalProperty('x', '', range(5)))
+      dataset.append_column(PhysicalProperty('I', '', intensities[key]))
+      datasets.append(dataset)
+    R=seperate_scattering(datasets, P)
+    total=array([self.S[key] for key in keys]).sum(axis=0)
+    for i, key in enumerate(keys):
+      self.assertTrue(allclose(R[i], self.S[key]/total, rtol=1e-5), "Channel "+key)
+
+class TestBatchExport(unittest.TestCase):
+  def setUp(self):
+    from plot_script.sessions.generic import GenericSession
+    from plot_script import measurement_data_structure
+    # the session replaces the temporary folder of the data structures
+    self.temp_dir=measurement_data_structure.TEMP_DIR
+    self.session=GenericSession(None)
+    self.session.file_data={'b.dat': [MeasurementData(), MeasurementData()], 'a.dat': [MeasurementData()]}
+
+  def tearDown(self):
+    from plot_script import measurement_data_structure
+    self.session.os_cleanup()
+    measurement_data_structure.TEMP_DIR=self.temp_dir
+
+  def test_options(self):
+    files=self.session.read_arguments(['-export', '[name]_[nr].png', '-export-workers', '3', 'a.dat'])
+    self.assertEqual(files, ['a.dat'], "Input files")
+    self.assertEqual(self.session.export_naming, '[name]_[nr].png', "Naming pattern")
+    self.assertEqual(self.session.export_workers, 3, "Workers")
+    self.assertFalse(self.session.use_gui, "No GUI")
+
+  def test_items(self):
+    items=self.session.get_export_items()
+    self.assertEqual([item[0] for item in items], ['a.dat', 'b.dat', 'b.dat'], "File order")
+    self.assertTrue(items[2][1] is self.session.file_data['b.dat'][1], "Datasets")
+
+  def test_requests_in_flight(self):
+    # the data of a plot is only exported when a gnuplot process is free soon
+    import plot_script.measurement_data_plotting as mdp
+    class Finished(object):
+      def __init__(self, callback):
+        self.callback=callback
+      def wait(self):
+        if self.callback is not None:
+          in_flight[0]-=1
+          self.callback('', [])
+          self.callback=None
+    class Request(object):
+      def __init__(self, callback):
+        self.finished=Finished(callback)
+    class Pool(object):
+      workers=[None, None]
+    def plot_script(*args, **opts):
+      in_flight[0]+=1
+      in_flight[1]=max(in_flight[1], in_flight[0])
+      return Request(opts['callback'])
+    in_flight=[0, 0]
+    items=[('a.dat', MeasurementData()) for ignore in range(6)]
+    self.session.get_export_items=lambda: items
+    pool, gnuplot_plot_script=mdp.gnuplot_pool, mdp.gnuplot_plot_script
+    mdp.gnuplot_pool, mdp.gnuplot_plot_script=Pool(), plot_script
+    try:
+      self.assertEqual(self.session.export_all(), [], "Failed plots")
+    finally:
+      mdp.gnuplot_pool, mdp.gnuplot_plot_script=pool, gnuplot_plot_script
+    self.assertEqual(in_flight, [0, 3], "Requests in flight")
+
+class TestRenderCache(unittest.TestCase):
+  def setUp(self):
+    self.dataset=MeasurementData()
+    self.dataset.append_column(PhysicalProperty('x', 'm', arange(10.)))
+    self.dataset.append_column(PhysicalProperty('y', 'm', arange(10.)**2))
+
+  def test_data_hash(self):
+    from plot_script.render_cache import data_hash
+    key=data_hash([self.dataset])
+    self.assertEqual(data_hash([self.dataset]), key, "Unchanged data")
+    self.dataset.y*=2.
+    self.assertNotEqual(data_hash([self.dataset]), key, "Changed column")
+    key=data_hash([self.dataset])
+    self.dataset.filters=[(0, 2., 5., True)]
+    self.assertNotEqual(data_hash([self.dataset]), key, "Changed filters")
+
+  def test_prefetch_later(self):
+    # the plot is prepared by the dispatched function and then submitted
+    from plot_script.render_cache import RenderCache, RenderPrefetcher
+    class Pool(object):
+      script=None
+      def submit(self, gnuplot_file_text, callback, priority, file_prefix):
+        self.script=gnuplot_file_text
+    dispatched=[]
+    pool=Pool()
+    prefetcher=RenderPrefetcher(pool, RenderCache(), lambda *args: dispatched.append(args))
+    prefetcher.prefetch_later('key', lambda: ('plot x', 'image.png'), 'tmp_prefetch_')
+    self.assertTrue('key' in prefetcher.pending, "Pending key")
+    self.assertEqual(pool.script, None, "Not prepared before dispatch")
+    function=dispatched[0][0]
+    function(*dispatched[0][1:])
+    self.assertEqual(pool.script, 'plot x', "Submitted script")
+
+class TestFitBatch(unittest.TestCase):
+  def create_dataset(self, x, y, z=None):
+    dataset=MeasurementData(zdata=-1)
+    dataset.append_column(PhysicalProperty('x', '', x))
+    dataset.append_column(PhysicalProperty('y', '', y))
+    if z is not None:
+      dataset.append_column(PhysicalProperty('z', '', z))
+      dataset.zdata=2
+    return dataset
+
+  def test_linear(self):
+    from plot_script.fit_data import FitSession, fit_batch
+    x=arange(10.)
+    datasets=[self.create_dataset(x, i*x+1.) for i in range(4)]
+    # a fit with less points than parameters is reported as failed
+    datasets[2]=self.create_dataset(x[:1], x[:1])
+    template=FitSession(datasets[0])
+    template.add_function('Linear Regression')
+    result=fit_batch(datasets, template, processes=2)
+    self.assertEqual(result.x.tolist(), [0., 1., 3.], "Successful fits")
+    self.assertTrue(abs(result.y-array([0., 1., 3.])).max()<1e-4, "Slopes")
+
+  def test_3d(self):
+    from plot_script.fit_data import FitSession, fit_batch
+    from numpy import meshgrid, exp, linspace
+    x, y=meshgrid(linspace(-1., 1., 15), linspace(-1., 1., 15))
+    x=x.flatten()
+    y=y.flatten()
+    datasets=[self.create_dataset(x, y, 2.*exp(-0.5*((x-x0)**2+y**2)/0.3**2))
+              for x0 in [-0.2, 0.2]]
+    template=FitSession(datasets[0])
+    template.add_function('Gaussian')
+    template.functions[0][0].parameters=[1.5, 0., 0., 0.25, 0.25, 0., 0.]
+    result=fit_batch(datasets, template, processes=1)
+    self.assertEqual(len(result), 2, "Fits")
+    self.assertTrue(abs(result.data[2]-array([-0.2, 0.2])).max()<1e-3, "Peak positions")
+    self.assertRaises(ValueError, fit_batch, [self.create_dataset(x, y)], template)
+
+class TestInterpolation(unittest.TestCase):
+  def reference(self, x, y, z, dzq, sigma_x, sigma_y, grid_x, grid_y, fill_value):
+    # point by point loop of the original implementation
+    from numpy import exp, where
+    zout=[]
+    dzout=[]
+    for xi in grid_x:
+      distances_x=abs(x-xi)
+      indices_x=where(distances_x<3.*sigma_x)[0]
+      for yi in grid_y:
+        distances_y=abs(y[indices_x]-yi)
+        sub_indices=where(distances_y<3.*sigma_y)[0]
+        indices=indices_x[sub_indices]
+        if len(indices)==0:
+          zout.append(fill_value[0])
+          dzout.append(fill_value[1])
+          continue
+        factors=exp(-0.5*distances_x[indices]**2/sigma_x**2-0.5*distances_y[sub_indices]**2/sigma_y**2)
+        scale=1./factors.sum()
+        zout.append((z[indices]*factors).sum()*scale)
+        dzout.append(sqrt((dzq[indices]*factors).sum())*scale)
+    return array(zout), array(dzout)
+
+  def test_random_points(self):
+    from plot_script.gtkgui.file_actions import interpolate_and_smooth
+    from numpy import random, linspace, round as nround, allclose, isinf, nan_to_num, where
+    random.seed(5)
+    # unsorted points with duplicate x-values
+    x=nround(random.uniform(0., 10., 400), 1)
+    y=random.uniform(-5., 5., 400)
+    z=random.uniform(0., 100., 400)
+    dataset=MeasurementData(zdata=2)
+    dataset.append_column(PhysicalProperty('x', '', x))
+    dataset.append_column(PhysicalProperty('y', '', y))
+    dataset.append_column(PhysicalProperty('z', '', z, sqrt(z)))
+    grid_x=linspace(-1., 11., 25)
+    grid_y=linspace(-6., 6., 19)
+    data=dataset.get_filtered_data_matrix()
+    dzq=dataset.z.error**2
+    dzq=where(isinf(dzq), nan_to_num(dzq), 1.)
+    zref, dzref=self.reference(data[0], data[1], data[2], dzq, 0.3, 0.5, grid_x, grid_y, (0., 1.))
+    for processes in [1, 2]:
+      output=interpolate_and_smooth(dataset, 0.3, 0.5, grid_x, grid_y, processes=processes)
+      self.assertEqual(len(output), len(grid_x)*len(grid_y), "Grid points")
+      self.assertTrue(allclose(output.x, grid_x.repeat(len(grid_y))), "Grid x")
+      self.assertTrue(allclose(array(output.z), zref, rtol=1e-5), "Values")
+      self.assertTrue(allclose(array(output.z.error), dzref, rtol=1e-5), "Errors")
+
+class TestSortAndBin(unittest.TestCase):
+  def reference(self, data, binning, gauss_weighting=False, sigma_gauss=1e10, bin_distance=None):
+    # loop of the original implementation
+    from math import exp
+    data.sort()
+    dat_tmp=[]
+    def gauss_sum(data_list):
+      output=0.
+      for i, dat in enumerate(data_list):
+        output+=dat*exp(-din[i][-1]**2/(2*sigma_gauss**2))
+      return output
+    if bin_distance is not None:
+      bin_dist_position=int(data[0][0]/bin_distance)
+      din=[]
+    for i, point in enumerate(data):
+      if bin_distance is not None:
+        if point[0]<=bin_distance*(bin_dist_position+0.5):
+          din.append([bin_dist_position*bin_distance]+point[1:])
+        else:
+          while point[0]>bin_distance*(bin_dist_position+0.5):
+            bin_dist_position+=1
+          din=[[bin_dist_position*bin_distance]+point[1:]]
+        if (i+1)==len(data) or data[i+1][0]<=bin_distance*(bin_dist_position+0.5):
+          continue
+      else:
+        if i%binning==0:
+          din=[point]
+        else:
+          din.append(point)
+        if (i+1)%binning!=0:
+          continue
+      dout=[]
+      if gauss_weighting:
+        g_sum=gauss_sum([1 for d in din])
+        for j in range(4):
+          dout.append(gauss_sum([d[j] for d in din])/g_sum)
+        if len(din[0])>5:
+          dout.append(sqrt(gauss_sum([d[4]**2 for d in din]))/g_sum)
+        dout.append(g_sum/len(din))
+      else:
+        for j in range(4):
+          dout.append(sum([d[j] for d in din])/len(din))
+        if len(din[0])>5:
+          dout.append(sqrt(sum([d[4]**2 for d in din]))/len(din))
+        dout.append(sum([d[-1] for d in din])/len(din))
+      dat_tmp.append(dout)
+    return dat_tmp
+
+  def setUp(self):
+    from plot_script.gtkgui.file_actions import FileActions
+    from numpy import random, round as nround
+    random.seed(7)
+    # the method doesn't use the window of the FileActions object
+    self.sort_and_bin=FileActions.sort_and_bin.im_func
+    # unsorted points with duplicate x0 values and gaps in x0
+    x0=nround(random.uniform(0., 10., 200), 1)
+    x0=x0[(x0<4.)|(x0>6.)]
+    N=len(x0)
+    self.data=array([x0, random.uniform(0., 1., N), random.uniform(0., 1., N),
+                     random.uniform(0., 100., N), random.uniform(0.1, 1., N),
+                     random.uniform(-1., 1., N)]).transpose()
+
+  def compare(self, data, *args):
+    from numpy import allclose
+    output=self.sort_and_bin(None, data.copy(), *args)
+    reference=array(self.reference(data.tolist(), *args))
+    self.assertEqual(output.shape, reference.shape, "Number of bins %s"%(args,))
+    self.assertTrue(allclose(output, reference), "Values %s"%(args,))
+
+  def test_binning(self):
+    self.compare(self.data, 3)
+    self.compare(self.data, 4, True, 0.5)
+    # without errors
+    self.compare(self.data[:, :5], 3)
+
+  def test_bin_distance(self):
+    # the bins between 4 and 6 are empty and skipped
+    self.compare(self.data, 1, False, 1e10, 0.5)
+    self.compare(self.data, 1, True, 0.5, 0.25)
+    self.compare(self.data[:, :5], 1, False, 1e10, 0.3)
+
+class TestGnuplotPool(unittest.TestCase):
+  # minimal replacement of the gnuplot program, which understands print and pause
+  fake_gnuplot="""#!%s
+import sys, time
+while True:
+  line=sys.stdin.readline()
+  if line=='' or line.strip()=='exit':
+    break
+  line=line.strip()
+  if line.startswith('print '):
+    sys.stdout.write(line[6:].strip('"')+'\\n')
+    sys.stdout.flush()
+  elif line.startswith('pause '):
+    time.sleep(float(line[6:]))
+  elif line=='crash':
+    sys.exit(1)
+"""
+
+  def setUp(self):
+    import sys
+    from plot_script.measurement_data_plotting import GnuplotPool
+    handle, self.command=mkstemp(suffix='.py')
+    os.write(handle, self.fake_gnuplot%sys.executable)
+    os.close(handle)
+    os.chmod(self.command, 0755)
+    self.pool=GnuplotPool(self.command, 1)
+
+  def tearDown(self):
+    self.pool.close()
+    os.remove(self.command)
+
+  def test_order(self):
+    finished=[]
+    # keep the worker busy until all requests are queued
+    first=self.pool.submit('pause 0.2', lambda output, variables: finished.append('first'))
+    requests=[self.pool.submit('print "%i"'%i, lambda output, variables: finished.append(variables),
+                               priority=priority) for i, priority in enumerate([1, 0, 1, 0])]
+    for request in [first]+requests:
+      request.wait(5.)
+    self.assertEqual(finished, ['first', [1.], [3.], [0.], [2.]], "Priority and queue order")
+
+  def test_timeout_restart(self):
+    output, ignore=self.pool.render('pause 5', timeout=0.3)
+    self.assertTrue('did not finish' in output, "Timeout")
+    self.assertEqual(self.pool.render('print "1.5"'), ('', [1.5]), "Restarted after timeout")
+    output, ignore=self.pool.render('crash')
+    self.assertTrue('closed' in output, "Crash reported")
+    self.assertEqual(self.pool.render('print "2"'), ('', [2.]), "Restarted after crash")
+
+  def test_errors(self):
+    # failing callbacks and gnuplot starts finish the requests and keep the pool running
+    def callback(output, variables):
+      raise ValueError, 'callback error'
+    self.assertTrue(self.pool.submit('print "1"', callback).wait(5.)[1]==[1.], "Failing callback")
+    worker=self.pool.workers[0]
+    worker.kill(timed_out=False)
+    worker.command=self.command+'_missing'
+    request=self.pool.submit('print "1"')
+    output, ignore=request.wait(5.)
+    self.assertTrue(request.finished.is_set(), "Finished")
+    self.assertTrue(output.startswith('could not start gnuplot'), "Start error")
+    worker.command=self.command
+    self.assertEqual(self.pool.render('print "3"'), ('', [3.]), "Worker alive")
 
 class TestBla(unittest.TestCase):
   pass
@@ -86,5 +866,24 @@ if __name__=='__main__':
   #unittest.main()
   loader=unittest.TestLoader()
   suite=loader.loadTestsFromTestCase(TestPhysicalProperty)
+  suite.addTest(loader.loadTestsFromTestCase(TestBufferList))
+  suite.addTest(loader.loadTestsFromTestCase(TestSnapshot))
+  suite.addTest(loader.loadTestsFromTestCase(TestAppend))
+  suite.addTest(loader.loadTestsFromTestCase(TestExport))
+  suite.addTest(loader.loadTestsFromTestCase(TestParratt))
+  suite.addTest(loader.loadTestsFromTestCase(TestController))
+  suite.addTest(loader.loadTestsFromTestCase(TestImportCache))
+  suite.addTest(loader.loadTestsFromTestCase(TestFilterCache))
+  suite.addTest(loader.loadTestsFromTestCase(TestProjection))
+  suite.addTest(loader.loadTestsFromTestCase(TestSubset))
+  suite.addTest(loader.loadTestsFromTestCase(TestAsciiImport))
+  suite.addTest(loader.loadTestsFromTestCase(TestFitJacobian))
+  suite.addTest(loader.loadTestsFromTestCase(TestPolarizationCorrection))
+  suite.addTest(loader.loadTestsFromTestCase(TestBatchExport))
+  suite.addTest(loader.loadTestsFromTestCase(TestRenderCache))
+  suite.addTest(loader.loadTestsFromTestCase(TestFitBatch))
+  suite.addTest(loader.loadTestsFromTestCase(TestInterpolation))
+  suite.addTest(loader.loadTestsFromTestCase(TestSortAndBin))
+  suite.addTest(loader.loadTestsFromTestCase(TestGnuplotPool))
   suite.addTest(loader.loadTestsFromTestCase(TestBla))
   unittest.TextTestRunner(verbosity=2).run(suite)